@@ -13,12 +13,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'website.settings')
 django_asgi_app = get_asgi_application()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
+from .core.http.lifespan import lifespan_application
 from .websockets import QrLoginConsumer
 from .websockets import UserConsumer
 from .websockets import ShareConsumer
 
 application = ProtocolTypeRouter({
     'http': django_asgi_app,
+    'lifespan': lifespan_application,
     'websocket': URLRouter([
         path('user', UserConsumer.as_asgi()),
         path('qrcode', QrLoginConsumer.as_asgi()),
@@ -1,24 +1,39 @@
 import base64
-import time
-from datetime import datetime, timedelta
+from typing import Optional
 
 from django.core.exceptions import ImproperlyConfigured
 from rest_framework.throttling import UserRateThrottle
 
-from website.constants import cache
+from website.constants import FAILED_REQUESTS_LIMIT, FAILED_REQUESTS_WINDOW
+from website.core import ratelimit
 from website.core.helpers import get_ip
+from website.core.ratelimit import RateLimitGuard, RateLimitResult
+
+
+def get_failed_requests_key(request) -> str:
+    if request.user.is_authenticated:
+        return f"fail:{request.user.pk}"
+
+    ip, _ = get_ip(request)
+    return f"fail_ip:{ip}"
+
+
+def get_failed_requests_guard(request) -> RateLimitGuard:
+    return RateLimitGuard(key=get_failed_requests_key(request), limit=FAILED_REQUESTS_LIMIT, period=FAILED_REQUESTS_WINDOW)
 
 
 class MyUserRateThrottleBase(UserRateThrottle):
+    """
+    Every scope is a GCRA bucket in redis (see core.ratelimit), checked together with
+    the user's failed requests bucket in a single atomic round trip.
+    """
     scope = None
     bucket = None
 
     def __init__(self):
         super().__init__()
-        self.fail_block = 30
-        self.fail_limit = 100
-        self.fail_count = None
         self.request = None
+        self.result: Optional[RateLimitResult] = None
         self.bucket = base64.b64encode(self.scope.encode()).decode().rstrip("=")
 
     def get_cache_key(self, request, view):
@@ -30,20 +45,17 @@ class MyUserRateThrottleBase(UserRateThrottle):
     def allow_request(self, request, view):
         self.request = request
 
-        # STEP 1. Check general rate limit
-        # allow_request already calls throttle_failure() or throttle_success()
-        # so we should be careful not to call it again. Especially because calling
-        # throttle_success() twice will lead to doubling the history records
-        user_allowed = super().allow_request(request, view)
-        if not user_allowed:
-            return self.throttle_failure()
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
 
-        # STEP 2. Check failed attempts (custom logic)
-        remaining_failed_requests = self.get_remaining_failed_requests()
-        if remaining_failed_requests <= 0:
-            return self.throttle_failure()
+        self.result = ratelimit.hit(self.key, self.num_requests, self.duration, guard=get_failed_requests_guard(request))
+        self.apply_ratelimit_headers()
 
-        return user_allowed
+        return self.result.allowed
 
     def parse_rate(self, rate):
         if rate is None:
@@ -60,93 +72,19 @@ class MyUserRateThrottleBase(UserRateThrottle):
         return num_requests, duration_time
 
     def apply_ratelimit_headers(self):
-        self.request.META["rate_limit_remaining"] = min(self.get_remaining_requests(), self.get_remaining_failed_requests())
+        self.request.META["rate_limit_remaining"] = self.result.remaining
         self.request.META["rate_limit_reset_after"] = round(self.wait(), 4)
         self.request.META["rate_limit_bucket"] = self.bucket
 
-    def throttle_failure(self):
-        self.apply_ratelimit_headers()
-        return super().throttle_failure()
-
-    def throttle_success(self):
-        self.apply_ratelimit_headers()
-        return super().throttle_success()
-
     def wait(self):
-        if self.get_remaining_failed_requests() <= 0:
-            fail_key = self._get_fail_key(self.request)
-            fail_data = cache.get(fail_key, [])
-            now = time.time()
-
-            recent_fails = sorted(t for t in fail_data if now - t < self.fail_block)
-            fail_count = len(recent_fails)
-
-            if fail_count < self.fail_limit / 2:
-                return 0
-
-            # How many fails must expire to be below half
-            target_fails = int(fail_count - (self.fail_limit // 2)) + 1
-            fail_to_expire = recent_fails[:target_fails][-1]
-            wait_time = max((fail_to_expire + self.fail_block) - now, 0)
-
-            return wait_time
-
-        return self.get_reset_time()
-
-    def get_reset_time(self):
-        """
-        Calculate the time when the rate limit bucket resets, in seconds.
-        """
-        if self.rate is None:
-            return None  # No limit
-
-        if not hasattr(self, 'history') or not hasattr(self, 'now'):
-            raise AttributeError("This method should be called after `allow_request` method.")
-
-        if not self.history:  # If history is empty, no requests have been made yet
-            return self.duration  # Reset time is the duration itself, in seconds
-
-        # Convert the float timestamp to a datetime object
-        last_request_time = datetime.fromtimestamp(self.history[-1])
-
-        # Calculate the time when the rate limit resets
-        reset_time = last_request_time + timedelta(seconds=self.duration)
-
-        # Calculate the total number of seconds until the reset time relative to the current time
-        seconds_until_reset = (reset_time - datetime.now()).total_seconds()
-
-        # Return the reset time in seconds
-        return seconds_until_reset
-
-    def get_remaining_failed_requests(self):
-        """
-        Returns the number of remaining requests in the global fail bucket before the limit is hit.
-        """
-        fail_key = self._get_fail_key(self.request)
-        fail_data = cache.get(fail_key, [])
-        now = time.time()
-
-        recent_fails = [t for t in fail_data if now - t < self.fail_block]
-        return max(self.fail_limit - len(recent_fails), 0)
-
-    def get_remaining_requests(self):
-        """
-        Returns the number of remaining requests before the limit is hit.
-        """
-        if self.rate is None:
-            return float('inf')
-
-        if not hasattr(self, 'history') or not hasattr(self, 'now'):
-            raise AttributeError("This method should be called after `allow_request` method.")
+        if self.result is None:
+            return None
 
-        return max(self.num_requests - len(self.history), 0)
+        if not self.result.allowed:
+            return self.result.retry_after
 
-    def _get_fail_key(self, request):
-        if request.user.is_authenticated:
-            return f"fail:{request.user.pk}"
+        return self.result.reset_after
 
-        ip, _ = get_ip(request)
-        return f"fail_ip:{ip}"
 
 class defaultAnonUserThrottle(MyUserRateThrottleBase):
     scope = 'anon'
@@ -13,7 +13,7 @@ app.autodiscover_tasks()
 @app.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
     from .tasks.cleanupTasks import run_cleanup  # fix for circular import error
-    from .tasks.otherTasks import generate_raw_image_thumbnails
+    from .tasks.otherTasks import generate_raw_image_thumbnails, reconcile_folder_aggregates
     from .tasks.deleteCleanupTasks import supervise_deletion_system
 
     # Executes every 1 minute.
@@ -34,6 +34,12 @@ def setup_periodic_tasks(sender, **kwargs):
         run_cleanup.s(),
     )
 
+    # Executes every hour.
+    sender.add_periodic_task(
+        crontab(minute="30"),
+        reconcile_folder_aggregates.s(),
+    )
+
 
 
 
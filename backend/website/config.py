@@ -20,6 +20,9 @@ DEFAULT_CONFIG = {
     "MAX_THUMBNAIL_SIZE": int(0.5 * 1024 * 1024),
     "GENERATE_RAW_THUMBNAILS": True,
     "MAX_RAW_IMAGE_SIZE_ALLOWED_FOR_CONVERSION": 75 * 1024 * 1024,
+    "MAX_STREAM_READ_AHEAD_FRAGMENTS": 4,
+    "FRAGMENT_CACHE_DIR": None,
+    "FRAGMENT_CACHE_MAX_SIZE": 10 * 1024 * 1024 * 1024,
 }
 
 
@@ -50,6 +53,8 @@ def validate_config(config):
         "TOKEN_EXPIRY_DAYS",
         "MAX_THUMBNAIL_SIZE",
         "MAX_RAW_IMAGE_SIZE_ALLOWED_FOR_CONVERSION",
+        "MAX_STREAM_READ_AHEAD_FRAGMENTS",
+        "FRAGMENT_CACHE_MAX_SIZE",
     ]
 
     for key in positive_int_keys:
@@ -68,6 +73,9 @@ def validate_config(config):
     if not isinstance(config["GENERATE_RAW_THUMBNAILS"], bool):
         raise ValueError("GENERATE_RAW_THUMBNAILS must be true or false")
 
+    if config["FRAGMENT_CACHE_DIR"] is not None and not isinstance(config["FRAGMENT_CACHE_DIR"], str):
+        raise ValueError("FRAGMENT_CACHE_DIR must be a path or null")
+
 
 CONFIG = load_config()
 
@@ -84,4 +92,7 @@ TOKEN_EXPIRY_DAYS = CONFIG["TOKEN_EXPIRY_DAYS"]
 MAX_RESOURCE_NAME_LENGTH = CONFIG["MAX_RESOURCE_NAME_LENGTH"]
 MAX_THUMBNAIL_SIZE = CONFIG["MAX_THUMBNAIL_SIZE"]
 GENERATE_RAW_THUMBNAILS = CONFIG["GENERATE_RAW_THUMBNAILS"]
-MAX_RAW_IMAGE_SIZE_ALLOWED_FOR_CONVERSION = CONFIG["MAX_RAW_IMAGE_SIZE_ALLOWED_FOR_CONVERSION"]
\ No newline at end of file
+MAX_RAW_IMAGE_SIZE_ALLOWED_FOR_CONVERSION = CONFIG["MAX_RAW_IMAGE_SIZE_ALLOWED_FOR_CONVERSION"]
+MAX_STREAM_READ_AHEAD_FRAGMENTS = CONFIG["MAX_STREAM_READ_AHEAD_FRAGMENTS"]
+FRAGMENT_CACHE_DIR = CONFIG["FRAGMENT_CACHE_DIR"]
+FRAGMENT_CACHE_MAX_SIZE = CONFIG["FRAGMENT_CACHE_MAX_SIZE"]
\ No newline at end of file
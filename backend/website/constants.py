@@ -19,6 +19,19 @@ MAX_MEDIA_CACHE_AGE = 2628000
 # Discord message cache expiry in seconds: 1 day
 DISCORD_MESSAGE_EXPIRY = 79200
 
+# How long a discord request waits for a free bot/webhook before giving up, in seconds
+DISCORD_ACQUIRE_WAIT = 10
+
+# Longest a discord request waiting in line sleeps before rechecking on its own, in seconds.
+# Releases wake waiters right away, this only covers rate limits running out and lost wake ups
+DISCORD_ACQUIRE_POLL_INTERVAL = 1
+
+# How long an acquired bot/webhook counts as in flight if it's never released (worker died mid request), in seconds
+DISCORD_CREDENTIAL_LEASE_TTL = 120
+
+# How many of the latest credential wait times are kept per user for the p50/p99 stats
+DISCORD_ACQUIRE_WAIT_SAMPLES = 1000
+
 # How long the resource urls are valid for, 2 hours
 SIGNED_URL_EXPIRY_SECONDS = 7200
 
@@ -43,6 +56,57 @@ MAX_FILES_IN_ZIP = 10_000
 # How long the zip download url is valid for, 6 hours
 ZIP_EXPIRY_SECONDS = 21600
 
+# How many zip entries get their fragments loaded in a single query while streaming a zip
+ZIP_FRAGMENT_QUERY_BATCH_SIZE = 200
+
+# Folder listing page size when the client doesn't ask for one, and the most it may ask for
+FOLDER_LISTING_PAGE_SIZE = 200
+FOLDER_LISTING_MAX_PAGE_SIZE = 1000
+
+# How many folder listing entries are serialized into one chunk of the streamed response
+FOLDER_LISTING_STREAM_BATCH = 100
+
+# How many fragments past the ones currently being downloaded get their urls warmed in the background
+URL_WARM_AHEAD_FRAGMENTS = 5
+
+# How often every worker re-scans the shared fragment cache directory to enforce its byte budget, in seconds
+FRAGMENT_CACHE_RESCAN_INTERVAL = 60
+
+# Temp files in the fragment cache untouched for this long are leftovers of crashed writes, in seconds
+FRAGMENT_CACHE_STALE_TMP_AGE = 600
+
+# Max bytes buffered for a single read-ahead fragment while it waits to be streamed, 4 MiB
+STREAM_FRAGMENT_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Streamed bytes are packed into chunks of about this size before they are handed to the server, 512 KiB
+STREAM_OUTPUT_CHUNK_SIZE = 512 * 1024
+
+# Max websocket events waiting to be published per process, the oldest ones are dropped past this
+WS_DISPATCH_QUEUE_SIZE = 10_000
+
+# How many websocket events are published to the channel layer concurrently
+WS_DISPATCH_BATCH_SIZE = 100
+
+# How long eventlet workers collect websocket events before handing them to the wsQ worker in one task, in seconds
+WS_GREEN_DISPATCH_WINDOW = 0.1
+
+# How long folder change events of a task are merged before they're sent, in seconds
+FOLDER_EVENT_WINDOW = 0.05
+
+# Max items held in merged folder change events before they're sent regardless of the window
+FOLDER_EVENT_MAX_ITEMS = 1000
+
+# Failed (4xx/5xx) requests a user or ip may make per window before every throttle starts refusing them
+FAILED_REQUESTS_LIMIT = 100
+FAILED_REQUESTS_WINDOW = 30
+
+# Discord (cloudflare) bans the server's IP after this many invalid (401/403/429) requests per window, in seconds
+DISCORD_INVALID_REQUEST_LIMIT = 10000
+DISCORD_INVALID_REQUEST_WINDOW = 600
+
+# How often each process re-reads the shared invalid request budget, in seconds
+DISCORD_INVALID_REQUEST_CHECK_INTERVAL = 1
+
 cache = caches["default"]
 
 FILE_TYPES = {
@@ -94,6 +158,9 @@ FILE_TYPES = {
 
 FILE_TYPE_CHOICES = [(key, key) for key in FILE_TYPES] + [("Other", "Other")]
 
+# FolderAggregate type folders count themselves under, never a file type
+FOLDER_AGGREGATE_TYPE = "folder"
+
 EXTENSION_TO_FILE_TYPE = {
     ext: file_type
     for file_type, extensions in FILE_TYPES.items()
@@ -116,6 +183,16 @@ class EventCode(Enum):
     NEW_DEVICE_LOG_IN = 12
     NOTIFICATIONS_UPDATE = 13
 
+class DiscordRequestPriority(Enum):
+    LOW = "low"  # cleanup sweeps, prefetching, raw thumbnails. Nobody waits for these
+    NORMAL = "normal"
+
+# Share of the discord invalid request budget used up after which requests of a priority are refused
+DISCORD_INVALID_REQUEST_SHED_AT = {
+    DiscordRequestPriority.LOW: 0.5,
+    DiscordRequestPriority.NORMAL: 0.9,
+}
+
 class EncryptionMethod(Enum):
     Not_Encrypted = 0
     AES_CTR = 1
@@ -1,9 +1,9 @@
 import base64
 from abc import abstractmethod, ABC
-from typing import Iterable
+from typing import Iterable, Optional
 
 from website.constants import API_BASE_URL, ShareEventType
-from website.core.crypto.signer import sign_resource
+from website.core.crypto.signer import sign_resource, ResourceSigner
 from website.models import File, Folder, ShareableLink, ShareAccessEvent, ShareAccess, Bot, Webhook, Tag, MediaPosition, VideoMetadataTrackMixin, Subtitle, AudioTrack, VideoTrack, \
     PerDeviceToken, UserZIP
 from website.models.file_related_models import PhotoMetadata, RawMetadata, SubtitleTrack, Moment
@@ -31,8 +31,9 @@ class SimpleSerializer(ABC):
 class AdvancedSerializer(ABC):
 
     @classmethod
-    def serialize_tuple(cls, tuple_data: tuple, hide: bool = False, sign_urls: bool = True) -> dict:
-        return cls._serialize(tuple_data, hide, sign_urls)
+    def serialize_tuple(cls, tuple_data: tuple, hide: bool = False, sign_urls: bool = True, signer: Optional[ResourceSigner] = None) -> dict:
+        """Pass one `signer` when serializing many tuples so their urls share its expiry"""
+        return cls._serialize(tuple_data, hide, sign_urls, signer)
 
     @classmethod
     def serialize_object(cls, obj: object, hide=False, sign_urls: bool = True) -> dict:
@@ -56,7 +57,7 @@ class AdvancedSerializer(ABC):
 
     @staticmethod
     @abstractmethod
-    def _serialize(tuple_data: tuple, hide=False, sign_urls: bool = True) -> dict:
+    def _serialize(tuple_data: tuple, hide=False, sign_urls: bool = True, signer: Optional[ResourceSigner] = None) -> dict:
         raise NotImplementedError
 
 
@@ -83,7 +84,7 @@ class FileSerializer(AdvancedSerializer):
         return tuple_data
 
     @staticmethod
-    def _serialize(tuple_data: tuple, hide=False, sign_urls: bool = True) -> dict:
+    def _serialize(tuple_data: tuple, hide=False, sign_urls: bool = True, signer: Optional[ResourceSigner] = None) -> dict:
         (
             _id, name, in_trash, ready, parent_id, owner_id, is_locked, lock_from_id, lock_from__name, password, is_dir,
             type_, size, created_at, last_modified_at, encryption_method, in_trash_since, extension,
@@ -124,7 +125,8 @@ class FileSerializer(AdvancedSerializer):
             download_path = f"/files/{_id}/stream"
 
             if sign_urls:
-                signed = sign_resource(download_path)
+                signer = signer or ResourceSigner()
+                signed = signer.sign(download_path)
             else:
                 d["_download_path"] = download_path
                 signed = ""
@@ -135,7 +137,7 @@ class FileSerializer(AdvancedSerializer):
                 thumbnail_path = f"/files/{_id}/thumbnail/{thumbnail_id}/stream"
 
                 if sign_urls:
-                    thumbnail_signed = sign_resource(thumbnail_path)
+                    thumbnail_signed = signer.sign(thumbnail_path)
                 else:
                     d["_thumbnail_path"] = thumbnail_path
                     thumbnail_signed = ""
@@ -148,7 +150,7 @@ class FileSerializer(AdvancedSerializer):
 class ShareFileSerializer(FileSerializer):
 
     @staticmethod
-    def _serialize(tuple_data: tuple, hide=False, sign_urls: bool = True) -> dict:
+    def _serialize(tuple_data: tuple, hide=False, sign_urls: bool = True, signer: Optional[ResourceSigner] = None) -> dict:
         (
             _id, name, in_trash, ready, parent_id, owner_id, is_locked, lock_from_id, lock_from__name, password, is_dir,
             type_, size, created_at, last_modified_at, encryption_method, in_trash_since, extension,
@@ -184,7 +186,8 @@ class ShareFileSerializer(FileSerializer):
             download_path = f"/files/{_id}/stream"
 
             if sign_urls:
-                signed = sign_resource(download_path)
+                signer = signer or ResourceSigner()
+                signed = signer.sign(download_path)
 
             d["download_url"] = f"{API_BASE_URL}{download_path}{signed}"
 
@@ -194,7 +197,7 @@ class ShareFileSerializer(FileSerializer):
                 thumbnail_signed = ""
 
                 if sign_urls:
-                    thumbnail_signed = sign_resource(thumbnail_path)
+                    thumbnail_signed = signer.sign(thumbnail_path)
 
                 d["thumbnail_url"] = f"{API_BASE_URL}{thumbnail_path}{thumbnail_signed}"
 
@@ -0,0 +1,73 @@
+import asyncio
+from typing import Optional
+
+from django.conf import settings
+from redis.asyncio import Redis
+
+from website.constants import cache
+
+
+class _LoopBoundRedis:
+    """
+    redis.asyncio connections belong to the event loop they were opened on.
+    Hands out one client per worker loop and rebuilds it if the loop changes.
+    """
+
+    def __init__(self):
+        self._client: Optional[Redis] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self) -> Redis:
+        loop = asyncio.get_running_loop()
+
+        if self._client is None or self._loop is not loop:
+            cache_settings = settings.CACHES["default"]
+            self._client = Redis.from_url(
+                cache_settings["LOCATION"],
+                password=cache_settings.get("OPTIONS", {}).get("PASSWORD"),
+            )
+            self._loop = loop
+
+        return self._client
+
+    async def close(self) -> None:
+        client = self._client
+        self._client = None
+        self._loop = None
+
+        if client is not None:
+            await client.aclose()
+
+
+_connection = _LoopBoundRedis()
+
+
+def get_async_redis_connection() -> Redis:
+    """Async counterpart of django_redis.get_redis_connection(), points at the same redis as the default cache."""
+    return _connection.get()
+
+
+async def close_async_redis_connection() -> None:
+    await _connection.close()
+
+
+# ------------------------------------------------------------------
+# Django cache compatible helpers
+# Keys and values are encoded exactly like django_redis does, so entries
+# written here are readable through `cache` and the other way around.
+# ------------------------------------------------------------------
+
+async def cache_aget_many(keys: list[str]) -> dict:
+    if not keys:
+        return {}
+
+    values = await get_async_redis_connection().mget([cache.make_key(key) for key in keys])
+    return {key: cache.client.decode(value) for key, value in zip(keys, values) if value is not None}
+
+
+async def cache_aset(key: str, value, timeout: float) -> None:
+    # django_redis treats a non-positive timeout as "already expired"
+    if timeout <= 0:
+        return
+
+    await get_async_redis_connection().set(cache.make_key(key), cache.client.encode(value), px=int(timeout * 1000))
@@ -10,3 +10,14 @@ class Decryptor(StreamCipherBase):
         if self.method == EncryptionMethod.Not_Encrypted:
             return raw_data
         return self._ctx.update(raw_data)
+
+    def decrypt_into(self, raw_data, out) -> int:
+        """
+        Decrypts straight into a writable buffer (bytearray / memoryview), no intermediate bytes object.
+        `out` must have room for len(raw_data) + 15 bytes. :return: number of bytes written
+        """
+        if self.method == EncryptionMethod.Not_Encrypted:
+            size = len(raw_data)
+            out[:size] = raw_data
+            return size
+        return self._ctx.update_into(raw_data, out)
@@ -28,6 +28,10 @@ class HttpxError(IDriveException):
 
 class CannotProcessDiscordRequestError(IDriveException):
     """Raised when we are unable to make requests to discord due to being overloaded"""
+    def __init__(self, message, retry_after=None):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
 
 class RangeNotSatisfiable(IDriveException):
     """Raised when the supplied header range is not satisfiable"""
@@ -1,4 +1,6 @@
 import base64
+import binascii
+import json
 import math
 import re
 import time
@@ -223,6 +225,22 @@ def normalize_blocked_until(value):
     return value
 
 
+def encode_cursor(position: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise BadRequestError("Invalid cursor.")
+
+    if not isinstance(position, list):
+        raise BadRequestError("Invalid cursor.")
+
+    return position
+
+
 def timed(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -0,0 +1,27 @@
+from website.core.aioredis import close_async_redis_connection
+from website.core.media.stream.CDNSessionPool import cdn_pool
+from website.discord.AsyncDiscord import async_discord
+
+
+async def lifespan_application(scope, receive, send):
+    """
+    ASGI lifespan handler. Django's ASGI handler only speaks http,
+    so worker startup/shutdown hooks live here.
+    """
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            try:
+                await cdn_pool.close()
+                await async_discord.close()
+                await close_async_redis_connection()
+            except Exception as e:
+                await send({"type": "lifespan.shutdown.failed", "message": str(e)})
+                return
+
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -1,8 +1,8 @@
-import time
-
 from django.conf import settings
 
-from website.constants import cache
+from website.auth.throttle import get_failed_requests_key
+from website.constants import FAILED_REQUESTS_LIMIT, FAILED_REQUESTS_WINDOW
+from website.core import ratelimit
 
 
 class ApplyRateLimitHeadersMiddleware:
@@ -35,21 +35,10 @@ class FailedRequestLoggerMiddleware:
     def __call__(self, request):
         response = self.get_response(request)
         if response.status_code >= 400:
-            key = self._get_key(request)
-            data = cache.get(key, [])
-            data.append(time.time())
-            data = [t for t in data if time.time() - t < 60]  # tylko z ostatniej minuty
-            cache.set(key, data, timeout=60)
+            # fills the bucket every throttle checks as its guard
+            ratelimit.record(get_failed_requests_key(request), FAILED_REQUESTS_LIMIT, FAILED_REQUESTS_WINDOW)
         return response
 
-    def _get_key(self, request):
-        if request.user.is_authenticated:
-            return f"fail:{request.user.pk}"
-        return f"fail_ip:{self._get_ip(request)}"
-
-    def _get_ip(self, request):
-        return request.META.get('REMOTE_ADDR')
-
 
 class ScriptNamePathMiddleware:
     def __init__(self, get_response):
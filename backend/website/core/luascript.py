@@ -0,0 +1,38 @@
+import hashlib
+
+from django_redis import get_redis_connection
+from redis.exceptions import NoScriptError
+
+from website.core.aioredis import get_async_redis_connection
+
+
+class LuaScript:
+    """
+    A lua script hashed once per process and called with EVALSHA.
+
+    Unlike redis-py's register_script() it isn't bound to a client, the same object
+    serves the sync connection and the async one of whatever loop is running.
+    The source is only sent again if redis doesn't know the script (restart, SCRIPT FLUSH).
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+    def __call__(self, keys: list, args: list):
+        client = get_redis_connection()
+
+        try:
+            return client.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            client.script_load(self.source)
+            return client.evalsha(self.sha, len(keys), *keys, *args)
+
+    async def acall(self, keys: list, args: list):
+        client = get_async_redis_connection()
+
+        try:
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            await client.script_load(self.source)
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
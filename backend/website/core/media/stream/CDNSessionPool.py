@@ -0,0 +1,78 @@
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+# Total sockets a single worker may open to the CDN
+CDN_POOL_LIMIT = 100
+
+# Sockets per (host, port, ssl) - discord serves everything from cdn.discordapp.com
+CDN_POOL_LIMIT_PER_HOST = 64
+
+CDN_DNS_CACHE_TTL = 300
+CDN_KEEPALIVE_TIMEOUT = 60
+
+
+class CDNSessionPool:
+    """
+    One long-lived aiohttp session per worker process, shared by every byte source.
+    Keeps TLS connections to the discord CDN alive across requests, viewers and zip entries.
+
+    The session is bound to the event loop it was created on, if that loop goes away
+    (tests, management commands calling asyncio.run) a new one is created transparently.
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=CDN_POOL_LIMIT,
+            limit_per_host=CDN_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=CDN_DNS_CACHE_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=CDN_KEEPALIVE_TIMEOUT,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60))
+
+    def get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = self._create_session()
+            self._loop = loop
+
+        return self._session
+
+    async def close(self) -> None:
+        session = self._session
+        self._session = None
+        self._loop = None
+
+        if session is not None and not session.closed:
+            await session.close()
+
+    def stats(self) -> dict:
+        session = self._session
+        if session is None or session.closed:
+            return {"open": 0, "idle": 0, "inUse": 0, "waiting": 0, "limit": CDN_POOL_LIMIT, "limitPerHost": CDN_POOL_LIMIT_PER_HOST}
+
+        connector = session.connector
+
+        # aiohttp has no public API for this, these are the connector's own bookkeeping structures
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        in_use = len(getattr(connector, "_acquired", ()))
+        waiting = sum(len(waiters) for waiters in getattr(connector, "_waiters", {}).values())
+
+        return {
+            "open": idle + in_use,
+            "idle": idle,
+            "inUse": in_use,
+            "waiting": waiting,
+            "limit": CDN_POOL_LIMIT,
+            "limitPerHost": CDN_POOL_LIMIT_PER_HOST,
+        }
+
+
+cdn_pool = CDNSessionPool()
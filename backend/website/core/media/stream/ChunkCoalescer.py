@@ -0,0 +1,54 @@
+from typing import Iterator, Optional
+
+from website.constants import STREAM_OUTPUT_CHUNK_SIZE
+from website.core.crypto.Decryptor import Decryptor
+
+# extra room update_into may want past the input length (one cipher block - 1)
+_CIPHER_SLACK = 15
+
+
+class ChunkCoalescer:
+    """
+    Packs the many small chunks a CDN response is read in into ~target_size bytes objects.
+
+    Every chunk handed to the ASGI server costs a send event and a socket write, so fewer bigger chunks
+    are a lot cheaper per byte. Input is decrypted straight into one reused buffer (update_into),
+    so packing doesn't cost more copies than decrypting every chunk on its own did.
+    Chunks that are big enough on their own skip the buffer.
+    """
+
+    def __init__(self, target_size: int = STREAM_OUTPUT_CHUNK_SIZE, decryptor: Optional[Decryptor] = None):
+        self.target_size = target_size
+        self.decryptor = decryptor
+
+        self._buffer = bytearray(target_size + _CIPHER_SLACK)
+        self._view = memoryview(self._buffer)
+        self._fill = 0
+
+    def feed(self, data) -> Iterator[bytes]:
+        """Yields zero, one or two packed chunks."""
+        size = len(data)
+        if not size:
+            return
+
+        if self._fill and self._fill + size > self.target_size:
+            yield self.flush()
+
+        if size >= self.target_size:
+            yield self.decryptor.decrypt(data) if self.decryptor else bytes(data)
+            return
+
+        if self.decryptor:
+            self._fill += self.decryptor.decrypt_into(data, self._view[self._fill:])
+        else:
+            self._view[self._fill:self._fill + size] = data
+            self._fill += size
+
+        if self._fill >= self.target_size:
+            yield self.flush()
+
+    def flush(self) -> bytes:
+        """:return: whatever is buffered, b"" if nothing is"""
+        data = bytes(self._view[:self._fill])
+        self._fill = 0
+        return data
@@ -0,0 +1,302 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, AsyncIterator
+
+import aiofiles
+
+from website.config import FRAGMENT_CACHE_DIR, FRAGMENT_CACHE_MAX_SIZE
+from website.constants import FRAGMENT_CACHE_RESCAN_INTERVAL, FRAGMENT_CACHE_STALE_TMP_AGE
+
+_TMP_SUFFIX = ".tmp"
+
+
+def _remove_files(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class FragmentCacheWriter:
+    """Writes one fragment to a temp file, `commit()` atomically publishes it under its final name."""
+
+    def __init__(self, cache: "FragmentDiskCache", fragment_id: str, expected_size: int):
+        self._cache = cache
+        self.fragment_id = fragment_id
+        self.expected_size = expected_size
+        self.written = 0
+
+        self._final_path = cache.path_for(fragment_id)
+        self._tmp_path = f"{self._final_path}.{os.getpid()}.{uuid.uuid4().hex}{_TMP_SUFFIX}"
+        self._file = None
+
+    async def write(self, data: bytes) -> None:
+        if self._file is None:
+            await asyncio.to_thread(os.makedirs, os.path.dirname(self._final_path), exist_ok=True)
+            self._file = await aiofiles.open(self._tmp_path, "wb")
+
+        await self._file.write(data)
+        self.written += len(data)
+
+    async def commit(self) -> None:
+        try:
+            if self._file is None or self.written != self.expected_size:
+                await self.abort()
+                return
+
+            await self._file.flush()
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+            await self._file.close()
+            self._file = None
+
+            await asyncio.to_thread(os.replace, self._tmp_path, self._final_path)
+            await self._cache.on_committed(self.fragment_id, self.written)
+
+        finally:
+            self._cache.on_fill_finished(self.fragment_id)
+
+    async def abort(self) -> None:
+        try:
+            if self._file is not None:
+                await self._file.close()
+                self._file = None
+
+            await asyncio.to_thread(_remove_files, [self._tmp_path])
+
+        finally:
+            self._cache.on_fill_finished(self.fragment_id)
+
+
+class FragmentDiskCache:
+    """
+    Optional on-disk LRU cache of fragment bytes exactly as they are stored on discord (still encrypted).
+    Decryption happens on the way out like for any other stream, so the same entry serves
+    raw and decrypted streams and no plaintext ever hits the disk.
+
+    - byte budget with LRU eviction, the LRU order survives restarts through file mtimes
+    - writes go to a temp file and are published with os.replace, a crash can't leave a torn fragment behind
+    - fills are single-flight per process: concurrent viewers of the same fragment wait for one download
+
+    Every worker keeps its own index of the shared directory. Between scans it only sees its own fills,
+    so it re-scans the directory every FRAGMENT_CACHE_RESCAN_INTERVAL seconds in the background and evicts
+    by the size and mtimes of what all workers wrote. The budget holds for the whole directory,
+    overshooting by at most what the workers fill within one interval.
+    Files evicted by another worker simply turn into misses.
+
+    All filesystem calls run in threads (asyncio.to_thread), this lives on the ASGI event loop
+    and a scan of a big cache directory must not stall every other stream of the worker.
+    """
+
+    def __init__(self, directory: Optional[str], max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total_size = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._scanned_at = 0.0
+        self._rescan_task: Optional[asyncio.Task] = None
+        self._fills: dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def path_for(self, fragment_id: str) -> str:
+        return os.path.join(self.directory, fragment_id[:2], fragment_id)
+
+    # ------------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------------
+
+    def _scan(self) -> list[tuple[float, str, int]]:
+        """(mtime, fragment id, size) of every cached fragment, oldest first. Blocking, runs in a thread."""
+        os.makedirs(self.directory, exist_ok=True)
+
+        found = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                if entry.name.endswith(_TMP_SUFFIX):
+                    # leftover of a crashed write, younger ones may be another worker's fill in progress
+                    if time.time() - stat.st_mtime > FRAGMENT_CACHE_STALE_TMP_AGE:
+                        _remove_files([entry.path])
+                    continue
+
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+
+        return sorted(found)
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+
+        # one scan per worker, concurrent first requests wait for it
+        async with self._load_lock:
+            if self._loaded:
+                return
+
+            await self._load()
+            self._loaded = True
+
+    async def _load(self) -> None:
+        """Replaces the index with what's on disk, oldest first, and evicts down to the budget"""
+        self._scanned_at = time.monotonic()
+        found = await asyncio.to_thread(self._scan)
+
+        self._entries = OrderedDict((fragment_id, size) for _, fragment_id, size in found)
+        self._total_size = sum(self._entries.values())
+        await self._evict()
+
+    def _rescan_if_due(self) -> None:
+        if self._rescan_task is not None or time.monotonic() - self._scanned_at < FRAGMENT_CACHE_RESCAN_INTERVAL:
+            return
+
+        async def rescan():
+            try:
+                async with self._load_lock:
+                    await self._load()
+            finally:
+                self._rescan_task = None
+
+        self._rescan_task = asyncio.create_task(rescan())
+
+    async def _touch(self, fragment_id: str) -> None:
+        self._entries.move_to_end(fragment_id)
+        try:
+            await asyncio.to_thread(os.utime, self.path_for(fragment_id))
+        except FileNotFoundError:
+            self._forget(fragment_id)
+
+    def _forget(self, fragment_id: str) -> None:
+        size = self._entries.pop(fragment_id, None)
+        if size is not None:
+            self._total_size -= size
+
+    async def _evict(self) -> None:
+        # the index is updated right away, only the deletes wait for the thread
+        paths = []
+        while self._total_size > self.max_size and self._entries:
+            fragment_id, size = self._entries.popitem(last=False)
+            self._total_size -= size
+            self.evictions += 1
+            paths.append(self.path_for(fragment_id))
+
+        if paths:
+            await asyncio.to_thread(_remove_files, paths)
+
+    async def on_committed(self, fragment_id: str, size: int) -> None:
+        self._forget(fragment_id)
+        self._entries[fragment_id] = size
+        self._total_size += size
+        self.fills += 1
+        await self._evict()
+
+    def on_fill_finished(self, fragment_id: str) -> None:
+        future = self._fills.pop(fragment_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def known(self, fragment_id: str) -> bool:
+        """Cached or being filled as far as this worker knows. No I/O, good enough to skip url lookups."""
+        return fragment_id in self._entries or fragment_id in self._fills
+
+    def filling(self, fragment_id: str) -> bool:
+        return fragment_id in self._fills
+
+    async def contains(self, fragment_id: str) -> bool:
+        """Waits for an in-flight fill of this fragment before answering."""
+        await self._ensure_loaded()
+        self._rescan_if_due()
+
+        fill = self._fills.get(fragment_id)
+        if fill is not None:
+            await asyncio.shield(fill)
+
+        if fragment_id not in self._entries:
+            # might have been written by another worker
+            try:
+                size = (await asyncio.to_thread(os.stat, self.path_for(fragment_id))).st_size
+            except FileNotFoundError:
+                self.misses += 1
+                return False
+
+            if fragment_id not in self._entries:
+                self._entries[fragment_id] = size
+                self._total_size += size
+
+        await self._touch(fragment_id)
+        self.hits += 1
+        return True
+
+    def writer(self, fragment_id: str, expected_size: int) -> Optional[FragmentCacheWriter]:
+        """
+        Claims the fill of a fragment. Returns None if another stream is already filling it (`filling()`),
+        call `contains()` again to wait for that fill. `contains()` also loads the index, nothing is filled before that.
+        """
+        if not self._loaded or fragment_id in self._fills or expected_size > self.max_size:
+            return None
+
+        self._fills[fragment_id] = asyncio.get_running_loop().create_future()
+        return FragmentCacheWriter(self, fragment_id, expected_size)
+
+    async def read(self, fragment_id: str, start: int, end: int, chunk_size: int) -> AsyncIterator[bytes]:
+        """
+        Yields bytes [start, end] (inclusive) of a cached fragment.
+        Raises FileNotFoundError if the fragment got evicted in the meantime.
+        """
+        try:
+            async with aiofiles.open(self.path_for(fragment_id), "rb") as f:
+                await f.seek(start)
+                remaining = end - start + 1
+
+                while remaining > 0:
+                    data = await f.read(min(chunk_size, remaining))
+                    if not data:
+                        raise FileNotFoundError(f"Cached fragment {fragment_id} is truncated")
+
+                    remaining -= len(data)
+                    yield data
+
+        except FileNotFoundError:
+            self._forget(fragment_id)
+            raise
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": self.hits / lookups if lookups else None,
+            "fills": self.fills,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "size": self._total_size,
+            "maxSize": self.max_size,
+            "fillsInFlight": len(self._fills),
+        }
+
+
+fragment_cache = FragmentDiskCache(FRAGMENT_CACHE_DIR, FRAGMENT_CACHE_MAX_SIZE)
@@ -0,0 +1,97 @@
+import bisect
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+# A checkpoint is taken every this many bytes of compressed input
+ZIP_CHECKPOINT_INTERVAL = 8 * 1024 * 1024
+
+# Max checkpoints kept per worker across all entries. One checkpoint is a zlib inflate state (~45 KiB)
+MAX_ZIP_CHECKPOINTS = 512
+
+
+@dataclass
+class ZipCheckpoint:
+    # bytes of compressed payload consumed (relative to the start of entry data)
+    compressed_pos: int
+    # bytes of decompressed output produced
+    output_pos: int
+    # zlib decompressobj snapshot, must be .copy()'ed before use
+    decompressor: object
+
+
+@dataclass
+class ZipEntryIndex:
+    """
+    zran-like random access index of a single zip entry.
+
+    Python's zlib can't prime an inflater with a bit offset and a 32 KiB window, so checkpoints are
+    snapshots of the inflater itself (decompressobj.copy()). They can't be serialized, which makes this
+    index per worker instead of persisted. It's filled lazily by whatever reads pass over the entry.
+    """
+    header_size: int
+    checkpoints: list[ZipCheckpoint] = field(default_factory=list)
+
+    def nearest(self, output_pos: int) -> Optional[ZipCheckpoint]:
+        """:return: the checkpoint with the highest output_pos <= output_pos"""
+        index = bisect.bisect_right([c.output_pos for c in self.checkpoints], output_pos) - 1
+        if index < 0:
+            return None
+        return self.checkpoints[index]
+
+    def wants_checkpoint(self, compressed_pos: int) -> bool:
+        slot = compressed_pos // ZIP_CHECKPOINT_INTERVAL
+        if slot == 0:
+            return False
+        return not any(c.compressed_pos // ZIP_CHECKPOINT_INTERVAL == slot for c in self.checkpoints)
+
+    def add(self, checkpoint: ZipCheckpoint) -> None:
+        positions = [c.compressed_pos for c in self.checkpoints]
+        self.checkpoints.insert(bisect.bisect_right(positions, checkpoint.compressed_pos), checkpoint)
+
+
+class ZipEntryIndexCache:
+    """LRU of ZipEntryIndex keyed by (file id, entry offset), bounded by the total number of checkpoints."""
+
+    def __init__(self, max_checkpoints: int = MAX_ZIP_CHECKPOINTS):
+        self.max_checkpoints = max_checkpoints
+        self._indexes: OrderedDict[tuple[str, int], ZipEntryIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_id: str, offset: int) -> Optional[ZipEntryIndex]:
+        with self._lock:
+            index = self._indexes.get((file_id, offset))
+            if index is not None:
+                self._indexes.move_to_end((file_id, offset))
+            return index
+
+    def get_or_create(self, file_id: str, offset: int, header_size: int) -> ZipEntryIndex:
+        with self._lock:
+            index = self._indexes.get((file_id, offset))
+            if index is None:
+                index = ZipEntryIndex(header_size=header_size)
+                self._indexes[(file_id, offset)] = index
+            self._indexes.move_to_end((file_id, offset))
+            return index
+
+    def add_checkpoint(self, index: ZipEntryIndex, checkpoint: ZipCheckpoint) -> None:
+        with self._lock:
+            index.add(checkpoint)
+            self._evict()
+
+    def _evict(self) -> None:
+        total = sum(len(index.checkpoints) for index in self._indexes.values())
+
+        while total > self.max_checkpoints and self._indexes:
+            oldest_key = next(iter(self._indexes))
+            oldest = self._indexes[oldest_key]
+
+            if oldest.checkpoints:
+                oldest.checkpoints.pop()
+                total -= 1
+            else:
+                del self._indexes[oldest_key]
+
+
+zip_entry_indexes = ZipEntryIndexCache()
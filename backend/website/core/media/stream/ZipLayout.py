@@ -0,0 +1,115 @@
+import bisect
+from dataclasses import dataclass
+from typing import Optional
+
+from zipFly import GenFile, ZipFly
+from zipFly.EmptyFolder import EmptyFolder
+
+from website.core.media.stream.ByteRange import ByteRange
+
+
+@dataclass(frozen=True)
+class ZipSegment:
+    # position in the archive, inclusive
+    start: int
+    end: int
+    # synthetic zip structure (local header, data descriptor, central directory)
+    data: Optional[bytes] = None
+    # zip entry dict whose content fills this segment
+    entry: Optional[dict] = None
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+
+class ZipLayout:
+    """
+    Byte exact layout of the archive zipFly streams for the given entries, computed from DB metadata only.
+
+    Every entry is stored (NO_COMPRESSION) with a known size and crc, so all headers, descriptors and the
+    central directory can be produced up front. A range read then only needs the content of the entries it overlaps.
+    """
+
+    def __init__(self, entries: list[dict], decrypted: bool):
+        self.segments: list[ZipSegment] = []
+        self._starts: list[int] = []
+        # raw archives carry every file's key and iv in its local header
+        self.contains_keys = not decrypted and any(entry.get("key") for entry in entries)
+
+        zipfly = ZipFly([self._make_zipfly_file(entry, decrypted) for entry in entries])
+        offset = 0
+
+        for file, entry in zip(zipfly._files, entries):
+            file.set_offset(offset)
+
+            prefix = zipfly._make_local_file_header(file)
+            if file.can_make_local_extra_field():
+                prefix += zipfly._make_local_zip64_extra_field(file)
+            if file.custom_payload:
+                prefix += zipfly._make_custom_extra_field(file)
+
+            offset = self._add(offset, data=prefix)
+
+            if file.predicted_size:
+                offset = self._add(offset, length=file.predicted_size, entry=entry)
+
+            # what zipFly records once a file finished streaming
+            file.set_crc(file.predicted_crc)
+            file.set_size(file.predicted_size)
+            file.set_compressed_size(file.predicted_size)
+            file.mark_finished_file_data_streaming()
+
+            offset = self._add(offset, data=zipfly._make_data_descriptor(file))
+
+        zipfly._set_offset(offset)
+        offset = self._add(offset, data=b"".join(zipfly._make_end_structures()))
+
+        self.size = offset
+
+    @staticmethod
+    def _make_zipfly_file(entry: dict, decrypted: bool):
+        if entry["isDir"]:
+            return EmptyFolder(name=entry["name"])
+
+        custom_payload = None
+        if not decrypted:
+            method = int(entry["encryption_method"]).to_bytes(2, byteorder="little")
+            iv = bytes(entry.get("iv") or b"")
+            key = bytes(entry.get("key") or b"")
+            custom_payload = method + iv + key
+
+        # metadata only, content is streamed separately for the segments that are actually read
+        return GenFile(
+            name=entry["name"],
+            generator=None,
+            size=entry["size"],
+            crc=entry["crc"],
+            validate_crc=decrypted,
+            custom_payload=custom_payload
+        )
+
+    def _add(self, offset: int, data: Optional[bytes] = None, length: int = 0, entry: Optional[dict] = None) -> int:
+        if data is not None:
+            length = len(data)
+
+        if length:
+            self.segments.append(ZipSegment(start=offset, end=offset + length - 1, data=data, entry=entry))
+            self._starts.append(offset)
+
+        return offset + length
+
+    def slice(self, byte_range: ByteRange) -> list[tuple[ZipSegment, int, int]]:
+        """:return: (segment, local_start, local_end) for every segment overlapping the range, in archive order"""
+        parts = []
+        index = max(0, bisect.bisect_right(self._starts, byte_range.start) - 1)
+
+        for segment in self.segments[index:]:
+            if segment.start > byte_range.end:
+                break
+
+            start = max(byte_range.start, segment.start)
+            end = min(byte_range.end, segment.end)
+            parts.append((segment, start - segment.start, end - segment.start))
+
+        return parts
@@ -2,19 +2,24 @@
 import zlib
 
 from website.core.media.stream.ByteRange import ByteRange
+from website.core.media.stream.ZipEntryIndex import zip_entry_indexes, ZipCheckpoint
 from website.core.media.stream.sources.ByteSource import ByteSource
 from website.core.media.stream.sources.FragmentByteSource import FragmentedDiscordByteSource
 
+LOCAL_HEADER_SIZE = 30
+# fixed header + max filename length + max extra field length
+MAX_LOCAL_HEADER_SIZE = LOCAL_HEADER_SIZE + 0xFFFF + 0xFFFF
+
 
 class DeflateZipEntryByteSource(ByteSource):
-    def __init__(self, file_obj, fragments, offset: int, compression_method: int, compressed_size: int, uncompressed_size: int):
+    def __init__(self, file_obj, fragments, offset: int, compression_method: int, compressed_size: int, uncompressed_size: int, read_ahead: int = 1):
         self.file_obj = file_obj
         self.offset = offset
         self.compression_method = compression_method
         self.compressed_size = compressed_size
         self.uncompressed_size = uncompressed_size
 
-        self._source = FragmentedDiscordByteSource(file_obj, fragments, decrypted=True)
+        self._source = FragmentedDiscordByteSource(file_obj, fragments, decrypted=True, read_ahead=read_ahead)
 
     def size(self) -> int:
         # logical size = decompressed size
@@ -22,99 +27,145 @@ class DeflateZipEntryByteSource(ByteSource):
 
     async def read(self, byte_range: ByteRange, chunk_size: int = 128 * 1024):
         """
-        Supports logical seeking by replaying the stream and skipping output.
         Decompresses only for method 8 (deflate). Otherwise, returns raw bytes.
+
+        The first read of an entry parses its local header and, while inflating, records
+        checkpoints into `zip_entry_indexes`. Later reads resume from the nearest checkpoint
+        (or, for stored entries, seek directly), so only the fragments from there on are fetched.
         """
+        if self.compressed_size == 0 or self.uncompressed_size == 0:
+            return
+
+        is_deflate = (self.compression_method == 8)
+        source_end = self._source.size() - 1
+
+        index = zip_entry_indexes.get(self.file_obj.id, self.offset)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if is_deflate else None
+
+        compressed_consumed = 0
+        output_pos = 0
+
+        if index is None:
+            header_size = None
+            physical_start = self.offset
+            physical_end = min(self.offset + MAX_LOCAL_HEADER_SIZE + self.compressed_size - 1, source_end)
+        else:
+            header_size = index.header_size
+
+            if is_deflate:
+                checkpoint = index.nearest(byte_range.start)
+                if checkpoint is not None:
+                    compressed_consumed = checkpoint.compressed_pos
+                    output_pos = checkpoint.output_pos
+                    decompressor = checkpoint.decompressor.copy()
+            else:
+                # stored entries map 1:1 onto the compressed payload
+                compressed_consumed = output_pos = byte_range.start
+
+            data_start = self.offset + header_size
+            physical_start = data_start + compressed_consumed
+            physical_end = min(data_start + self.compressed_size - 1, source_end)
 
         physical_range = ByteRange(
-            start=self.offset,
-            end=self._source.size() - 1,
+            start=physical_start,
+            end=physical_end,
             total=self._source.size()
         )
 
         upstream = self._source.read(physical_range, chunk_size)
 
-        is_deflate = (self.compression_method == 8)
-        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if is_deflate else None
-
-        buffer = b""
-        header_parsed = False
-
-        compressed_consumed = 0
-        output_pos = 0
+        header_buffer = bytearray()
 
         target_start = byte_range.start
         target_end = byte_range.end
 
-        async for chunk in upstream:
-            if not chunk:
-                continue
+        try:
+            async for chunk in upstream:
+                if not chunk:
+                    continue
 
-            buffer += chunk
+                # ---- parse ZIP local header ----
+                if header_size is None:
+                    header_buffer += chunk
 
-            # ---- parse ZIP local header ----
-            if not header_parsed:
-                if len(buffer) < 30:
-                    continue
+                    if len(header_buffer) < LOCAL_HEADER_SIZE:
+                        continue
 
-                if buffer[0:4] != b"PK\x03\x04":
-                    raise ValueError("Invalid ZIP header")
+                    if header_buffer[0:4] != b"PK\x03\x04":
+                        raise ValueError("Invalid ZIP header")
 
-                filename_len = int.from_bytes(buffer[26:28], "little")
-                extra_len = int.from_bytes(buffer[28:30], "little")
-                header_size = 30 + filename_len + extra_len
+                    filename_len = int.from_bytes(header_buffer[26:28], "little")
+                    extra_len = int.from_bytes(header_buffer[28:30], "little")
+                    parsed_header_size = LOCAL_HEADER_SIZE + filename_len + extra_len
 
-                if len(buffer) < header_size:
-                    continue
+                    if len(header_buffer) < parsed_header_size:
+                        continue
 
-                buffer = buffer[header_size:]
-                header_parsed = True
+                    header_size = parsed_header_size
+                    index = zip_entry_indexes.get_or_create(self.file_obj.id, self.offset, header_size)
 
-            # ---- consume compressed payload ----
-            remaining = self.compressed_size - compressed_consumed
-            if remaining <= 0:
-                break
+                    chunk = bytes(header_buffer[header_size:])
+                    header_buffer = None
 
-            chunk_to_feed = buffer[:remaining]
-            buffer = buffer[len(chunk_to_feed):]
+                    if not chunk:
+                        continue
 
-            compressed_consumed += len(chunk_to_feed)
+                # ---- consume compressed payload ----
+                remaining = self.compressed_size - compressed_consumed
+                if remaining <= 0:
+                    break
 
-            if not chunk_to_feed:
-                continue
+                if len(chunk) > remaining:
+                    chunk = memoryview(chunk)[:remaining]
 
-            # ---- transform (decompress or passthrough) ----
-            if is_deflate:
-                out = decompressor.decompress(chunk_to_feed)
-            else:
-                out = chunk_to_feed
+                compressed_consumed += len(chunk)
 
-            if not out:
-                continue
+                # ---- transform (decompress or passthrough) ----
+                if is_deflate:
+                    out = decompressor.decompress(chunk)
 
-            # ---- apply logical range ----
-            out_start = output_pos
-            out_end = output_pos + len(out) - 1
+                    if index.wants_checkpoint(compressed_consumed):
+                        zip_entry_indexes.add_checkpoint(index, ZipCheckpoint(
+                            compressed_pos=compressed_consumed,
+                            output_pos=output_pos + len(out),
+                            decompressor=decompressor.copy(),
+                        ))
+                else:
+                    out = chunk
 
-            if out_end < target_start:
-                output_pos += len(out)
-                continue
+                if not out:
+                    continue
+
+                # ---- apply logical range ----
+                out_start = output_pos
+                out_end = output_pos + len(out) - 1
 
-            if out_start > target_end:
-                break
+                if out_end < target_start:
+                    output_pos += len(out)
+                    continue
+
+                if out_start > target_end:
+                    break
 
-            slice_start = max(0, target_start - out_start)
-            slice_end = min(len(out), target_end - out_start + 1)
+                slice_start = max(0, target_start - out_start)
+                slice_end = min(len(out), target_end - out_start + 1)
 
-            yield out[slice_start:slice_end]
+                if slice_start == 0 and slice_end == len(out):
+                    yield out
+                else:
+                    yield out[slice_start:slice_end]
+
+                output_pos += len(out)
 
-            output_pos += len(out)
+                if output_pos > target_end:
+                    break
 
-            if output_pos > target_end:
-                break
+        finally:
+            # stop read-ahead downloads we no longer need
+            await upstream.aclose()
 
         # ---- flush only for deflate ----
-        if is_deflate:
+        if is_deflate and output_pos <= target_end:
             tail = decompressor.flush()
             if tail:
                 out_start = output_pos
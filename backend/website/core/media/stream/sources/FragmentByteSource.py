@@ -1,14 +1,21 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
 from dataclasses import dataclass
 
 import aiohttp
-from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
 
+from website.config import MAX_STREAM_READ_AHEAD_FRAGMENTS
+from website.constants import STREAM_FRAGMENT_BUFFER_SIZE, URL_WARM_AHEAD_FRAGMENTS
 from website.core.crypto.Decryptor import Decryptor
 from website.core.media.stream.ByteRange import ByteRange
+from website.core.media.stream.CDNSessionPool import cdn_pool
+from website.core.media.stream.ChunkCoalescer import ChunkCoalescer
+from website.core.media.stream.FragmentDiskCache import fragment_cache
 from website.core.media.stream.sources.ByteSource import ByteSource
-from website.discord.Discord import discord
+from website.discord.AttachmentUrlWarmer import url_warmer
 from website.models import Fragment
-from website.tasks.helper import auto_prefetch
 
 
 @dataclass(frozen=True)
@@ -24,11 +31,19 @@ class FragmentRange:
     def length(self) -> int:
         return self.local_end - self.local_start + 1
 
+
+_FRAGMENT_DONE = object()
+
+
 class FragmentedDiscordByteSource(ByteSource):
-    def __init__(self, file_obj, fragments, decrypted: bool):
+    def __init__(self, file_obj, fragments, decrypted: bool, read_ahead: int = 1):
         self.file_obj = file_obj
-        self.fragments = list(fragments.order_by("sequence"))
+        if isinstance(fragments, QuerySet):
+            fragments = fragments.select_related("channel").order_by("sequence")
+        # already loaded lists must be ordered by sequence with `channel` loaded
+        self.fragments = list(fragments)
         self.decrypted = decrypted
+        self.read_ahead = max(1, min(read_ahead, MAX_STREAM_READ_AHEAD_FRAGMENTS))
 
     def size(self) -> int:
         return self.file_obj.size
@@ -71,8 +86,77 @@ class FragmentedDiscordByteSource(ByteSource):
 
         return mappings
 
+    async def _fetch_fragment(self, session: aiohttp.ClientSession, mapping: FragmentRange, get_url: Callable[[], Awaitable[str]], queue: asyncio.Queue, chunk_size: int):
+        """
+        Downloads a single fragment range into a bounded queue.
+        The queue applies backpressure, so a fragment that is ahead of the reader
+        holds at most STREAM_FRAGMENT_BUFFER_SIZE bytes in memory.
+
+        With the disk cache enabled, cached fragments are read from disk and
+        fragments requested in full are written to it while they stream.
+        The attachment url is only resolved (`get_url`) when the fragment has to come from discord.
+        """
+        writer = None
+        try:
+            fragment = mapping.fragment
+            # first byte of the mapping the reader hasn't been given yet
+            start = mapping.local_start
+
+            while fragment_cache.enabled:
+                if await fragment_cache.contains(fragment.id):
+                    try:
+                        async for chunk in fragment_cache.read(fragment.id, mapping.local_start, mapping.local_end, chunk_size):
+                            await queue.put(chunk)
+                            start += len(chunk)
+                        await queue.put(_FRAGMENT_DONE)
+                        return
+                    except FileNotFoundError:
+                        # evicted before we managed to open it, or truncated midway,
+                        # discord sends the rest from where the cached copy stopped
+                        pass
+
+                if start == 0 and mapping.length == fragment.size:
+                    writer = fragment_cache.writer(fragment.id, fragment.size)
+                    if writer:
+                        break
+
+                # another viewer started filling it while we checked, wait for that instead of downloading it twice
+                if start != mapping.local_start or not fragment_cache.filling(fragment.id):
+                    break
+
+            url = await get_url()
+            headers = {"Range": f"bytes={start}-{mapping.local_end}"}
+
+            async with session.get(url, headers=headers) as response:
+                response.raise_for_status()
+
+                async for raw_chunk in response.content.iter_chunked(chunk_size):
+                    if writer:
+                        await writer.write(raw_chunk)
+                    await queue.put(raw_chunk)
+
+            if writer:
+                await writer.commit()
+                writer = None
+
+            await queue.put(_FRAGMENT_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            if writer:
+                await asyncio.shield(writer.abort())
+
     async def read(self, byte_range: ByteRange, chunk_size: int = 128 * 1024):
+        """
+        Streams fragments through an ordered read-ahead window.
+        Up to `read_ahead` fragments are downloaded concurrently, bytes are always yielded in fragment order,
+        packed into STREAM_OUTPUT_CHUNK_SIZE chunks.
+        """
         mappings = self.map_range(byte_range)
+        next_index = 0
+        warmed_until = 0
 
         decryptor = None
         if self.decrypted and self.file_obj.is_encrypted():
@@ -83,29 +167,78 @@ class FragmentedDiscordByteSource(ByteSource):
                 start_byte=byte_range.start,
             )
 
-        async with aiohttp.ClientSession() as session:
-            for mapping in mappings:
-                fragment = mapping.fragment
+        coalescer = ChunkCoalescer(decryptor=decryptor)
+
+        queue_size = max(1, STREAM_FRAGMENT_BUFFER_SIZE // chunk_size)
+        window: deque[tuple[asyncio.Task, asyncio.Queue]] = deque()
+        urls: dict[str, str] = {}
+        url_lock = asyncio.Lock()
+
+        session = cdn_pool.get_session()
+
+        def url_getter(index: int):
+            async def get_url() -> str:
+                attachment_id = mappings[index].fragment.attachment_id
+
+                # one batch at a time, fragments of the window resolved by an earlier batch don't ask discord again
+                async with url_lock:
+                    if attachment_id not in urls:
+                        batch = [
+                            m.fragment for m in mappings[index:index + self.read_ahead]
+                            if m.fragment.attachment_id not in urls and (m is mappings[index] or not fragment_cache.known(m.fragment.id))
+                        ]
+                        urls.update(await url_warmer.get_attachment_urls(self.file_obj.owner, batch))
+
+                return urls[attachment_id]
+
+            return get_url
+
+        async def fill_window():
+            nonlocal next_index, warmed_until
+
+            while len(window) < self.read_ahead and next_index < len(mappings):
+                mapping = mappings[next_index]
+                next_index += 1
+
+                warm_end = next_index + self.read_ahead + URL_WARM_AHEAD_FRAGMENTS
+                warm_start = max(warmed_until, next_index + self.read_ahead)
+                if warm_start < warm_end:
+                    url_warmer.warm(self.file_obj.owner, [m.fragment for m in mappings[warm_start:warm_end] if not fragment_cache.known(m.fragment.id)])
+                    warmed_until = warm_end
+
+                queue = asyncio.Queue(maxsize=queue_size)
+                task = asyncio.create_task(self._fetch_fragment(session, mapping, url_getter(next_index - 1), queue, chunk_size))
+                window.append((task, queue))
+
+        try:
+            await fill_window()
+
+            while window:
+                _, queue = window[0]
 
-                auto_prefetch(fragment.id)
+                while True:
+                    item = await queue.get()
+                    if item is _FRAGMENT_DONE:
+                        break
 
-                url = await sync_to_async(discord.get_attachment_url)(self.file_obj.owner, fragment)
+                    if isinstance(item, Exception):
+                        raise item
 
-                headers = {"Range": f"bytes={mapping.local_start}-{mapping.local_end}"}
+                    for data in coalescer.feed(item):
+                        yield data
 
-                async with session.get(url, headers=headers) as response:
-                    response.raise_for_status()
+                window.popleft()
+                await fill_window()
 
-                    async for raw_chunk in response.content.iter_chunked(chunk_size):
-                        if decryptor:
-                            data = decryptor.decrypt(raw_chunk)
-                        else:
-                            data = raw_chunk
+        finally:
+            for task, _ in window:
+                task.cancel()
 
-                        if data:
-                            yield data
+            if window:
+                await asyncio.gather(*(task for task, _ in window), return_exceptions=True)
 
+        tail = coalescer.flush()
         if decryptor:
-            tail = decryptor.finalize()
-            if tail:
-                yield tail
+            tail += decryptor.finalize()
+        if tail:
+            yield tail
@@ -1,31 +1,48 @@
+import asyncio
+from collections import deque
 from typing import Iterable, Optional
 
-import aiohttp
 from asgiref.sync import sync_to_async
-from zipFly import GenFile, ZipFly
-from zipFly.EmptyFolder import EmptyFolder
 
-from website.constants import EncryptionMethod, MAX_FILES_IN_ZIP
-from website.core.crypto.Decryptor import Decryptor
+from website.constants import EncryptionMethod, MAX_FILES_IN_ZIP, STREAM_FRAGMENT_BUFFER_SIZE, ZIP_FRAGMENT_QUERY_BATCH_SIZE
 from website.core.errors import BadRequestError
 from website.core.media.stream.ByteRange import ByteRange
+from website.core.media.stream.ChunkCoalescer import ChunkCoalescer
+from website.core.media.stream.ZipLayout import ZipLayout, ZipSegment
 from website.core.media.stream.sources.ByteSource import ByteSource
-from website.discord.Discord import discord
-from website.models import Fragment
-from website.tasks.helper import auto_prefetch
+from website.core.media.stream.sources.FragmentByteSource import FragmentedDiscordByteSource
+from website.models import File, Fragment
+
+_ENTRY_DONE = object()
+
+
+class ZipEntryFile:
+    """The parts of a File that FragmentedDiscordByteSource needs, built from a zip entry dict and its key/iv."""
+
+    def __init__(self, entry: dict, owner, key: Optional[bytes], iv: Optional[bytes]):
+        self.id = entry["id"]
+        self.size = entry["size"]
+        self.owner = owner
+        self.encryption_method = entry["encryption_method"]
+        self.key = key
+        self.iv = iv
+
+    def get_encryption_method(self) -> EncryptionMethod:
+        return EncryptionMethod(self.encryption_method)
+
+    def is_encrypted(self) -> bool:
+        return self.get_encryption_method() != EncryptionMethod.Not_Encrypted
 
 
 class ZipByteSource(ByteSource):
-    def __init__(self, dict_files: Iterable[dict], owner, num_bots: int, decrypted: bool, size_file_limit: int = MAX_FILES_IN_ZIP):
+    def __init__(self, layout: ZipLayout, owner, num_bots: int, decrypted: bool):
         self.owner = owner
         self.num_bots = num_bots
         self.decrypted = decrypted
-        self.size_file_limit = size_file_limit
-
-        self.entries = self._build_entries(dict_files)
-        self._size = self._calculate_size()
+        self.layout = layout
 
-    def _build_entries(self, dict_files: Iterable[dict]) -> list[dict]:
+    @staticmethod
+    def build_layout(dict_files: Iterable[dict], decrypted: bool, size_file_limit: int = MAX_FILES_IN_ZIP) -> ZipLayout:
         entries = []
         file_count = 0
 
@@ -33,90 +50,134 @@ class ZipByteSource(ByteSource):
             entries.append(entry)
             file_count += 1
 
-            if file_count > self.size_file_limit:
-                raise BadRequestError(f"ZIP contains more than {self.size_file_limit} files")
+            if file_count > size_file_limit:
+                raise BadRequestError(f"ZIP contains more than {size_file_limit} files")
 
-        return entries
+        layout = ZipLayout(entries, decrypted)
+
+        # the layout gets cached, keys are loaded with the fragments of an entry when it's streamed
+        for entry in entries:
+            entry.pop("key", None)
+            entry.pop("iv", None)
+
+        return layout
 
     # -----------------------------------------------------
 
     @staticmethod
-    def _fetch_fragments_sync(file_id):
-        return list(Fragment.objects.filter(file_id=file_id).order_by("sequence"))
-
-    async def _stream_file(self, entry: dict, chunk_size=8192 * 16):
-        async with aiohttp.ClientSession() as session:
-            decryptor = Decryptor(
-                method=EncryptionMethod(entry["encryption_method"]),
-                key=entry.get("key"),
-                iv=entry.get("iv"),
-            )
-
-            fragments = await sync_to_async(self._fetch_fragments_sync)(entry["id"])
-
-            for fragment in fragments:
-                url = await sync_to_async(discord.get_attachment_url)(self.owner, fragment, True)
-                auto_prefetch(fragment.id)
-
-                async with session.get(url) as response:
-                    response.raise_for_status()
-
-                    async for raw_data in response.content.iter_chunked(chunk_size):
-                        if self.decrypted:
-                            yield decryptor.decrypt(raw_data)
-                        else:
-                            yield raw_data
-
-    def _make_zipfly_file(self, entry: dict):
-        if entry["isDir"]:
-            return EmptyFolder(name=entry["name"])
-
-        custom_payload = None
-        if not self.decrypted:
-            method = int(entry["encryption_method"]).to_bytes(2, byteorder="little")
-            iv = bytes(entry.get("iv") or b"")
-            key = bytes(entry.get("key") or b"")
-            custom_payload = method + iv + key
-
-        return GenFile(
-            name=entry["name"],
-            generator=self._stream_file(entry),
-            size=entry["size"],
-            crc=entry["crc"],
-            validate_crc=self.decrypted,
-            custom_payload=custom_payload
-        )
-
-    def _build_zipfly(self, byte_offset: int = 0):
-        files = [self._make_zipfly_file(entry) for entry in self.entries]
-        return ZipFly(files, byte_offset=byte_offset)
-
-    def _calculate_size(self) -> int:
-        zipfly = self._build_zipfly()
-        return zipfly.calculate_archive_size()
+    def _fetch_fragments_sync(file_ids: list[str]) -> dict[str, tuple[list[Fragment], Optional[bytes], Optional[bytes]]]:
+        """:return: file id -> (fragments, key, iv)"""
+        fragments_by_file = {file_id: [] for file_id in file_ids}
+
+        fragments = Fragment.objects.filter(file_id__in=file_ids).select_related("channel").order_by("file_id", "sequence")
+        for fragment in fragments:
+            fragments_by_file[str(fragment.file_id)].append(fragment)
+
+        secrets = {
+            str(file_id): (key, iv)
+            for file_id, key, iv in File.objects.filter(id__in=file_ids).exclude(key__isnull=True).values_list("id", "key", "iv")
+        }
+
+        result = {}
+        for file_id, file_fragments in fragments_by_file.items():
+            key, iv = secrets.get(file_id, (None, None))
+            result[file_id] = (file_fragments, key, iv)
+
+        return result
+
+    async def _stream_entry(self, entry: dict, entry_data: tuple[list[Fragment], Optional[bytes], Optional[bytes]], local_start: int, local_end: int, read_ahead: int, queue: asyncio.Queue, chunk_size: int):
+        """Streams [local_start, local_end] of a single entry's content into a bounded queue."""
+        try:
+            fragments, key, iv = entry_data
+            source = FragmentedDiscordByteSource(ZipEntryFile(entry, self.owner, key, iv), fragments, decrypted=self.decrypted, read_ahead=read_ahead)
+            byte_range = ByteRange(start=local_start, end=local_end, total=entry["size"])
+
+            async for chunk in source.read(byte_range, chunk_size):
+                await queue.put(chunk)
+
+            await queue.put(_ENTRY_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
 
     # -----------------------------------------------------
 
     def size(self) -> int:
-        return self._size
+        return self.layout.size
 
     # -----------------------------------------------------
 
     async def read(self, byte_range: Optional[ByteRange] = None, chunk_size=128 * 1024):
-        byte_offset = byte_range.start
-        max_bytes = byte_range.length
+        """
+        Headers, data descriptors and the central directory come from the precomputed layout,
+        only the entries overlapping the range are downloaded, starting at the first requested byte.
+        Up to `num_bots` entries are downloaded concurrently, bytes are always yielded in archive order.
+        """
+        parts = self.layout.slice(byte_range)
+        data_parts: list[tuple[ZipSegment, int, int]] = [part for part in parts if part[0].entry is not None]
+
+        # a resumed download of one big file gets the read-ahead inside that file instead of across entries
+        read_ahead = self.num_bots if len(data_parts) == 1 else 1
+        max_entries = max(1, self.num_bots)
+
+        queue_size = max(1, STREAM_FRAGMENT_BUFFER_SIZE // chunk_size)
+        window: deque[tuple[asyncio.Task, asyncio.Queue]] = deque()
+        fragments_by_file: dict[str, tuple[list[Fragment], Optional[bytes], Optional[bytes]]] = {}
+        next_index = 0
+
+        # small files make for lots of tiny headers and descriptors, pack them with the data around them
+        coalescer = ChunkCoalescer()
+
+        async def fill_window():
+            nonlocal next_index
+
+            while len(window) < max_entries and next_index < len(data_parts):
+                segment, local_start, local_end = data_parts[next_index]
+                file_id = segment.entry["id"]
+
+                if file_id not in fragments_by_file:
+                    batch = [s.entry["id"] for s, _, _ in data_parts[next_index:next_index + ZIP_FRAGMENT_QUERY_BATCH_SIZE]]
+                    fragments_by_file.update(await sync_to_async(self._fetch_fragments_sync)(batch))
+
+                next_index += 1
+
+                queue = asyncio.Queue(maxsize=queue_size)
+                task = asyncio.create_task(self._stream_entry(segment.entry, fragments_by_file.pop(file_id), local_start, local_end, read_ahead, queue, chunk_size))
+                window.append((task, queue))
+
+        try:
+            await fill_window()
+
+            for segment, local_start, local_end in parts:
+                if segment.entry is None:
+                    for data in coalescer.feed(memoryview(segment.data)[local_start:local_end + 1]):
+                        yield data
+                    continue
+
+                _, queue = window[0]
+
+                while True:
+                    item = await queue.get()
+                    if item is _ENTRY_DONE:
+                        break
+
+                    if isinstance(item, Exception):
+                        raise item
 
-        zipfly = self._build_zipfly(byte_offset=byte_offset)
+                    for data in coalescer.feed(item):
+                        yield data
 
-        sent = 0
+                window.popleft()
+                await fill_window()
 
-        async for chunk in zipfly.async_stream_parallel(prefetch_files=self.num_bots):
-            if sent >= max_bytes:
-                break
+        finally:
+            for task, _ in window:
+                task.cancel()
 
-            remaining = max_bytes - sent
-            if len(chunk) > remaining:
-                chunk = chunk[:remaining]
+            if window:
+                await asyncio.gather(*(task for task, _ in window), return_exceptions=True)
 
-            sent += len(chunk)
-            yield chunk
+        tail = coalescer.flush()
+        if tail:
+            yield tail
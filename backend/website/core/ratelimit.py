@@ -0,0 +1,172 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from website.constants import cache
+from website.core.luascript import LuaScript
+
+# ------------------------------------------------------------------
+# GCRA (generic cell rate algorithm) buckets.
+# A bucket is a single redis string holding its "theoretical arrival time" in ms,
+# so a hit is one atomic script call no matter how many requests the window holds.
+# Time comes from redis, every worker sees the same clock.
+# ------------------------------------------------------------------
+
+_LUA_HELPERS = """
+    local function now_ms()
+        local t = redis.call('TIME')
+        return tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+    end
+
+    local function get_tat(key, now)
+        local tat = tonumber(redis.call('GET', key))
+        if not tat or tat < now then
+            return now
+        end
+        return tat
+    end
+
+    local function set_tat(key, tat, now)
+        redis.call('SET', key, string.format('%.3f', tat), 'PX', math.max(1, math.ceil(tat - now)))
+    end
+"""
+
+# KEYS[1] = bucket, KEYS[2] = optional guard bucket that is only checked, not consumed
+# ARGV = limit, period_ms, guard_limit, guard_period_ms
+# returns {allowed, remaining, retry_after_ms, reset_after_ms}
+HIT_SCRIPT = LuaScript(_LUA_HELPERS + """
+    local now = now_ms()
+    local limit = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+    local emission = period / limit
+
+    local guard_remaining = limit
+    if #KEYS > 1 then
+        local guard_limit = tonumber(ARGV[3])
+        local guard_period = tonumber(ARGV[4])
+        local guard_emission = guard_period / guard_limit
+        local guard_used = get_tat(KEYS[2], now) - now
+
+        if guard_used + guard_emission > guard_period then
+            -- an exhausted guard lets requests through again once it's drained to half
+            return {0, 0, math.ceil(guard_used - guard_period / 2), math.ceil(guard_used)}
+        end
+
+        guard_remaining = math.floor((guard_period - guard_used) / guard_emission)
+    end
+
+    local tat = get_tat(KEYS[1], now)
+    local new_tat = tat + emission
+    local allow_at = new_tat - period
+
+    if now < allow_at then
+        return {0, 0, math.ceil(allow_at - now), math.ceil(tat - now)}
+    end
+
+    set_tat(KEYS[1], new_tat, now)
+
+    local remaining = math.floor((period - (new_tat - now)) / emission)
+    return {1, math.min(remaining, guard_remaining), 0, math.ceil(new_tat - now)}
+""")
+
+# KEYS[1] = bucket, ARGV = limit, period_ms
+# consumes unconditionally, a bucket never holds more than one period
+RECORD_SCRIPT = LuaScript(_LUA_HELPERS + """
+    local now = now_ms()
+    local limit = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+
+    local new_tat = math.min(get_tat(KEYS[1], now) + period / limit, now + period)
+    set_tat(KEYS[1], new_tat, now)
+    return 1
+""")
+
+# KEYS[1] = bucket, ARGV = limit, period_ms
+# returns {remaining, reset_after_ms} without touching the bucket
+PEEK_SCRIPT = LuaScript(_LUA_HELPERS + """
+    local now = now_ms()
+    local limit = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+
+    local used = get_tat(KEYS[1], now) - now
+    return {math.floor((period - used) / (period / limit)), math.ceil(used)}
+""")
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    remaining: int
+    retry_after: float  # seconds until the next hit is allowed, 0 if this one was
+    reset_after: float  # seconds until the bucket is full again
+
+
+@dataclass
+class RateLimitGuard:
+    """A second bucket checked by a hit but filled by something else (see `record`)"""
+    key: str
+    limit: int
+    period: float
+
+
+def _make_key(key: str) -> str:
+    return cache.make_key(f"ratelimit:{key}")
+
+
+def _hit_keys_and_args(key: str, limit: int, period: float, guard: Optional[RateLimitGuard]) -> tuple[list, list]:
+    keys = [_make_key(key)]
+    args = [limit, int(period * 1000)]
+
+    if guard:
+        keys.append(_make_key(guard.key))
+        args += [guard.limit, int(guard.period * 1000)]
+
+    return keys, args
+
+
+def _parse_hit_result(result) -> RateLimitResult:
+    allowed, remaining, retry_after_ms, reset_after_ms = result
+    return RateLimitResult(
+        allowed=bool(allowed),
+        remaining=int(remaining),
+        retry_after=int(retry_after_ms) / 1000,
+        reset_after=int(reset_after_ms) / 1000,
+    )
+
+
+def hit(key: str, limit: int, period: float, guard: Optional[RateLimitGuard] = None) -> RateLimitResult:
+    """Takes one request from `limit` per `period` seconds, one redis round trip"""
+    keys, args = _hit_keys_and_args(key, limit, period, guard)
+    return _parse_hit_result(HIT_SCRIPT(keys=keys, args=args))
+
+
+async def ahit(key: str, limit: int, period: float, guard: Optional[RateLimitGuard] = None) -> RateLimitResult:
+    keys, args = _hit_keys_and_args(key, limit, period, guard)
+    return _parse_hit_result(await HIT_SCRIPT.acall(keys=keys, args=args))
+
+
+def record(key: str, limit: int, period: float) -> None:
+    """Fills a bucket without checking it, used for guards"""
+    RECORD_SCRIPT(keys=[_make_key(key)], args=[limit, int(period * 1000)])
+
+
+async def arecord(key: str, limit: int, period: float) -> None:
+    await RECORD_SCRIPT.acall(keys=[_make_key(key)], args=[limit, int(period * 1000)])
+
+
+def _parse_peek_result(result) -> RateLimitResult:
+    remaining, reset_after_ms = result
+    return RateLimitResult(
+        allowed=int(remaining) > 0,
+        remaining=int(remaining),
+        retry_after=0,
+        reset_after=int(reset_after_ms) / 1000,
+    )
+
+
+def peek(key: str, limit: int, period: float) -> RateLimitResult:
+    """Reads a bucket without taking from it"""
+    return _parse_peek_result(PEEK_SCRIPT(keys=[_make_key(key)], args=[limit, int(period * 1000)]))
+
+
+async def apeek(key: str, limit: int, period: float) -> RateLimitResult:
+    return _parse_peek_result(await PEEK_SCRIPT.acall(keys=[_make_key(key)], args=[limit, int(period * 1000)]))
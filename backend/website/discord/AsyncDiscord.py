@@ -0,0 +1,277 @@
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+from asgiref.sync import sync_to_async
+
+from website.constants import DISCORD_BASE_URL, DISCORD_ACQUIRE_WAIT, DiscordRequestPriority
+from website.core.aioredis import cache_aget_many, cache_aset
+from website.core.errors import DiscordError, DiscordErrorMaxRetries
+from website.discord.CredentialState import CredentialState
+from website.discord.DiscordRoute import DiscordRoute
+from website.discord.Discord import DiscordManager, DiscordService, discord
+from website.discord.InvalidRequestGuard import invalid_request_guard
+from website.discord.UserState import UserState
+from website.models import Bot, Webhook, DiscordAttachmentMixin
+from website.services import cache_service
+
+logger = logging.getLogger("Discord")
+
+
+class AsyncRawDiscordAPI:
+    """
+    httpx.AsyncClient counterpart of RawDiscordAPI.
+    The client is bound to the event loop it was created on, so it's (re)created lazily per loop.
+    """
+
+    def __init__(self, timeout: float = 10.0):
+        self.base_url = DISCORD_BASE_URL
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+            self._loop = loop
+
+        return self._client
+
+    async def request(self, method: str, path: str, token: Optional[str] = None, params: dict = None, json: dict = None, files: dict = None, headers: dict = None) -> httpx.Response:
+        if headers is None:
+            headers = {}
+
+        if token:
+            headers["Authorization"] = f"Bot {token}"
+
+        url = f"{self.base_url}{path}"
+
+        return await self.client.request(
+            method=method,
+            url=url,
+            params=params,
+            json=json,
+            files=files,
+            headers=headers,
+        )
+
+    async def close(self) -> None:
+        client = self._client
+        self._client = None
+        self._loop = None
+
+        if client is not None and not client.is_closed:
+            await client.aclose()
+
+
+class AsyncDiscordManager:
+    """
+    Event loop friendly version of DiscordManager.
+    Shares UserState instances (and therefore redis credential state) with the sync manager,
+    waits for rate limits with asyncio.sleep instead of parking a thread.
+    """
+
+    MAX_RETRIES = DiscordManager.MAX_RETRIES
+
+    def __init__(self, manager: DiscordManager):
+        self._manager = manager
+        self._raw = AsyncRawDiscordAPI()
+
+    async def get_user_state(self, user) -> UserState:
+        state = self._manager.get_cached_user_state(user)
+        if state:
+            return state
+
+        # first use of a user in this process reads discord settings from the DB
+        return await sync_to_async(self._manager.get_user_state)(user)
+
+    async def _post_request_check(self, state: UserState, credential: CredentialState, response):
+        await invalid_request_guard.arecord(response)
+
+        block = DiscordManager.get_block_reason(response)
+        if block:
+            reason, discord_code = block
+            await state.ablock_credential(credential, None, reason, discord_code)
+
+    async def execute_bot_once(self, user, method: str, url: str, bot: Optional[Bot] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
+        await invalid_request_guard.acheck(priority)
+        state = await self.get_user_state(user)
+        route = DiscordRoute.for_bot(method, url)
+        credential = await state.aacquire_token(bot, wait=DISCORD_ACQUIRE_WAIT, route=route)
+
+        headers = {}
+        if credential.credential_type == "bot":
+            headers["Authorization"] = f"Bot {credential.secret}"
+
+        try:
+            response = await self._raw.request(
+                method=method,
+                path=url,
+                headers=headers,
+                json=json,
+                params=params,
+                files=files,
+            )
+            await self._post_request_check(state, credential, response)
+            await state.aupdate_from_headers(credential, response.headers, route)
+
+            if response.is_error:
+                raise DiscordError(response)
+
+        finally:
+            await state.arelease(credential)
+
+        return response
+
+    async def execute_bot_with_retries(self, user, method: str, url: str, bot: Optional[Bot] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
+        errors = []
+
+        for _ in range(self.MAX_RETRIES):
+            try:
+                response = await self.execute_bot_once(user, method, url, bot=bot, json=json, params=params, files=files, priority=priority)
+            except DiscordError as exc:
+                if exc.status in (429, 500, 502, 503):
+                    errors.append(exc)
+                    await asyncio.sleep(exc.retry_after)
+                    continue
+                else:
+                    raise exc
+
+            if response.is_success:
+                return response
+
+            errors.append(response)
+
+        raise DiscordErrorMaxRetries(errors)
+
+    async def execute_webhook_once(self, user, method: str, path: str, webhook: Optional[Webhook] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
+        await invalid_request_guard.acheck(priority)
+        state = await self.get_user_state(user)
+        route = DiscordRoute.for_webhook(method, path)
+        credential = await state.aacquire_webhook(webhook, wait=DISCORD_ACQUIRE_WAIT, route=route)
+
+        url = f"{credential.secret}{path}"
+
+        try:
+            response = await self._raw.client.request(
+                method=method,
+                url=url,
+                json=json,
+                params=params,
+                files=files,
+            )
+            await self._post_request_check(state, credential, response)
+            await state.aupdate_from_headers(credential, response.headers, route)
+
+            if response.is_error:
+                raise DiscordError(response)
+
+        finally:
+            await state.arelease(credential)
+
+        return response
+
+    async def execute_webhook_with_retries(self, user, method: str, path: str, webhook: Optional[Webhook] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
+        errors = []
+
+        for _ in range(self.MAX_RETRIES):
+            try:
+                response = await self.execute_webhook_once(user, method, path=path, webhook=webhook, json=json, params=params, files=files, priority=priority)
+            except DiscordError as exc:
+                if exc.status in (429, 500, 502, 503):
+                    errors.append(exc)
+                    await asyncio.sleep(exc.retry_after)
+                    continue
+                else:
+                    raise exc
+
+            if response.is_success:
+                return response
+
+            errors.append(response)
+
+        raise DiscordErrorMaxRetries(errors)
+
+    async def close(self) -> None:
+        await self._raw.close()
+
+
+class AsyncDiscordService:
+    """
+    Read side of DiscordService for code running on the event loop (streaming byte sources).
+    Message cache entries are shared with the sync service.
+    """
+
+    MAX_PARALLEL_MESSAGE_FETCHES = DiscordService.MAX_PARALLEL_MESSAGE_FETCHES
+
+    def __init__(self, service: DiscordService):
+        self.manager = AsyncDiscordManager(service.manager)
+
+    async def _fetch_message(self, user, channel_id: str, message_id: str, retries: bool = True, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL) -> dict:
+        path = DiscordService._discord_path(f"/channels/{channel_id}/messages/{message_id}")
+        if retries:
+            response = await self.manager.execute_bot_with_retries(user, "GET", path, priority=priority)
+        else:
+            response = await self.manager.execute_bot_once(user, "GET", path, priority=priority)
+        message = response.json()
+        key = cache_service.get_discord_message_key(message["id"])
+        await cache_aset(key, message, timeout=DiscordService.calculate_expiry(message))
+        return message
+
+    async def get_message(self, user, channel_id: str, message_id: str, retries: bool = True) -> dict:
+        messages = await self.get_messages(user, {message_id: channel_id}, retries=retries)
+        return messages[message_id]
+
+    async def get_cached_messages(self, message_ids: list[str]) -> dict[str, dict]:
+        """Single MGET, never talks to discord. :return: message_id -> message"""
+        keys = {cache_service.get_discord_message_key(message_id): message_id for message_id in message_ids}
+        cached = await cache_aget_many(list(keys))
+        return {keys[key]: message for key, message in cached.items() if message}
+
+    async def fetch_messages(self, user, channel_ids_by_message: dict[str, str], retries: bool = True, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL) -> dict[str, dict]:
+        """Fetches every given message from discord in parallel, bypassing the cache (but refreshing it)."""
+        semaphore = asyncio.Semaphore(self.MAX_PARALLEL_MESSAGE_FETCHES)
+
+        async def fetch(message_id: str) -> dict:
+            async with semaphore:
+                return await self._fetch_message(user, channel_ids_by_message[message_id], message_id, retries, priority)
+
+        message_ids = list(channel_ids_by_message)
+        fetched = await asyncio.gather(*(fetch(message_id) for message_id in message_ids))
+        return dict(zip(message_ids, fetched))
+
+    async def get_messages(self, user, channel_ids_by_message: dict[str, str], retries: bool = True) -> dict[str, dict]:
+        """
+        :param channel_ids_by_message: message_id -> channel discord_id
+        :return: message_id -> message
+        """
+        messages = await self.get_cached_messages(list(channel_ids_by_message))
+
+        missing = {message_id: channel_id for message_id, channel_id in channel_ids_by_message.items() if message_id not in messages}
+        if missing:
+            messages.update(await self.fetch_messages(user, missing, retries))
+
+        return messages
+
+    async def get_attachment_url(self, user, resource: DiscordAttachmentMixin, retries: bool = False) -> str:
+        urls = await self.get_attachment_urls(user, [resource], retries=retries)
+        return urls[resource.attachment_id]
+
+    async def get_attachment_urls(self, user, resources: list[DiscordAttachmentMixin], retries: bool = False) -> dict[str, str]:
+        """
+        Resources must have `channel` loaded (select_related), lazy loading is not allowed on the event loop.
+
+        :return: attachment_id -> url
+        """
+        messages = await self.get_messages(user, DiscordService.group_channels_by_message(resources), retries=retries)
+        return DiscordService.extract_attachment_urls(resources, messages)
+
+    async def close(self) -> None:
+        await self.manager.close()
+
+
+async_discord = AsyncDiscordService(discord)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Optional
+
+from website.constants import DiscordRequestPriority
+from website.discord.AsyncDiscord import async_discord
+from website.discord.Discord import DiscordService
+from website.models import DiscordAttachmentMixin
+
+logger = logging.getLogger("Discord")
+
+
+class AttachmentUrlWarmer:
+    """
+    In-process replacement for the old `prefetch_next_fragments` celery task.
+
+    Streams call `warm()` with the attachments they are going to need next, the warmer fetches
+    the missing discord messages in the background so the message cache is hot by the time
+    the stream gets there. Warm-ups are single-flight per message: if 3 viewers watch the same video,
+    each message is fetched once and everyone else waits for that fetch.
+
+    State is per worker process and per event loop.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.warmed = 0
+        self.failed = 0
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._inflight = {}
+            self._tasks = set()
+            self._loop = loop
+
+    def warm(self, user, resources: list[DiscordAttachmentMixin]) -> None:
+        """Fire and forget, never raises. Resources must have `channel` loaded."""
+        if not resources:
+            return
+
+        self._bind_loop()
+
+        channel_ids_by_message = {
+            message_id: channel_id
+            for message_id, channel_id in DiscordService.group_channels_by_message(resources).items()
+            if message_id not in self._inflight
+        }
+        if not channel_ids_by_message:
+            return
+
+        loop = asyncio.get_running_loop()
+        for message_id in channel_ids_by_message:
+            self._inflight[message_id] = loop.create_future()
+
+        task = asyncio.create_task(self._warm(user, channel_ids_by_message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _warm(self, user, channel_ids_by_message: dict[str, str]) -> None:
+        try:
+            cached = await async_discord.get_cached_messages(list(channel_ids_by_message))
+            missing = {message_id: channel_id for message_id, channel_id in channel_ids_by_message.items() if message_id not in cached}
+
+            if missing:
+                # no retries: a warm-up is best effort, the stream will fetch (with retries) on its own if this fails
+                await async_discord.fetch_messages(user, missing, retries=False, priority=DiscordRequestPriority.LOW)
+                self.warmed += len(missing)
+
+        except Exception as e:
+            self.failed += 1
+            logger.info(f"Failed to warm attachment urls: {e}")
+
+        finally:
+            for message_id in channel_ids_by_message:
+                future = self._inflight.pop(message_id, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+    async def get_attachment_urls(self, user, resources: list[DiscordAttachmentMixin], retries: bool = False) -> dict[str, str]:
+        """
+        Same contract as AsyncDiscordService.get_attachment_urls, but joins warm-ups that are already in flight
+        instead of racing them with a duplicate discord call.
+
+        :return: attachment_id -> url
+        """
+        self._bind_loop()
+
+        channel_ids_by_message = DiscordService.group_channels_by_message(resources)
+
+        inflight = [self._inflight[message_id] for message_id in channel_ids_by_message if message_id in self._inflight]
+        if inflight:
+            await asyncio.wait(inflight)
+
+        messages = await async_discord.get_cached_messages(list(channel_ids_by_message))
+        missing = {message_id: channel_id for message_id, channel_id in channel_ids_by_message.items() if message_id not in messages}
+
+        self.hits += len(messages)
+        self.misses += len(missing)
+
+        if missing:
+            messages.update(await async_discord.fetch_messages(user, missing, retries=retries))
+
+        return DiscordService.extract_attachment_urls(resources, messages)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": self.hits / lookups if lookups else None,
+            "warmed": self.warmed,
+            "failed": self.failed,
+            "inflight": len(self._inflight),
+        }
+
+
+url_warmer = AttachmentUrlWarmer()
@@ -21,10 +21,13 @@ class CredentialState:
     blocked_until: Optional[float] = None
     block_reason: str = ""
     discord_error_code: Optional[int] = None
+    # set by acquire, release gives this lease back. Not stored in the credential hash
+    lease_id: str = ""
 
     def to_dict(self) -> Dict[str, Any]:
         data = self.__dict__.copy()
         data.pop("secret", None)
+        data.pop("lease_id", None)
         data["blocked_until"] = normalize_blocked_until(data.get("blocked_until"))
         return data
 
@@ -1,6 +1,7 @@
 import json
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, UTC
 from threading import Lock
 from typing import Optional
@@ -9,9 +10,11 @@ from urllib.parse import urlparse, parse_qs
 import httpx
 from httpx import Response
 
-from website.constants import DISCORD_BASE_URL, cache
-from website.core.errors import DiscordError, CannotProcessDiscordRequestError, DiscordErrorMaxRetries, DiscordTextError, BadRequestError
+from website.constants import DISCORD_BASE_URL, DISCORD_ACQUIRE_WAIT, cache, DiscordRequestPriority
+from website.core.errors import DiscordError, DiscordErrorMaxRetries, DiscordTextError, BadRequestError
 from website.discord.CredentialState import CredentialState
+from website.discord.DiscordRoute import DiscordRoute
+from website.discord.InvalidRequestGuard import invalid_request_guard
 from website.discord.UserState import UserState
 from website.models import Bot, Webhook, DiscordAttachmentMixin
 from website.queries.selectors import query_attachments
@@ -73,9 +76,14 @@ class DiscordManager:
         with self._lock:
             self._users.pop(user.id, None)
 
-    def _post_request_check(self, state: UserState, credential: CredentialState, response):
+    def get_cached_user_state(self, user) -> Optional[UserState]:
+        return self._users.get(user.id)
+
+    @staticmethod
+    def get_block_reason(response) -> Optional[tuple[str, Optional[int]]]:
+        """:return: (reason, discord_code) if the credential used for this response has to be blocked"""
         if response.is_success:
-            return
+            return None
 
         status = response.status_code
 
@@ -86,30 +94,39 @@ class DiscordManager:
 
         discord_code = data.get("code")
         if status == 401:
-            state.block_credential(credential, None, "unauthorized", discord_code)
-            return
+            return "unauthorized", discord_code
 
         if status == 403:
-            state.block_credential(credential, None, "forbidden", discord_code)
-            return
+            return "forbidden", discord_code
 
         if status == 404:
             # 10015: Unknown Webhook
             # 10008: Unknown Message
             # 10003: Unknown Channel
             if discord_code in (10015, 10003):
-                state.block_credential(credential, None, "notFound", discord_code)
-            return
+                return "notFound", discord_code
+            return None
 
         if status == 429:
             is_global = data.get("global", False)
             if is_global:
-                state.block_credential(credential, None, "cloudflareGlobalLimit", discord_code)
-                return
+                return "cloudflareGlobalLimit", discord_code
+
+        return None
+
+    def _post_request_check(self, state: UserState, credential: CredentialState, response):
+        invalid_request_guard.record(response)
+
+        block = self.get_block_reason(response)
+        if block:
+            reason, discord_code = block
+            state.block_credential(credential, None, reason, discord_code)
 
-    def execute_bot_once(self, user, method: str, url: str, bot: Optional[Bot] = None, json=None, params=None, files=None):
+    def execute_bot_once(self, user, method: str, url: str, bot: Optional[Bot] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
+        invalid_request_guard.check(priority)
         state = self.get_user_state(user)
-        credential = state.acquire_token(bot)
+        route = DiscordRoute.for_bot(method, url)
+        credential = state.acquire_token(bot, wait=DISCORD_ACQUIRE_WAIT, route=route)
 
         headers = {}
         if credential.credential_type == "bot":
@@ -127,7 +144,7 @@ class DiscordManager:
             self._post_request_check(state, credential, response)
 
             # todo fix this to ensure its ALWAYS called
-            state.update_from_headers(credential, response.headers)
+            state.update_from_headers(credential, response.headers, route)
 
             if response.is_error:
                 raise DiscordError(response)
@@ -137,12 +154,12 @@ class DiscordManager:
 
         return response
 
-    def execute_bot_with_retries(self, user, method: str, url: str, bot: Optional[Bot] = None, json=None, params=None, files=None):
+    def execute_bot_with_retries(self, user, method: str, url: str, bot: Optional[Bot] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
         errors = []
 
-        for attempt in range(1, self.MAX_RETRIES + 1):
+        for _ in range(self.MAX_RETRIES):
             try:
-                response = self.execute_bot_once(user, method, url, bot=bot, json=json, params=params, files=files)
+                response = self.execute_bot_once(user, method, url, bot=bot, json=json, params=params, files=files, priority=priority)
             except DiscordError as exc:
                 if exc.status in (429, 500, 502, 503):
                     errors.append(exc)
@@ -150,10 +167,6 @@ class DiscordManager:
                     continue
                 else:
                     raise exc
-            except CannotProcessDiscordRequestError as e:
-                print(f"CannotProcessDiscordRequestError: {str(e)}")
-                time.sleep(min(2 ** attempt, 5))
-                continue
 
             if response.is_success:
                 return response
@@ -162,9 +175,11 @@ class DiscordManager:
 
         raise DiscordErrorMaxRetries(errors)
 
-    def execute_webhook_once(self, user, method: str, path: str, webhook: Optional[Webhook] = None, json=None, params=None, files=None):
+    def execute_webhook_once(self, user, method: str, path: str, webhook: Optional[Webhook] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
+        invalid_request_guard.check(priority)
         state = self.get_user_state(user)
-        credential = state.acquire_webhook(webhook)
+        route = DiscordRoute.for_webhook(method, path)
+        credential = state.acquire_webhook(webhook, wait=DISCORD_ACQUIRE_WAIT, route=route)
 
         url = f"{credential.secret}{path}"
 
@@ -177,7 +192,7 @@ class DiscordManager:
                 files=files,
             )
             self._post_request_check(state, credential, response)
-            state.update_from_headers(credential, response.headers)
+            state.update_from_headers(credential, response.headers, route)
 
             if response.is_error:
                 raise DiscordError(response)
@@ -187,12 +202,12 @@ class DiscordManager:
 
         return response
 
-    def execute_webhook_with_retries(self, user, method: str, path: str, webhook: Optional[Webhook] = None, json=None, params=None, files=None):
+    def execute_webhook_with_retries(self, user, method: str, path: str, webhook: Optional[Webhook] = None, json=None, params=None, files=None, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
         errors = []
 
-        for attempt in range(1, self.MAX_RETRIES + 1):
+        for _ in range(self.MAX_RETRIES):
             try:
-                response = self.execute_webhook_once(user, method, path=path, webhook=webhook, json=json, params=params, files=files)
+                response = self.execute_webhook_once(user, method, path=path, webhook=webhook, json=json, params=params, files=files, priority=priority)
             except DiscordError as exc:
                 if exc.status in (429, 500, 502, 503):
                     errors.append(exc)
@@ -200,9 +215,6 @@ class DiscordManager:
                     continue
                 else:
                     raise exc
-            except CannotProcessDiscordRequestError as e:
-                time.sleep(min(2 ** attempt, 10))
-                continue
 
             if response.is_success:
                 return response
@@ -213,6 +225,8 @@ class DiscordManager:
 
 
 class DiscordService:
+    MAX_PARALLEL_MESSAGE_FETCHES = 8
+
     def __init__(self, base_url: str = DISCORD_BASE_URL):
         self.manager = DiscordManager()
         self.base_url = base_url
@@ -238,7 +252,8 @@ class DiscordService:
             return attachments[0].channel.discord_id
         raise DiscordTextError(f"Unable to find channel id associated with message ID={message_id}", 404)
 
-    def _calculate_expiry(self, message: dict) -> float:
+    @staticmethod
+    def calculate_expiry(message: dict) -> float:
         try:
             url = message["attachments"][0]["url"]
             parsed_url = urlparse(url)
@@ -254,7 +269,8 @@ class DiscordService:
         except (KeyError, IndexError, ValueError):
             return 60 * 60 * 24
 
-    def _discord_path(self, path: str) -> str:
+    @staticmethod
+    def _discord_path(path: str) -> str:
         # append / if needed
         return path if path.startswith("/") else f"/{path}"
 
@@ -262,30 +278,69 @@ class DiscordService:
     # Core Discord operations (bot)
     # -------------------------
 
-    def get_message(self, user, channel_id: str, message_id: str, retries: bool = True) -> dict:
-        key = cache_service.get_discord_message_key(message_id)
-        cached = cache.get(key)
-        if cached:
-            return cached
-
+    def _fetch_message(self, user, channel_id: str, message_id: str, retries: bool = True, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL) -> dict:
         path = self._discord_path(f"/channels/{channel_id}/messages/{message_id}")
         if retries:
-            response = self.manager.execute_bot_with_retries(user, "GET", path)
+            response = self.manager.execute_bot_with_retries(user, "GET", path, priority=priority)
         else:
-            response = self.manager.execute_bot_once(user, "GET", path)
+            response = self.manager.execute_bot_once(user, "GET", path, priority=priority)
         message = response.json()
         key = cache_service.get_discord_message_key(message["id"])
-        cache.set(key, message, timeout=self._calculate_expiry(message))
+        cache.set(key, message, timeout=self.calculate_expiry(message))
         return message
 
-    def delete_message(self, user, channel_id, message_id: str) -> Response:
+    def get_message(self, user, channel_id: str, message_id: str, retries: bool = True) -> dict:
+        key = cache_service.get_discord_message_key(message_id)
+        cached = cache.get(key)
+        if cached:
+            return cached
+
+        return self._fetch_message(user, channel_id, message_id, retries)
+
+    def get_messages(self, user, channel_ids_by_message: dict[str, str], retries: bool = True, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL) -> dict[str, dict]:
+        """
+        Fetches many messages at once.
+        Cached messages are read with a single MGET, every distinct uncached message costs exactly 1 discord call.
+        Those calls run in parallel, the credential pool in UserState spreads them across bots.
+
+        :param channel_ids_by_message: message_id -> channel discord_id
+        :return: message_id -> message
+        """
+        keys = {cache_service.get_discord_message_key(message_id): message_id for message_id in channel_ids_by_message}
+        cached = cache.get_many(list(keys))
+
+        messages = {keys[key]: message for key, message in cached.items() if message}
+        missing = [message_id for message_id in channel_ids_by_message if message_id not in messages]
+
+        if not missing:
+            return messages
+
+        if len(missing) == 1:
+            message_id = missing[0]
+            messages[message_id] = self._fetch_message(user, channel_ids_by_message[message_id], message_id, retries, priority)
+            return messages
+
+        # UserState touches the DB on first use, do it here rather than inside worker threads
+        self.get_user_state(user)
+
+        with ThreadPoolExecutor(max_workers=min(len(missing), self.MAX_PARALLEL_MESSAGE_FETCHES)) as executor:
+            futures = {
+                message_id: executor.submit(self._fetch_message, user, channel_ids_by_message[message_id], message_id, retries, priority)
+                for message_id in missing
+            }
+            for message_id, future in futures.items():
+                messages[message_id] = future.result()
+
+        return messages
+
+    def delete_message(self, user, channel_id, message_id: str, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL) -> Response:
         path = self._discord_path(f"/channels/{channel_id}/messages/{message_id}")
-        return self.manager.execute_bot_with_retries(user, "DELETE", path)
+        return self.manager.execute_bot_with_retries(user, "DELETE", path, priority=priority)
 
-    def bulk_delete_messages(self, user, channel_id, message_ids: list[str]) -> Response:
+    def bulk_delete_messages(self, user, channel_id, message_ids: list[str], priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL) -> Response:
         path = self._discord_path(f"/channels/{channel_id}/messages/bulk-delete")
         payload = {"messages": message_ids}
-        return self.manager.execute_bot_with_retries(user, "POST", path, json=payload)
+        return self.manager.execute_bot_with_retries(user, "POST", path, json=payload, priority=priority)
 
     def _get_file_url(self, user, message_id: str, attachment_id: str, channel_id: str, retries: bool = True) -> str:
         message = self.get_message(user, channel_id, message_id, retries)
@@ -297,6 +352,40 @@ class DiscordService:
     def get_attachment_url(self, user, resource: DiscordAttachmentMixin, retries: bool = False) -> str:
         return self._get_file_url(user, resource.message_id, resource.attachment_id, resource.channel.discord_id, retries=retries)
 
+    def get_attachment_urls(self, user, resources: list[DiscordAttachmentMixin], retries: bool = False, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL) -> dict[str, str]:
+        """
+        Batch version of get_attachment_url. Resources sharing a message are resolved with a single lookup.
+        Resources must have `channel` loaded (select_related) to avoid a query per resource.
+
+        :return: attachment_id -> url
+        """
+        messages = self.get_messages(user, self.group_channels_by_message(resources), retries=retries, priority=priority)
+        return self.extract_attachment_urls(resources, messages)
+
+    @staticmethod
+    def group_channels_by_message(resources: list[DiscordAttachmentMixin]) -> dict[str, str]:
+        """:return: message_id -> channel discord_id"""
+        channel_ids_by_message = {}
+        for resource in resources:
+            if resource.message_id not in channel_ids_by_message:
+                channel_ids_by_message[resource.message_id] = resource.channel.discord_id
+        return channel_ids_by_message
+
+    @staticmethod
+    def extract_attachment_urls(resources: list[DiscordAttachmentMixin], messages: dict[str, dict]) -> dict[str, str]:
+        """:return: attachment_id -> url"""
+        urls = {}
+        for resource in resources:
+            message = messages[resource.message_id]
+            for attachment in message.get("attachments", []):
+                if attachment.get("id") == resource.attachment_id:
+                    urls[resource.attachment_id] = attachment.get("url")
+                    break
+            else:
+                raise BadRequestError(f"File with attachment_id={resource.attachment_id} not found in message_id={resource.message_id}")
+
+        return urls
+
     # -------------------------
     # Attachment editing
     # -------------------------
@@ -321,20 +410,20 @@ class DiscordService:
     # Fetch / pagination
     # -------------------------
 
-    def fetch_messages(self, user, channel_id: str, limit: int = 100):
+    def fetch_messages(self, user, channel_id: str, limit: int = 100, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
         path = self._discord_path(f"/channels/{channel_id}/messages")
         params = {"limit": int(limit)}
 
         while True:
-            response = self.manager.execute_bot_with_retries(user, "GET", path, params=params)
+            response = self.manager.execute_bot_with_retries(user, "GET", path, params=params, priority=priority)
             batch = response.json()
             if not batch:
                 break
             yield batch
             params["before"] = batch[-1]["id"]
 
-    def fetch_all_messages(self, user, channel_id: str, limit: int = 100):
-        for batch in self.fetch_messages(user, channel_id, limit=limit):
+    def fetch_all_messages(self, user, channel_id: str, limit: int = 100, priority: DiscordRequestPriority = DiscordRequestPriority.NORMAL):
+        for batch in self.fetch_messages(user, channel_id, limit=limit, priority=priority):
             for msg in batch:
                 yield msg
 
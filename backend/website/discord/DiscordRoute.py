@@ -0,0 +1,28 @@
+import re
+from dataclasses import dataclass
+
+_SNOWFLAKE = re.compile(r"/\d{15,25}(?=/|$)")
+_MAJOR_PARAMETER = re.compile(r"^/(?:channels|guilds)/(\d+)")
+
+
+@dataclass(frozen=True)
+class DiscordRoute:
+    """
+    What discord rate limits a request by.
+    The route template maps to a bucket (learnt from X-RateLimit-Bucket, several routes can share one),
+    the major parameter (channel / guild id) splits that bucket further.
+    """
+    key: str
+    major: str = ""
+
+    @classmethod
+    def for_bot(cls, method: str, path: str) -> "DiscordRoute":
+        path = path.split("?", 1)[0]
+        match = _MAJOR_PARAMETER.match(path)
+        return cls(f"{method} {_SNOWFLAKE.sub('/{id}', path)}", match.group(1) if match else "")
+
+    @classmethod
+    def for_webhook(cls, method: str, path: str) -> "DiscordRoute":
+        # a webhook is its own credential, so there's no major parameter left to split by
+        path = path.split("?", 1)[0]
+        return cls(f"{method} /webhooks/{{id}}/{{token}}{_SNOWFLAKE.sub('/{id}', path)}")
@@ -0,0 +1,108 @@
+import time
+
+from website.constants import DISCORD_INVALID_REQUEST_LIMIT, DISCORD_INVALID_REQUEST_WINDOW, DISCORD_INVALID_REQUEST_CHECK_INTERVAL, DISCORD_INVALID_REQUEST_SHED_AT, \
+    DiscordRequestPriority
+from website.core import ratelimit
+from website.core.errors import CannotProcessDiscordRequestError
+from website.core.ratelimit import RateLimitResult
+
+
+class InvalidRequestGuard:
+    """
+    Discord bans the whole server IP after too many invalid requests (401, 403 and non shared 429),
+    no matter which user or bot made them. Every worker records its invalid responses into one
+    redis bucket (core.ratelimit, drains continuously over DISCORD_INVALID_REQUEST_WINDOW),
+    requests are refused by priority as the bucket fills up, low priority work goes first.
+
+    Each process re-reads the bucket at most every DISCORD_INVALID_REQUEST_CHECK_INTERVAL,
+    right away after recording an invalid response itself.
+    """
+
+    KEY = "discord-invalid-requests"
+
+    def __init__(self):
+        self._budget: RateLimitResult | None = None
+        self._checked_at = float("-inf")
+
+        self.recorded = 0
+        self.shed = {priority.value: 0 for priority in DiscordRequestPriority}
+
+    @staticmethod
+    def is_invalid(response) -> bool:
+        status = response.status_code
+        if status == 429:
+            # shared resource limits don't count towards the ban
+            return response.headers.get("X-RateLimit-Scope") != "shared"
+
+        return status in (401, 403)
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self._checked_at >= DISCORD_INVALID_REQUEST_CHECK_INTERVAL
+
+    def _update(self, budget: RateLimitResult) -> None:
+        self._budget = budget
+        self._checked_at = time.monotonic()
+
+    @staticmethod
+    def _used_ratio(budget: RateLimitResult) -> float:
+        return 1 - budget.remaining / DISCORD_INVALID_REQUEST_LIMIT
+
+    def _check_budget(self, priority: DiscordRequestPriority) -> None:
+        used = self._used_ratio(self._budget)
+        shed_at = DISCORD_INVALID_REQUEST_SHED_AT[priority]
+
+        if used >= shed_at:
+            self.shed[priority.value] += 1
+            # the bucket drains linearly, the whole of it over one window
+            retry_after = (used - shed_at) * DISCORD_INVALID_REQUEST_WINDOW
+            raise CannotProcessDiscordRequestError(f"Too many invalid discord requests lately, {priority.value} priority requests are paused", retry_after=retry_after)
+
+    def check(self, priority: DiscordRequestPriority) -> None:
+        """Raises CannotProcessDiscordRequestError if requests of this priority are being shed"""
+        if self._is_stale():
+            self._update(ratelimit.peek(self.KEY, DISCORD_INVALID_REQUEST_LIMIT, DISCORD_INVALID_REQUEST_WINDOW))
+
+        self._check_budget(priority)
+
+    async def acheck(self, priority: DiscordRequestPriority) -> None:
+        if self._is_stale():
+            self._update(await ratelimit.apeek(self.KEY, DISCORD_INVALID_REQUEST_LIMIT, DISCORD_INVALID_REQUEST_WINDOW))
+
+        self._check_budget(priority)
+
+    def record(self, response) -> None:
+        if not self.is_invalid(response):
+            return
+
+        ratelimit.record(self.KEY, DISCORD_INVALID_REQUEST_LIMIT, DISCORD_INVALID_REQUEST_WINDOW)
+        self.recorded += 1
+        self._checked_at = float("-inf")
+
+    async def arecord(self, response) -> None:
+        if not self.is_invalid(response):
+            return
+
+        await ratelimit.arecord(self.KEY, DISCORD_INVALID_REQUEST_LIMIT, DISCORD_INVALID_REQUEST_WINDOW)
+        self.recorded += 1
+        self._checked_at = float("-inf")
+
+    def stats(self) -> dict:
+        budget = ratelimit.peek(self.KEY, DISCORD_INVALID_REQUEST_LIMIT, DISCORD_INVALID_REQUEST_WINDOW)
+        self._update(budget)
+        used = self._used_ratio(budget)
+
+        return {
+            "limit": DISCORD_INVALID_REQUEST_LIMIT,
+            "window": DISCORD_INVALID_REQUEST_WINDOW,
+            "remaining": budget.remaining,
+            "usedRatio": used,
+            "resetAfter": budget.reset_after,
+            "shedAt": {priority.value: shed_at for priority, shed_at in DISCORD_INVALID_REQUEST_SHED_AT.items()},
+            "shedding": [priority.value for priority, shed_at in DISCORD_INVALID_REQUEST_SHED_AT.items() if used >= shed_at],
+            # per worker process
+            "recorded": self.recorded,
+            "shed": self.shed,
+        }
+
+
+invalid_request_guard = InvalidRequestGuard()
@@ -1,16 +1,447 @@
+import asyncio
+import hashlib
 import json
 import time
+import uuid
 from typing import Optional, Dict, Any
 
 from django_redis import get_redis_connection
 
+from website.constants import DISCORD_ACQUIRE_POLL_INTERVAL, DISCORD_ACQUIRE_WAIT_SAMPLES, DISCORD_CREDENTIAL_LEASE_TTL
+from website.core.aioredis import get_async_redis_connection
 from website.core.errors import BadRequestError, DiscordBlockError, CannotProcessDiscordRequestError
 from website.core.helpers import normalize_blocked_until
+from website.core.luascript import LuaScript
 from website.discord.CredentialState import CredentialState, CredentialType
+from website.discord.DiscordRoute import DiscordRoute
 from website.discord.utils import decode_redis_hash
 from website.models import DiscordSettings, Webhook, Bot, Channel
 
 
+# ------------------------------------------------------------------
+# Credential schedule
+# Every user has a sorted set of credential keys per credential type, scored by when
+# the credential can be used next: its last use while it's usable (least recently used comes first),
+# the end of its block otherwise, the expiry of its oldest lease while it's at max concurrency.
+# Every script that changes a credential reschedules it, so acquire only looks at the head of the set.
+#
+# Leases
+# Every acquire adds a lease (acquire id scored by its expiry) to the credential's lease set, release removes it.
+# in_flight is the number of live leases, expired ones are pruned by every script that looks at it,
+# so a worker that dies mid request only holds its slot for DISCORD_CREDENTIAL_LEASE_TTL.
+#
+# Route buckets
+# Discord rate limits per route bucket, not per credential. Each credential has a hash of
+# bucket states ({bucket}|{major parameter} -> remaining, reset, limit, window), the route -> bucket
+# mapping is learnt from X-RateLimit-Bucket and shared by everyone. A route whose bucket isn't known
+# yet is its own bucket. Acquire skips due credentials whose bucket for the route is exhausted,
+# so a busy route doesn't hold up the others.
+#
+# Waiting queue
+# Callers that wait for a credential queue up per credential type and route (sorted set scored
+# by arrival), only the head of a queue may take a credential. Whatever frees a credential pushes
+# to the wake list of every queue head of that type, the waiter BLPOPs on it. Waiters keep a marker
+# key alive until their deadline, a waiter whose marker expired (worker died) is dropped when it reaches the head.
+# ------------------------------------------------------------------
+
+SCHEDULE_HELPERS = """
+    local function parse_until(raw)
+        if not raw or raw == '' then
+            return nil
+        end
+        if raw == 'inf' then
+            return math.huge
+        end
+        return tonumber(raw)
+    end
+
+    local function max_concurrent_of(meta_key)
+        return tonumber(redis.call('HGET', meta_key, 'max_concurrent_per_token') or '1')
+    end
+
+    -- drops expired leases and mirrors the live ones into in_flight, :return: live lease count
+    local function prune_leases(credential_key, now)
+        local leases_key = credential_key .. ':leases'
+        redis.call('ZREMRANGEBYSCORE', leases_key, '-inf', now)
+        local in_flight = redis.call('ZCARD', leases_key)
+        redis.call('HSET', credential_key, 'in_flight', in_flight)
+        return in_flight
+    end
+
+    -- when the credential can be used next, nil if it can be used right now
+    local function available_at(credential_key, now, max_concurrent)
+        local blocked_until = parse_until(redis.call('HGET', credential_key, 'blocked_until'))
+        if blocked_until and now < blocked_until then
+            return blocked_until
+        end
+
+        if prune_leases(credential_key, now) >= max_concurrent then
+            -- a release frees it earlier, the oldest lease running out at the latest
+            local oldest = redis.call('ZRANGE', credential_key .. ':leases', 0, 0, 'WITHSCORES')
+            return tonumber(oldest[2])
+        end
+
+        return nil
+    end
+
+    -- :return: same as available_at
+    local function schedule(credential_key, now, max_concurrent, bot_schedule_key, webhook_schedule_key)
+        local schedule_key = webhook_schedule_key
+        if redis.call('HGET', credential_key, 'credential_type') == 'bot' then
+            schedule_key = bot_schedule_key
+        end
+
+        local at = available_at(credential_key, now, max_concurrent)
+        local score = at
+        if at == nil then
+            score = tonumber(redis.call('HGET', credential_key, 'last_used') or '0')
+        end
+
+        if score == math.huge then
+            redis.call('ZADD', schedule_key, '+inf', credential_key)
+        else
+            redis.call('ZADD', schedule_key, score, credential_key)
+        end
+
+        return at
+    end
+
+    local function bucket_id(route_buckets_key, route, major)
+        local bucket = redis.call('HGET', route_buckets_key, route) or route
+        return bucket .. '|' .. major
+    end
+
+    -- when the credential's bucket lets a request through again, nil if it does now
+    local function bucket_until(credential_key, bucket, now)
+        local state = redis.call('HMGET', credential_key .. ':buckets', bucket .. ':remaining', bucket .. ':reset')
+        local remaining, reset = tonumber(state[1]), tonumber(state[2])
+
+        if remaining == nil or remaining > 0 then
+            return nil
+        end
+        if reset and now < reset then
+            return reset
+        end
+        return nil
+    end
+
+    local function bucket_take(credential_key, bucket, now)
+        local buckets_key = credential_key .. ':buckets'
+        local state = redis.call('HMGET', buckets_key, bucket .. ':reset', bucket .. ':limit', bucket .. ':window')
+        local reset, limit, window = tonumber(state[1]), tonumber(state[2]), tonumber(state[3])
+
+        -- never seen a response from this bucket, its headers will tell
+        if not limit then
+            return
+        end
+
+        if reset and now < reset then
+            redis.call('HINCRBY', buckets_key, bucket .. ':remaining', -1)
+        else
+            -- a new window, guess its end from the last one until discord's headers say
+            redis.call('HSET', buckets_key, bucket .. ':remaining', limit - 1, bucket .. ':reset', now + (window or 1))
+        end
+    end
+
+    local function queue_head(queue_key, waiter_prefix)
+        while true do
+            local head = redis.call('ZRANGE', queue_key, 0, 0)[1]
+            if not head then
+                return nil
+            end
+            if redis.call('EXISTS', waiter_prefix .. head) == 1 then
+                return head
+            end
+            redis.call('ZREM', queue_key, head)
+        end
+    end
+
+    local function wake(queue_key, waiter_prefix)
+        local head = queue_head(queue_key, waiter_prefix)
+        if head then
+            local wake_key = waiter_prefix .. head .. ':wake'
+            redis.call('DEL', wake_key)
+            redis.call('RPUSH', wake_key, 1)
+            redis.call('PEXPIRE', wake_key, 60000)
+        end
+        return head
+    end
+
+    local function wake_all(queues_key, waiter_prefix)
+        for _, queue_key in ipairs(redis.call('SMEMBERS', queues_key)) do
+            if not wake(queue_key, waiter_prefix) then
+                redis.call('SREM', queues_key, queue_key)
+            end
+        end
+    end
+
+    -- reschedules a credential and wakes the waiters of its type if it's usable now
+    -- KEYS = credential, meta, bot schedule, webhook schedule, bot queues, webhook queues
+    local function reschedule_and_wake(now, waiter_prefix)
+        if schedule(KEYS[1], now, max_concurrent_of(KEYS[2]), KEYS[3], KEYS[4]) == nil then
+            if redis.call('HGET', KEYS[1], 'credential_type') == 'bot' then
+                wake_all(KEYS[5], waiter_prefix)
+            else
+                wake_all(KEYS[6], waiter_prefix)
+            end
+        end
+    end
+"""
+
+# KEYS = meta, credentials_by_secret, bot schedule, webhook schedule, queue of the requested type and route,
+#        queues of the requested type, wait samples, route buckets
+# ARGV = now, max_concurrent, requested_type, requested_secret, waiter_id, waiter_ttl_ms, waiter_prefix, waited_ms, max_samples,
+#        route, major parameter, lease id, lease ttl
+ACQUIRE_SCRIPT = LuaScript(SCHEDULE_HELPERS + """
+    local now = tonumber(ARGV[1])
+    local max_concurrent = tonumber(ARGV[2])
+    local requested_type = ARGV[3]
+    local requested_secret = ARGV[4]
+    local waiter_id = ARGV[5]
+    local waiter_ttl = tonumber(ARGV[6])
+    local waiter_prefix = ARGV[7]
+    local bucket = bucket_id(KEYS[8], ARGV[10], ARGV[11])
+
+    local global_blocked_until = parse_until(redis.call('HGET', KEYS[1], 'blocked_until'))
+    if global_blocked_until then
+        if now < global_blocked_until then
+            return cjson.encode({ ok = false, code = 'GLOBAL_BLOCK', retry_after = global_blocked_until - now })
+        end
+        redis.call('HDEL', KEYS[1], 'blocked_until')
+    end
+
+    local function take(credential_key)
+        bucket_take(credential_key, bucket, now)
+        redis.call('ZADD', credential_key .. ':leases', now + tonumber(ARGV[13]), ARGV[12])
+        prune_leases(credential_key, now)
+        redis.call('HSET', credential_key, 'last_used', now)
+        schedule(credential_key, now, max_concurrent, KEYS[3], KEYS[4])
+
+        if ARGV[8] ~= '' then
+            redis.call('LPUSH', KEYS[7], ARGV[8])
+            redis.call('LTRIM', KEYS[7], 0, tonumber(ARGV[9]) - 1)
+        end
+
+        return cjson.encode({ ok = true, credential_key = credential_key })
+    end
+
+    local function unavailable(code, at)
+        if at == nil or at == math.huge then
+            return cjson.encode({ ok = false, code = code })
+        end
+        return cjson.encode({ ok = false, code = code, retry_after = math.max(at - now, 0) })
+    end
+
+    if requested_secret ~= '' then
+        local credential_key = redis.call('HGET', KEYS[2], requested_secret)
+        if not credential_key then
+            return cjson.encode({ ok = false, code = 'NOT_FOUND' })
+        end
+
+        local ctype = redis.call('HGET', credential_key, 'credential_type')
+        if requested_type ~= '' and ctype ~= requested_type then
+            return cjson.encode({ ok = false, code = 'TYPE_MISMATCH' })
+        end
+
+        local blocked_until = parse_until(redis.call('HGET', credential_key, 'blocked_until'))
+        if blocked_until and now < blocked_until then
+            return unavailable('CREDENTIAL_BLOCKED', blocked_until)
+        end
+
+        local at = available_at(credential_key, now, max_concurrent) or bucket_until(credential_key, bucket, now)
+        if at == nil then
+            return take(credential_key)
+        end
+
+        return unavailable('UNAVAILABLE', at)
+    end
+
+    local schedule_keys = {}
+    if requested_type == '' or requested_type == 'bot' then
+        table.insert(schedule_keys, KEYS[3])
+    end
+    if requested_type == '' or requested_type == 'webhook' then
+        table.insert(schedule_keys, KEYS[4])
+    end
+
+    -- soonest time anything in the schedules frees up, nil if nothing will by itself
+    local function next_due(soonest)
+        for _, schedule_key in ipairs(schedule_keys) do
+            local entry = redis.call('ZRANGEBYSCORE', schedule_key, '(' .. now, '+inf', 'WITHSCORES', 'LIMIT', 0, 1)
+            if entry[1] then
+                local score = tonumber(entry[2])
+                if soonest == nil or score < soonest then
+                    soonest = score
+                end
+            end
+        end
+        return soonest
+    end
+
+    local function any_due()
+        for _, schedule_key in ipairs(schedule_keys) do
+            if redis.call('ZCOUNT', schedule_key, '-inf', now) > 0 then
+                return true
+            end
+        end
+        return false
+    end
+
+    local function enqueue()
+        if waiter_id == '' then
+            return
+        end
+        if not redis.call('ZSCORE', KEYS[5], waiter_id) then
+            redis.call('ZADD', KEYS[5], redis.call('HINCRBY', KEYS[1], 'waiter_seq', 1), waiter_id)
+            redis.call('SADD', KEYS[6], KEYS[5])
+        end
+        redis.call('SET', waiter_prefix .. waiter_id, 1, 'PX', waiter_ttl)
+    end
+
+    -- only the untyped acquire skips the queue, nothing waits on it
+    local queued = requested_type ~= ''
+    local first = queued and queue_head(KEYS[5], waiter_prefix)
+
+    if first and first ~= waiter_id then
+        -- somebody has been waiting longer for this route, get in line
+        enqueue()
+        return unavailable('QUEUED', next_due(nil))
+    end
+
+    -- due credentials in least recently used order, skipping those whose bucket for the route is exhausted.
+    -- entries that aren't usable after all (stale) get rescheduled on the way
+    local soonest = nil
+    for _, schedule_key in ipairs(schedule_keys) do
+        for _, credential_key in ipairs(redis.call('ZRANGEBYSCORE', schedule_key, '-inf', now, 'LIMIT', 0, 16)) do
+            if available_at(credential_key, now, max_concurrent) == nil then
+                local bucket_reset = bucket_until(credential_key, bucket, now)
+
+                if bucket_reset == nil then
+                    local result = take(credential_key)
+
+                    if first then
+                        redis.call('ZREM', KEYS[5], waiter_id)
+                        redis.call('DEL', waiter_prefix .. waiter_id, waiter_prefix .. waiter_id .. ':wake')
+
+                        -- more than one credential may have freed up, pass it on
+                        if any_due() then
+                            wake(KEYS[5], waiter_prefix)
+                        end
+                    end
+
+                    return result
+                end
+
+                if soonest == nil or bucket_reset < soonest then
+                    soonest = bucket_reset
+                end
+            else
+                schedule(credential_key, now, max_concurrent, KEYS[3], KEYS[4])
+            end
+        end
+    end
+
+    if queued then
+        enqueue()
+    end
+
+    return unavailable('NO_CREDENTIALS', next_due(soonest))
+    """)
+
+# KEYS = credential, meta, bot schedule, webhook schedule, bot queues, webhook queues
+# ARGV = now, waiter_prefix, lease id
+RELEASE_SCRIPT = LuaScript(SCHEDULE_HELPERS + """
+    -- an expired lease may be gone already, nothing to give back then
+    redis.call('ZREM', KEYS[1] .. ':leases', ARGV[3])
+
+    reschedule_and_wake(tonumber(ARGV[1]), ARGV[2])
+    return 1
+    """)
+
+# KEYS = credential, meta, bot schedule, webhook schedule, bot queues, webhook queues
+BLOCK_CREDENTIAL_SCRIPT = LuaScript(SCHEDULE_HELPERS + """
+    local retry_after = ARGV[1]
+    local reason = ARGV[2]
+    local discord_error_code = ARGV[3]
+    local now = tonumber(ARGV[4])
+
+    local blocked_until = 'inf'
+    if retry_after ~= '' then
+        blocked_until = tostring(now + tonumber(retry_after))
+    end
+
+    redis.call('HSET', KEYS[1],
+        'blocked_until', blocked_until,
+        'block_reason', reason,
+        'discord_error_code', discord_error_code
+    )
+
+    schedule(KEYS[1], now, max_concurrent_of(KEYS[2]), KEYS[3], KEYS[4])
+    return 1
+    """)
+
+# KEYS = credential, meta, bot schedule, webhook schedule, bot queues, webhook queues
+# ARGV = now, waiter_prefix
+UNBLOCK_CREDENTIAL_SCRIPT = LuaScript(SCHEDULE_HELPERS + """
+    redis.call('HSET', KEYS[1],
+        'blocked_until', '',
+        'block_reason', '',
+        'discord_error_code', ''
+    )
+
+    reschedule_and_wake(tonumber(ARGV[1]), ARGV[2])
+    return 1
+    """)
+
+# KEYS = credential, meta, bot schedule, webhook schedule, bot queues, webhook queues, route buckets
+# ARGV = remaining, reset, now, waiter_prefix, bucket, route, major parameter, limit, reset_after
+UPDATE_FROM_HEADERS_SCRIPT = LuaScript(SCHEDULE_HELPERS + """
+    local remaining = ARGV[1]
+    local reset = ARGV[2]
+
+    -- last seen values, shown in to_dict()
+    if remaining ~= '' then
+        redis.call('HSET', KEYS[1], 'requests_remaining', remaining)
+    end
+
+    if reset ~= '' then
+        redis.call('HSET', KEYS[1], 'reset_timestamp', reset)
+    end
+
+    if ARGV[5] ~= '' then
+        redis.call('HSET', KEYS[7], ARGV[6], ARGV[5])
+    end
+
+    local buckets_key = KEYS[1] .. ':buckets'
+    local bucket = bucket_id(KEYS[7], ARGV[6], ARGV[7])
+    local fields = { remaining = ARGV[1], reset = ARGV[2], limit = ARGV[8], window = ARGV[9] }
+
+    for name, value in pairs(fields) do
+        if value ~= '' then
+            redis.call('HSET', buckets_key, bucket .. ':' .. name, value)
+        end
+    end
+
+    reschedule_and_wake(tonumber(ARGV[3]), ARGV[4])
+    return 1
+    """)
+
+# KEYS = queue, waiter marker, wake list, meta
+# ARGV = waiter_id, waiter_prefix, timed_out
+LEAVE_QUEUE_SCRIPT = LuaScript(SCHEDULE_HELPERS + """
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('DEL', KEYS[2], KEYS[3])
+
+    if ARGV[3] == '1' then
+        redis.call('HINCRBY', KEYS[4], 'acquire_timeouts', 1)
+    end
+
+    -- we may have been woken and never used it, the next one in line gets the chance
+    wake(KEYS[1], ARGV[2])
+    return 1
+    """)
+
+
 class UserState:
     """
     Redis-backed replacement for the original in-memory UserState.
@@ -22,19 +453,39 @@ class UserState:
       - mapping of credentials
 
     Mutable runtime state in Redis per credential:
-      - requests_remaining
-      - reset_timestamp
-      - in_flight
+      - requests_remaining (last seen)
+      - reset_timestamp (last seen)
+      - in_flight (live leases, see SCHEDULE_HELPERS)
       - blocked_until
       - block_reason
       - discord_error_code
 
     Global mutable runtime state in Redis:
       - _blocked_until
+
+    Leases in Redis, one sorted set per credential:
+      - acquire id -> expiry
+
+    Rate limit buckets in Redis, see SCHEDULE_HELPERS:
+      - per credential: bucket -> remaining, reset, limit, window
+      - shared by all users: route -> bucket
+
+    Credential schedule in Redis, one sorted set per credential type:
+      - credential key -> when it can be used next, see SCHEDULE_HELPERS
+
+    Waiting queue in Redis, one sorted set per credential type and route:
+      - waiter id -> arrival, plus a marker key and a wake list per waiter
+      - the last DISCORD_ACQUIRE_WAIT_SAMPLES wait times, for p50/p99
     """
 
     REDIS_PREFIX = "discord_user_state"
 
+    # bump when the redis layout changes, workers then rebuild the state from scratch instead of merging into it
+    STATE_VERSION = 4
+
+    # written over on every snapshot change, the rest of a credential hash is runtime state
+    STATIC_CREDENTIAL_FIELDS = ("name", "secret", "discord_id", "credential_type")
+
     def __init__(self, user, max_concurrent_per_token: int = 3):
         self.user = user
         self.max_concurrent_per_token = max_concurrent_per_token
@@ -59,185 +510,39 @@ class UserState:
     def _credential_key(self, secret: str) -> str:
         return f"{self._user_key()}:credential:{secret}"
 
-    # ------------------------------------------------------------------
-    # Lua scripts
-    # ------------------------------------------------------------------
+    def _schedule_key(self, credential_type: CredentialType) -> str:
+        return f"{self._user_key()}:schedule:{credential_type}"
 
-    @property
-    def _acquire_script(self):
-        return self._redis.register_script("""
-            local now = tonumber(ARGV[1])
-            local max_concurrent = tonumber(ARGV[2])
-            local requested_type = ARGV[3]
-            local requested_secret = ARGV[4]
-            
-            local global_blocked_until_raw = redis.call('HGET', KEYS[1], 'blocked_until')
-            if global_blocked_until_raw and global_blocked_until_raw ~= '' then
-                local global_blocked_until
-                if global_blocked_until_raw == 'inf' then
-                    global_blocked_until = math.huge
-                else
-                    global_blocked_until = tonumber(global_blocked_until_raw)
-                end
-            
-                if global_blocked_until and now < global_blocked_until then
-                    return cjson.encode({ ok = false, code = 'GLOBAL_BLOCK', retry_after = global_blocked_until - now })
-                else
-                    redis.call('HDEL', KEYS[1], 'blocked_until')
-                end
-            end
-            
-            if requested_secret ~= '' then
-                local credential_key = redis.call('HGET', KEYS[2], requested_secret)
-                if not credential_key then
-                    return cjson.encode({ ok = false, code = 'NOT_FOUND' })
-                end
-            
-                local ctype = redis.call('HGET', credential_key, 'credential_type')
-                if requested_type ~= '' and ctype ~= requested_type then
-                    return cjson.encode({ ok = false, code = 'TYPE_MISMATCH' })
-                end
-            
-                local blocked_until_raw = redis.call('HGET', credential_key, 'blocked_until')
-                if blocked_until_raw and blocked_until_raw ~= '' then
-                    local blocked_until
-                    if blocked_until_raw == 'inf' then
-                        blocked_until = math.huge
-                    else
-                        blocked_until = tonumber(blocked_until_raw)
-                    end
-            
-                    if blocked_until and now < blocked_until then
-                        return cjson.encode({ ok = false, code = 'CREDENTIAL_BLOCKED' })
-                    end
-                end
-            
-                local reset_ts_raw = redis.call('HGET', credential_key, 'reset_timestamp')
-                if reset_ts_raw and reset_ts_raw ~= '' then
-                    local reset_ts = tonumber(reset_ts_raw)
-                    if reset_ts and now >= reset_ts then
-                        redis.call('HSET', credential_key, 'requests_remaining', 5)
-                        redis.call('HSET', credential_key, 'reset_timestamp', '')
-                    end
-                end
-            
-                local requests_remaining = tonumber(redis.call('HGET', credential_key, 'requests_remaining') or '0')
-                local in_flight = tonumber(redis.call('HGET', credential_key, 'in_flight') or '0')
-            
-                if requests_remaining > 0 and in_flight < max_concurrent then
-                    redis.call('HINCRBY', credential_key, 'requests_remaining', -1)
-                    redis.call('HINCRBY', credential_key, 'in_flight', 1)
-                    return cjson.encode({ ok = true, credential_key = credential_key })
-                end
-            
-                return cjson.encode({ ok = false, code = 'UNAVAILABLE' })
-            end
-            
-            local credentials = redis.call('SMEMBERS', KEYS[3])
-            for _, credential_key in ipairs(credentials) do
-                local ctype = redis.call('HGET', credential_key, 'credential_type')
-            
-                if requested_type == '' or ctype == requested_type then
-                    local blocked_until_raw = redis.call('HGET', credential_key, 'blocked_until')
-            
-                    local blocked = false
-                    if blocked_until_raw and blocked_until_raw ~= '' then
-                        local blocked_until
-                        if blocked_until_raw == 'inf' then
-                            blocked_until = math.huge
-                        else
-                            blocked_until = tonumber(blocked_until_raw)
-                        end
-            
-                        if blocked_until and now < blocked_until then
-                            blocked = true
-                        end
-                    end
-            
-                    if not blocked then
-                        local reset_ts_raw = redis.call('HGET', credential_key, 'reset_timestamp')
-                        if reset_ts_raw and reset_ts_raw ~= '' then
-                            local reset_ts = tonumber(reset_ts_raw)
-                            if reset_ts and now >= reset_ts then
-                                redis.call('HSET', credential_key, 'requests_remaining', 5)
-                                redis.call('HSET', credential_key, 'reset_timestamp', '')
-                            end
-                        end
-            
-                        local requests_remaining = tonumber(redis.call('HGET', credential_key, 'requests_remaining') or '0')
-                        local in_flight = tonumber(redis.call('HGET', credential_key, 'in_flight') or '0')
-            
-                        if requests_remaining > 0 and in_flight < max_concurrent then
-                            redis.call('HINCRBY', credential_key, 'requests_remaining', -1)
-                            redis.call('HINCRBY', credential_key, 'in_flight', 1)
-                            return cjson.encode({ ok = true, credential_key = credential_key })
-                        end
-                    end
-                end
-            end
-            
-            return cjson.encode({ ok = false, code = 'NO_CREDENTIALS' })
-            """)
-
-    @property
-    def _release_script(self):
-        return self._redis.register_script("""
-            local in_flight = tonumber(redis.call('HGET', KEYS[1], 'in_flight') or '0')
-            if in_flight > 0 then
-                redis.call('HINCRBY', KEYS[1], 'in_flight', -1)
-            end
-            return 1
-            """)
-
-    @property
-    def _block_credential_script(self):
-        return self._redis.register_script("""
-            local retry_after = ARGV[1]
-            local reason = ARGV[2]
-            local discord_error_code = ARGV[3]
-            local now = tonumber(ARGV[4])
-
-            local blocked_until = 'inf'
-            if retry_after ~= '' then
-                blocked_until = tostring(now + tonumber(retry_after))
-            end
+    def _credential_buckets_key(self, credential_key: str) -> str:
+        return f"{credential_key}:buckets"
 
-            redis.call('HSET', KEYS[1],
-                'blocked_until', blocked_until,
-                'block_reason', reason,
-                'discord_error_code', discord_error_code
-            )
-
-            return 1
-            """)
-
-    @property
-    def _unblock_credential_script(self):
-        return self._redis.register_script("""
-            redis.call('HSET', KEYS[1],
-                'blocked_until', '',
-                'block_reason', '',
-                'discord_error_code', ''
-            )
-            return 1
-            """)
-
-    @property
-    def _update_from_headers_script(self):
-        return self._redis.register_script("""
-            local remaining = ARGV[1]
-            local reset = ARGV[2]
-
-            if remaining ~= '' then
-                redis.call('HSET', KEYS[1], 'requests_remaining', remaining)
-            end
+    def _credential_leases_key(self, credential_key: str) -> str:
+        return f"{credential_key}:leases"
 
-            if reset ~= '' then
-                redis.call('HSET', KEYS[1], 'reset_timestamp', reset)
-            end
+    def _route_buckets_key(self) -> str:
+        return f"{self.REDIS_PREFIX}:route_buckets"
+
+    def _queues_key(self, credential_type: CredentialType) -> str:
+        return f"{self._user_key()}:queues:{credential_type}"
+
+    def _queue_key(self, credential_type: CredentialType, route: Optional[DiscordRoute]) -> str:
+        return f"{self._user_key()}:waiters:{credential_type}:{route.key if route else ''}"
+
+    def _waiter_prefix(self) -> str:
+        return f"{self._user_key()}:waiter:"
 
-            return 1
-            """)
+    def _wake_key(self, waiter_id: str) -> str:
+        return f"{self._waiter_prefix()}{waiter_id}:wake"
+
+    def _wait_samples_key(self) -> str:
+        return f"{self._user_key()}:acquire_waits"
+
+    def _credential_script_keys(self, credential: CredentialState) -> list[str]:
+        return [
+            self._credential_key(credential.secret), self._meta_key(),
+            self._schedule_key("bot"), self._schedule_key("webhook"),
+            self._queues_key("bot"), self._queues_key("webhook"),
+        ]
 
     # ------------------------------------------------------------------
     # Public serialization
@@ -281,13 +586,59 @@ class UserState:
             "_blocked_until": normalize_blocked_until(blocked_until),
             "bots": bots,
             "webhooks": webhooks,
+            "acquire_wait": self.get_acquire_wait_stats(),
+        }
+
+    def get_acquire_wait_stats(self) -> Dict[str, Any]:
+        """Wait times of the last DISCORD_ACQUIRE_WAIT_SAMPLES acquires that were allowed to wait, across all workers"""
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.lrange(self._wait_samples_key(), 0, -1)
+        pipe.hget(self._meta_key(), "acquire_timeouts")
+        pipe.smembers(self._queues_key("bot"))
+        pipe.smembers(self._queues_key("webhook"))
+        samples_raw, timeouts, bot_queues, webhook_queues = pipe.execute()
+
+        pipe = self._redis.pipeline(transaction=False)
+        for queue_key in (*bot_queues, *webhook_queues):
+            pipe.zcard(queue_key)
+        queue_lengths = pipe.execute()
+
+        samples = sorted(float(sample) for sample in samples_raw)
+
+        def percentile(p: float) -> Optional[float]:
+            if not samples:
+                return None
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+        return {
+            "samples": len(samples),
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99),
+            "max_ms": samples[-1] if samples else None,
+            "timeouts": int(timeouts or 0),
+            "waiting": {"bot": sum(queue_lengths[:len(bot_queues)]), "webhook": sum(queue_lengths[len(bot_queues):])},
         }
 
     # ------------------------------------------------------------------
     # Initialization from Django DB into Redis
     # ------------------------------------------------------------------
 
+    @staticmethod
+    def _snapshot_hash(guild_id: str, max_concurrent_per_token: int, channel_ids: list, states: list[CredentialState]) -> str:
+        snapshot = {
+            "guild_id": guild_id,
+            "max_concurrent_per_token": max_concurrent_per_token,
+            "channels": channel_ids,
+            "credentials": sorted([state.secret, state.name, state.discord_id, state.credential_type] for state in states),
+        }
+        return hashlib.sha1(json.dumps(snapshot, default=str).encode()).hexdigest()
+
     def _initialize(self):
+        """
+        Writes the db snapshot into redis unless it's already there. Other workers may be mid request
+        on the same credentials, so a changed snapshot only adds/removes credentials and rewrites
+        the static fields, runtime state is kept. Only a new STATE_VERSION starts from scratch.
+        """
         settings = DiscordSettings.objects.get(user=self.user)
         bots = Bot.objects.filter(owner=self.user)
         webhooks = Webhook.objects.filter(owner=self.user)
@@ -296,38 +647,75 @@ class UserState:
         if not settings.auto_setup_complete:
             raise BadRequestError("No discord settings. Perform auto complete")
 
-        pipe = self._redis.pipeline()
-
-        pipe.delete(self._meta_key())
-        pipe.delete(self._channels_key())
-        pipe.delete(self._credentials_by_secret_key())
-
-        existing = self._redis.smembers(self._credentials_set_key())
-        if existing:
-            pipe.delete(*existing)
-
-        pipe.delete(self._credentials_set_key())
-
-        pipe.hset(self._meta_key(), mapping={
-            "guild_id": settings.guild_id,
-            "max_concurrent_per_token": self.max_concurrent_per_token,
-            "blocked_until": "",
-        })
-
         channel_ids = [c.discord_id for c in channels]
-        if channel_ids:
-            pipe.rpush(self._channels_key(), *channel_ids)
-
         states = [CredentialState.new_bot(bot) for bot in bots]
         states.extend(CredentialState.new_webhook(webhook) for webhook in webhooks)
 
-        for state in states:
-            credential_key = self._credential_key(state.secret)
-            pipe.hset(credential_key, mapping=state.to_redis_hash())
-            pipe.hset(self._credentials_by_secret_key(), state.secret, credential_key)
-            pipe.sadd(self._credentials_set_key(), credential_key)
+        version = str(self.STATE_VERSION)
+        snapshot = self._snapshot_hash(settings.guild_id, self.max_concurrent_per_token, channel_ids, states)
 
-        pipe.execute()
+        def current(pipe) -> tuple[Optional[str], Optional[str]]:
+            values = pipe.hmget(self._meta_key(), "state_version", "snapshot")
+            return tuple(v.decode() if isinstance(v, bytes) else v for v in values)
+
+        # the usual case, another worker already wrote this exact snapshot
+        if current(self._redis) == (version, snapshot):
+            return
+
+        def write(pipe):
+            stored_version, stored_snapshot = current(pipe)
+            if (stored_version, stored_snapshot) == (version, snapshot):
+                return
+
+            existing = {k.decode() if isinstance(k, bytes) else k for k in pipe.smembers(self._credentials_set_key())}
+            credential_keys = {self._credential_key(state.secret) for state in states}
+            stale = existing - credential_keys
+            reset = stored_version != version
+
+            pipe.multi()
+
+            if reset:
+                stale = existing
+                pipe.delete(self._meta_key(), self._schedule_key("bot"), self._schedule_key("webhook"))
+
+            if stale:
+                pipe.delete(
+                    *stale,
+                    *(self._credential_buckets_key(credential_key) for credential_key in stale),
+                    *(self._credential_leases_key(credential_key) for credential_key in stale),
+                )
+                pipe.srem(self._credentials_set_key(), *stale)
+                pipe.zrem(self._schedule_key("bot"), *stale)
+                pipe.zrem(self._schedule_key("webhook"), *stale)
+
+            pipe.hset(self._meta_key(), mapping={
+                "guild_id": settings.guild_id,
+                "max_concurrent_per_token": self.max_concurrent_per_token,
+                "state_version": version,
+                "snapshot": snapshot,
+            })
+            pipe.hsetnx(self._meta_key(), "blocked_until", "")
+
+            pipe.delete(self._channels_key())
+            if channel_ids:
+                pipe.rpush(self._channels_key(), *channel_ids)
+
+            pipe.delete(self._credentials_by_secret_key())
+
+            for state in states:
+                credential_key = self._credential_key(state.secret)
+                fields = state.to_redis_hash()
+
+                pipe.hset(credential_key, mapping={name: fields.pop(name) for name in self.STATIC_CREDENTIAL_FIELDS})
+                for name, value in fields.items():
+                    pipe.hsetnx(credential_key, name, value)
+
+                pipe.hset(self._credentials_by_secret_key(), state.secret, credential_key)
+                pipe.sadd(self._credentials_set_key(), credential_key)
+                # acquire checks a credential before taking it, an early score only costs a reschedule
+                pipe.zadd(self._schedule_key(state.credential_type), {credential_key: 0}, nx=True)
+
+        self._redis.transaction(write, self._meta_key(), self._credentials_set_key())
 
     # ------------------------------------------------------------------
     # Global block
@@ -355,65 +743,205 @@ class UserState:
     # Acquire
     # ------------------------------------------------------------------
 
-    def _acquire(self, credential_type: Optional[CredentialType] = None, secret: Optional[str] = None) -> CredentialState:
-        result_raw = self._acquire_script(
-            keys=[self._meta_key(), self._credentials_by_secret_key(), self._credentials_set_key()],
-            args=[time.time(), self.max_concurrent_per_token, credential_type or "", secret or ""],
-        )
+    def _acquire_keys(self, credential_type: Optional[CredentialType], route: Optional[DiscordRoute]) -> list[str]:
+        return [
+            self._meta_key(), self._credentials_by_secret_key(),
+            self._schedule_key("bot"), self._schedule_key("webhook"),
+            self._queue_key(credential_type or "bot", route), self._queues_key(credential_type or "bot"),
+            self._wait_samples_key(), self._route_buckets_key(),
+        ]
+
+    def _acquire_args(self, credential_type: Optional[CredentialType], secret: Optional[str], route: Optional[DiscordRoute], lease_id: str,
+                      waiter_id: str = "", deadline: Optional[float] = None, started: Optional[float] = None) -> list:
+        waiter_ttl_ms = waited_ms = ""
+        if waiter_id:
+            now = time.monotonic()
+            waiter_ttl_ms = max(int((deadline - now) * 1000), 1) + 1000
+            waited_ms = round((now - started) * 1000, 3)
+
+        return [
+            time.time(), self.max_concurrent_per_token, credential_type or "", secret or "",
+            waiter_id, waiter_ttl_ms, self._waiter_prefix(), waited_ms, DISCORD_ACQUIRE_WAIT_SAMPLES,
+            route.key if route else "", route.major if route else "",
+            lease_id, DISCORD_CREDENTIAL_LEASE_TTL,
+        ]
+
+    def _leave_queue_keys(self, credential_type: Optional[CredentialType], route: Optional[DiscordRoute], waiter_id: str) -> list[str]:
+        return [self._queue_key(credential_type or "bot", route), f"{self._waiter_prefix()}{waiter_id}", self._wake_key(waiter_id), self._meta_key()]
+
+    def _leave_queue_args(self, waiter_id: str, timed_out: bool) -> list:
+        return [waiter_id, self._waiter_prefix(), 1 if timed_out else 0]
 
+    @staticmethod
+    def _leased(data, lease_id: str) -> CredentialState:
+        credential = CredentialState.from_redis_hash(data)
+        credential.lease_id = lease_id
+        return credential
+
+    @staticmethod
+    def _parse_acquire_result(result_raw) -> str:
+        """:return: redis key of the acquired credential"""
         result = json.loads(result_raw)
 
         if result["ok"]:
-            return CredentialState.from_redis_hash(self._redis.hgetall(result["credential_key"]))
+            return result["credential_key"]
 
         code = result["code"]
+        retry_after = result.get("retry_after")
 
         if code == "GLOBAL_BLOCK":
-            raise DiscordBlockError("Discord temporarily blocked us :(", retry_after=result["retry_after"])
+            raise DiscordBlockError("Discord temporarily blocked us :(", retry_after=retry_after)
         if code == "NOT_FOUND":
             raise CannotProcessDiscordRequestError("Requested credential not found")
         if code == "TYPE_MISMATCH":
             raise CannotProcessDiscordRequestError("Credential type mismatch")
         if code == "CREDENTIAL_BLOCKED":
-            raise CannotProcessDiscordRequestError("Credential is temporarily blocked")
+            raise CannotProcessDiscordRequestError("Credential is temporarily blocked", retry_after=retry_after)
         if code == "UNAVAILABLE":
-            raise CannotProcessDiscordRequestError("Credential currently unavailable")
+            raise CannotProcessDiscordRequestError("Credential currently unavailable", retry_after=retry_after)
         if code == "NO_CREDENTIALS":
-            raise CannotProcessDiscordRequestError("No credentials available right now")
+            raise CannotProcessDiscordRequestError("No credentials available right now", retry_after=retry_after)
+        if code == "QUEUED":
+            raise CannotProcessDiscordRequestError("Other requests are waiting for a credential", retry_after=retry_after)
 
         raise CannotProcessDiscordRequestError(f"Unexpected acquire error: {code}")
 
-    def acquire_token(self, bot: Optional["Bot"] = None) -> CredentialState:
+    @staticmethod
+    def _wait_time(error: CannotProcessDiscordRequestError, deadline: float) -> Optional[float]:
+        """How long to block on the wake list before trying again, None if the deadline has passed"""
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return None
+
+        # a credential freeing up by time (block or rate limit window ending) wakes nobody,
+        # and a wake can get lost with a dead worker, so never sleep blind for long
+        wait = DISCORD_ACQUIRE_POLL_INTERVAL
+        if error.retry_after is not None:
+            # retry_after is rounded down to the credential becoming due, don't wake up just before it
+            wait = min(wait, error.retry_after + 0.001)
+
+        # BLPOP treats 0 as "forever"
+        return max(min(wait, left), 0.001)
+
+    def _acquire(self, credential_type: Optional[CredentialType] = None, secret: Optional[str] = None, wait: Optional[float] = None, route: Optional[DiscordRoute] = None) -> CredentialState:
+        lease_id = uuid.uuid4().hex
+
+        if wait is None:
+            result_raw = ACQUIRE_SCRIPT(keys=self._acquire_keys(credential_type, route), args=self._acquire_args(credential_type, secret, route, lease_id))
+            credential_key = self._parse_acquire_result(result_raw)
+            return self._leased(self._redis.hgetall(credential_key), lease_id)
+
+        waiter_id = uuid.uuid4().hex
+        started = time.monotonic()
+        deadline = started + wait
+        acquired = timed_out = False
+
+        try:
+            while True:
+                try:
+                    result_raw = ACQUIRE_SCRIPT(keys=self._acquire_keys(credential_type, route), args=self._acquire_args(credential_type, secret, route, lease_id, waiter_id, deadline, started))
+                    credential_key = self._parse_acquire_result(result_raw)
+                    acquired = True
+                    return self._leased(self._redis.hgetall(credential_key), lease_id)
+                except CannotProcessDiscordRequestError as e:
+                    timeout = self._wait_time(e, deadline)
+                    if timeout is None:
+                        timed_out = True
+                        raise
+                    self._redis.blpop([self._wake_key(waiter_id)], timeout=timeout)
+        finally:
+            if not acquired:
+                LEAVE_QUEUE_SCRIPT(keys=self._leave_queue_keys(credential_type, route, waiter_id), args=self._leave_queue_args(waiter_id, timed_out))
+
+    async def _aacquire(self, credential_type: Optional[CredentialType] = None, secret: Optional[str] = None, wait: Optional[float] = None, route: Optional[DiscordRoute] = None) -> CredentialState:
+        client = get_async_redis_connection()
+
+        lease_id = uuid.uuid4().hex
+
+        if wait is None:
+            result_raw = await ACQUIRE_SCRIPT.acall(keys=self._acquire_keys(credential_type, route), args=self._acquire_args(credential_type, secret, route, lease_id))
+            credential_key = self._parse_acquire_result(result_raw)
+            return self._leased(await client.hgetall(credential_key), lease_id)
+
+        waiter_id = uuid.uuid4().hex
+        started = time.monotonic()
+        deadline = started + wait
+        acquired = timed_out = False
+
+        try:
+            while True:
+                try:
+                    result_raw = await ACQUIRE_SCRIPT.acall(keys=self._acquire_keys(credential_type, route), args=self._acquire_args(credential_type, secret, route, lease_id, waiter_id, deadline, started))
+                    credential_key = self._parse_acquire_result(result_raw)
+                    acquired = True
+                    return self._leased(await client.hgetall(credential_key), lease_id)
+                except CannotProcessDiscordRequestError as e:
+                    timeout = self._wait_time(e, deadline)
+                    if timeout is None:
+                        timed_out = True
+                        raise
+                    # a blocking command holds its connection, the pool hands other coroutines a different one
+                    await client.blpop([self._wake_key(waiter_id)], timeout=timeout)
+        finally:
+            if not acquired:
+                await asyncio.shield(LEAVE_QUEUE_SCRIPT.acall(keys=self._leave_queue_keys(credential_type, route, waiter_id), args=self._leave_queue_args(waiter_id, timed_out)))
+
+    def acquire_token(self, bot: Optional["Bot"] = None, wait: Optional[float] = None, route: Optional[DiscordRoute] = None) -> CredentialState:
+        """
+        :param wait: seconds to wait in line for the soonest available bot instead of failing right away
+        :param route: skip bots whose rate limit bucket for this route is exhausted
+        """
         secret = bot.token if bot else None
-        return self._acquire("bot", secret)
+        return self._acquire("bot", secret, wait, route)
 
-    def acquire_webhook(self, webhook: Optional["Webhook"] = None) -> CredentialState:
+    def acquire_webhook(self, webhook: Optional["Webhook"] = None, wait: Optional[float] = None, route: Optional[DiscordRoute] = None) -> CredentialState:
         secret = webhook.url if webhook else None
-        return self._acquire("webhook", secret)
+        return self._acquire("webhook", secret, wait, route)
+
+    async def aacquire_token(self, bot: Optional["Bot"] = None, wait: Optional[float] = None, route: Optional[DiscordRoute] = None) -> CredentialState:
+        secret = bot.token if bot else None
+        return await self._aacquire("bot", secret, wait, route)
+
+    async def aacquire_webhook(self, webhook: Optional["Webhook"] = None, wait: Optional[float] = None, route: Optional[DiscordRoute] = None) -> CredentialState:
+        secret = webhook.url if webhook else None
+        return await self._aacquire("webhook", secret, wait, route)
 
     # ------------------------------------------------------------------
     # Release
     # ------------------------------------------------------------------
     def release(self, credential: CredentialState):
-        self._release_script(keys=[self._credential_key(credential.secret)], args=[])
+        RELEASE_SCRIPT(keys=self._credential_script_keys(credential), args=[time.time(), self._waiter_prefix(), credential.lease_id])
+
+    async def arelease(self, credential: CredentialState):
+        await RELEASE_SCRIPT.acall(keys=self._credential_script_keys(credential), args=[time.time(), self._waiter_prefix(), credential.lease_id])
 
     # ------------------------------------------------------------------
     # Block / unblock credential
     # ------------------------------------------------------------------
 
+    @staticmethod
+    def _block_credential_args(retry_after_seconds: Optional[float], reason: str, discord_error_code: int) -> list:
+        return [
+            "" if retry_after_seconds is None else float(retry_after_seconds),
+            reason or "",
+            "" if discord_error_code is None else int(discord_error_code),
+            float(time.time()),
+        ]
+
     def block_credential(self, credential: CredentialState, retry_after_seconds: Optional[float], reason: str, discord_error_code: int):
-        self._block_credential_script(
-            keys=[self._credential_key(credential.secret)],
-            args=[
-                "" if retry_after_seconds is None else float(retry_after_seconds),
-                reason or "",
-                "" if discord_error_code is None else int(discord_error_code),
-                float(time.time()),
-            ]
+        BLOCK_CREDENTIAL_SCRIPT(
+            keys=self._credential_script_keys(credential),
+            args=self._block_credential_args(retry_after_seconds, reason, discord_error_code),
+        )
+
+    async def ablock_credential(self, credential: CredentialState, retry_after_seconds: Optional[float], reason: str, discord_error_code: int):
+        await BLOCK_CREDENTIAL_SCRIPT.acall(
+            keys=self._credential_script_keys(credential),
+            args=self._block_credential_args(retry_after_seconds, reason, discord_error_code),
         )
 
     def unblock_credential(self, credential: CredentialState):
-        self._unblock_credential_script(keys=[self._credential_key(credential.secret)], args=[])
+        UNBLOCK_CREDENTIAL_SCRIPT(keys=self._credential_script_keys(credential), args=[time.time(), self._waiter_prefix()])
 
     # ------------------------------------------------------------------
     # Lookup by discord credential id
@@ -437,16 +965,37 @@ class UserState:
     # Update from headers
     # ------------------------------------------------------------------
 
-    def update_from_headers(self, credential: CredentialState, headers: dict):
+    def _update_from_headers_args(self, headers: dict, route: Optional[DiscordRoute]) -> list:
         remaining = headers.get("X-RateLimit-Remaining")
         reset = headers.get("X-RateLimit-Reset")
+        limit = headers.get("X-RateLimit-Limit")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+
+        return [
+            "" if remaining is None else int(remaining),
+            "" if reset is None else float(reset),
+            time.time(),
+            self._waiter_prefix(),
+            headers.get("X-RateLimit-Bucket") or "",
+            route.key if route else "",
+            route.major if route else "",
+            "" if limit is None else int(limit),
+            "" if reset_after is None else float(reset_after),
+        ]
+
+    def _update_from_headers_keys(self, credential: CredentialState) -> list[str]:
+        return self._credential_script_keys(credential) + [self._route_buckets_key()]
+
+    def update_from_headers(self, credential: CredentialState, headers: dict, route: Optional[DiscordRoute] = None):
+        UPDATE_FROM_HEADERS_SCRIPT(
+            keys=self._update_from_headers_keys(credential),
+            args=self._update_from_headers_args(headers, route),
+        )
 
-        self._update_from_headers_script(
-            keys=[self._credential_key(credential.secret)],
-            args=[
-                "" if remaining is None else int(remaining),
-                "" if reset is None else float(reset),
-            ],
+    async def aupdate_from_headers(self, credential: CredentialState, headers: dict, route: Optional[DiscordRoute] = None):
+        await UPDATE_FROM_HEADERS_SCRIPT.acall(
+            keys=self._update_from_headers_keys(credential),
+            args=self._update_from_headers_args(headers, route),
         )
 
     def get_all_credentials(self) -> Dict[str, CredentialState]:
@@ -0,0 +1,96 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from website.constants import cache
+from website.core import ratelimit
+
+
+def _legacy_hit(key: str, limit: int, period: float) -> bool:
+    """What the throttles and FailedRequestLoggerMiddleware did: a list of timestamps read, filtered and written back"""
+    now = time.time()
+    history = [t for t in cache.get(key, []) if now - t < period]
+
+    if len(history) >= limit:
+        return False
+
+    history.append(now)
+    cache.set(key, history, period)
+    return True
+
+
+def _gcra_hit(key: str, limit: int, period: float) -> bool:
+    return ratelimit.hit(key, limit, period).allowed
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the redis GCRA rate limiter against the old timestamp-list one on the configured cache redis: "
+            "latency and redis traffic per check as the window fills up, and admitted requests under concurrency. "
+            "Commands a script runs count as redis commands too, the script is still one round trip.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limits", type=int, nargs="+", default=[10, 100, 1000], help="Requests per window, the old limiter stores one timestamp per request.")
+        parser.add_argument("--checks", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=16)
+
+    def handle(self, *args, **options):
+        redis_client = get_redis_connection()
+        prefix = f"benchmark-ratelimit-{uuid.uuid4().hex[:8]}"
+        limiters = (("list", _legacy_hit), ("gcra", _gcra_hit))
+
+        self.stdout.write(f"Sequential checks on a window already holding `limit` requests, {options['checks']} checks each")
+        self.stdout.write(f"{'limiter':<8} {'limit':>6} {'path':<8} {'us/check':>9} {'redis cmds/check':>17} {'redis bytes/check':>18}")
+
+        for limit in options["limits"]:
+            for name, limiter in limiters:
+                # "allowed": room for every check, "denied": the window is full
+                for path, capacity in (("allowed", limit + options["checks"]), ("denied", limit)):
+                    key = f"{prefix}-{name}-{path}-{limit}"
+
+                    # fill the window first, that's where the list limiter pays for its history
+                    for _ in range(limit):
+                        limiter(key, capacity, 3600)
+
+                    before = redis_client.info("stats")
+                    started = time.perf_counter()
+                    for _ in range(options["checks"]):
+                        limiter(key, capacity, 3600)
+                    elapsed = time.perf_counter() - started
+                    after = redis_client.info("stats")
+
+                    # INFO itself counts as a command
+                    commands = after["total_commands_processed"] - before["total_commands_processed"] - 1
+                    traffic = (after["total_net_input_bytes"] - before["total_net_input_bytes"]) + (after["total_net_output_bytes"] - before["total_net_output_bytes"])
+                    checks = options["checks"]
+
+                    self.stdout.write(f"{name:<8} {limit:>6} {path:<8} {elapsed / checks * 1e6:>9.0f} {commands / checks:>17.1f} {traffic / checks:>18.0f}")
+
+        self.stdout.write("")
+        self.stdout.write(f"Concurrent checks, {options['threads']} threads, each tries to take the whole limit")
+        self.stdout.write(f"{'limiter':<8} {'limit':>6} {'admitted':>9}")
+
+        for limit in options["limits"]:
+            for name, limiter in limiters:
+                key = f"{prefix}-race-{name}-{limit}"
+                admitted = [0] * options["threads"]
+
+                def worker(index):
+                    for _ in range(limit):
+                        if limiter(key, limit, 3600):
+                            admitted[index] += 1
+
+                threads = [threading.Thread(target=worker, args=(index,)) for index in range(options["threads"])]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                self.stdout.write(f"{name:<8} {limit:>6} {sum(admitted):>9}")
+
+        for key in redis_client.scan_iter(match=f"*{prefix}*"):
+            redis_client.delete(key)
+
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from website.constants import EncryptionMethod
+from website.core.crypto.Decryptor import Decryptor
+from website.core.media.stream.ChunkCoalescer import ChunkCoalescer
+
+
+def _drain(sock: socket.socket) -> None:
+    buffer = bytearray(1024 * 1024)
+    while sock.recv_into(buffer):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark of the streaming decrypt path: bytes/sec per core with per-chunk decryption vs ChunkCoalescer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=512, help="MiB streamed per run.")
+        parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[8, 16, 64, 128], help="Input chunk sizes in KiB, like the ones read from the CDN.")
+        parser.add_argument("--method", choices=[m.name for m in EncryptionMethod], default=EncryptionMethod.AES_CTR.name)
+
+    async def _source(self, total: int, chunk_size: int):
+        data = os.urandom(chunk_size)
+        for _ in range(total // chunk_size):
+            yield data
+
+    async def _sink(self, stream) -> None:
+        """Stands in for the ASGI server: one socket write and one loop iteration per chunk."""
+        writer, reader = socket.socketpair()
+        drain = threading.Thread(target=_drain, args=(reader,))
+        drain.start()
+
+        try:
+            async for chunk in stream:
+                writer.sendall(chunk)
+                await asyncio.sleep(0)
+        finally:
+            writer.close()
+            drain.join()
+            reader.close()
+
+    async def _per_chunk(self, decryptor: Decryptor, total: int, chunk_size: int):
+        async for chunk in self._source(total, chunk_size):
+            yield decryptor.decrypt(chunk)
+
+    async def _coalesced(self, decryptor: Decryptor, total: int, chunk_size: int):
+        coalescer = ChunkCoalescer(decryptor=decryptor)
+        async for chunk in self._source(total, chunk_size):
+            for data in coalescer.feed(chunk):
+                yield data
+
+        tail = coalescer.flush()
+        if tail:
+            yield tail
+
+    def _run(self, method: EncryptionMethod, pipeline, total: int, chunk_size: int) -> float:
+        decryptor = Decryptor(method=method, key=Decryptor.generate_key(method), iv=Decryptor.generate_iv(method))
+
+        started = time.thread_time()
+        asyncio.run(self._sink(pipeline(decryptor, total, chunk_size)))
+        elapsed = time.thread_time() - started
+
+        return total / elapsed / (1024 * 1024)
+
+    def handle(self, *args, **options):
+        method = EncryptionMethod[options["method"]]
+        total = options["size"] * 1024 * 1024
+
+        self.stdout.write(f"{method.name}, {options['size']} MiB per run, MiB/s per core (CPU time of the streaming thread)")
+
+        for chunk_kib in options["chunk_sizes"]:
+            chunk_size = chunk_kib * 1024
+
+            before = self._run(method, self._per_chunk, total, chunk_size)
+            after = self._run(method, self._coalesced, total, chunk_size)
+
+            self.stdout.write(f"{chunk_kib:>5} KiB chunks: per-chunk {before:8.0f}  coalesced {after:8.0f}  ({after / before:.2f}x)")
+
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import hmac
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from website.constants import API_BASE_URL, SIGNED_URL_EXPIRY_SECONDS, EncryptionMethod
+from website.core.Serializers import FileSerializer
+from website.core.crypto.signer import SECRET, ResourceSigner, sign_resource
+
+
+def _legacy_sign_resource(path: str) -> str:
+    """What sign_resource did for every url: re-key the HMAC, hash, encode"""
+    expires = int(time.time()) + SIGNED_URL_EXPIRY_SECONDS
+    digest = hmac.new(SECRET, f"{path}:{expires}".encode(), hashlib.md5).digest()
+    sig = base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+    return f"?sig={sig}&expires={expires}"
+
+
+def _file_tuple(index: int) -> tuple:
+    """A File.DISPLAY_VALUES row, every other file has a thumbnail"""
+    now = datetime.now(timezone.utc)
+    return (
+        f"file{index:018d}", f"file {index}.mp4", False, "active", "parent", 1, False, None, None, None, False,
+        "Video", 1024 * index, now, now, EncryptionMethod.Not_Encrypted.value, None, ".mp4",
+        "parent", 1, False, False, False, f"thumb{index:017d}" if index % 2 else None, True, None, None,
+    )
+
+
+def _legacy_listing(file_tuples: list[tuple]) -> None:
+    """get_folder_info before: serialize unsigned, then sign_resource every url"""
+    for file in (FileSerializer.serialize_tuple(file_tuple, sign_urls=False) for file_tuple in file_tuples):
+        download_path = file.pop("_download_path", None)
+        thumbnail_path = file.pop("_thumbnail_path", None)
+
+        if thumbnail_path:
+            file["thumbnail_url"] = f"{API_BASE_URL}{thumbnail_path}{_legacy_sign_resource(thumbnail_path)}"
+
+        if download_path:
+            file["download_url"] = f"{API_BASE_URL}{download_path}{_legacy_sign_resource(download_path)}"
+
+
+def _batch_listing(file_tuples: list[tuple]) -> None:
+    """get_folder_info now: serialize unsigned, then sign every url of the listing in one sign_many call"""
+    files = [FileSerializer.serialize_tuple(file_tuple, sign_urls=False) for file_tuple in file_tuples]
+
+    targets = []
+    for file in files:
+        for path_key, url_key in (("_download_path", "download_url"), ("_thumbnail_path", "thumbnail_url")):
+            path = file.pop(path_key, None)
+            if path:
+                targets.append((file, url_key, path))
+
+    signatures = ResourceSigner().sign_many(path for _, _, path in targets)
+    for (file, url_key, path), signature in zip(targets, signatures):
+        file[url_key] = f"{API_BASE_URL}{path}{signature}"
+
+
+def _shared_signer_listing(file_tuples: list[tuple]) -> None:
+    """Serializer signing inline with one signer, what the paginated listing, search and trash do"""
+    signer = ResourceSigner()
+    for file_tuple in file_tuples:
+        FileSerializer.serialize_tuple(file_tuple, signer=signer)
+
+
+def _lazy_listing(file_tuples: list[tuple]) -> None:
+    """signUrls=false, urls are signed later by get_files_signed_urls_view for what the client shows"""
+    for file in (FileSerializer.serialize_tuple(file_tuple, sign_urls=False) for file_tuple in file_tuples):
+        file.pop("_download_path", None)
+        file.pop("_thumbnail_path", None)
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks serializing a folder listing of files with signed urls: the old per url sign_resource, "
+            "batch signing from pre-keyed HMAC states, and lazy (unsigned) listings. No database or network is used.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per variant, the fastest one is reported.")
+
+    def _best(self, func, *args) -> float:
+        best = float("inf")
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            func(*args)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        items = options["items"]
+        file_tuples = [_file_tuple(index) for index in range(items)]
+        paths = [f"/files/file{index:018d}/stream" for index in range(items)]
+
+        self.stdout.write(f"Signing {items} paths")
+        self.stdout.write(f"{'signer':<28} {'ms':>9} {'us/url':>8}")
+
+        signer = ResourceSigner()
+        expected = base64.urlsafe_b64encode(hmac.new(SECRET, f"{paths[0]}:{signer.expires}".encode(), hashlib.md5).digest()).rstrip(b'=').decode()
+        if signer.sign(paths[0]) != f"?sig={expected}&expires={signer.expires}":
+            raise CommandError("ResourceSigner signatures don't match hmac.new ones.")
+
+        signing = (
+            ("legacy sign_resource", lambda: [_legacy_sign_resource(path) for path in paths]),
+            ("sign_resource", lambda: [sign_resource(path) for path in paths]),
+            ("ResourceSigner.sign", lambda: [signer.sign(path) for path in paths]),
+            ("ResourceSigner.sign_many", lambda: signer.sign_many(paths)),
+        )
+        for name, func in signing:
+            elapsed = self._best(func)
+            self.stdout.write(f"{name:<28} {elapsed * 1e3:>9.1f} {elapsed / items * 1e6:>8.2f}")
+
+        self.stdout.write("")
+        self.stdout.write(f"Serializing a listing of {items} files, every other one with a thumbnail")
+        self.stdout.write(f"{'listing':<28} {'ms':>9} {'ms/10k items':>13}")
+
+        listings = (
+            ("legacy", _legacy_listing),
+            ("batch signed", _batch_listing),
+            ("shared signer", _shared_signer_listing),
+            ("lazy urls", _lazy_listing),
+        )
+        for name, func in listings:
+            elapsed = self._best(func, file_tuples)
+            self.stdout.write(f"{name:<28} {elapsed * 1e3:>9.1f} {elapsed / items * 1e7:>13.1f}")
+
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,137 @@
+import asyncio
+import gc
+import threading
+import time
+
+from channels.generic.websocket import WebsocketConsumer
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from website.websockets.BaseConsumer import RateLimitedWebsocketConsumer
+
+# not in CHANNEL_LAYERS, so the benchmark consumers get no channel layer and never touch redis
+NO_CHANNEL_LAYER = "benchmark-none"
+
+
+def _read_proc_status() -> dict:
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmSize", "Threads"):
+                status[name] = int(value.split()[0])
+    return status
+
+
+class _ThreadHeartbeatConsumer(WebsocketConsumer):
+    """The previous model: sync consumer with a sleeping heartbeat thread per socket"""
+    channel_layer_alias = NO_CHANNEL_LAYER
+    ping_interval = 10
+
+    def __init__(self):
+        super().__init__()
+        self._stopped = threading.Event()
+
+    def connect(self):
+        self.accept()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+    def disconnect(self, close_code):
+        self._stopped.set()
+
+    def _heartbeat_loop(self):
+        # the old loop slept with time.sleep(), an Event lets the benchmark end threads right away
+        while not self._stopped.wait(self.ping_interval):
+            pass
+
+
+class _LoopHeartbeatConsumer(RateLimitedWebsocketConsumer):
+    """The real base class with redis bookkeeping switched off, only the per connection cost is left"""
+    channel_layer_alias = NO_CHANNEL_LAYER
+
+    async def authorize(self) -> tuple[bool, bool, str]:
+        return True, True, ""
+
+    def get_group_name(self) -> str:
+        return ""
+
+    def get_group_names(self) -> list[str]:
+        return []
+
+    async def _check_rate_limit(self, key_prefix, limit, window_seconds) -> bool:
+        return True
+
+    async def _count_connections(self) -> int:
+        return 0
+
+    async def _register_connection(self) -> None:
+        pass
+
+    async def _unregister_connection(self) -> None:
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Memory and threads per open websocket: the old thread-per-socket heartbeat vs the event loop timer one. "
+            "Linux only, reads /proc/self/status. Run one --model per process for clean RSS numbers, freed memory gets reused.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, nargs="+", default=[1000, 10000])
+        parser.add_argument("--model", choices=["threads", "loop", "both"], default="both")
+
+    def handle(self, *args, **options):
+        models = ["threads", "loop"] if options["model"] == "both" else [options["model"]]
+
+        self.stdout.write(f"{'model':<8} {'conns':>6} {'opened':>7} {'threads':>8} {'RSS MiB':>8} {'KiB/conn':>9} {'virt MiB':>9} {'virt KiB/conn':>14}")
+
+        for connections in options["connections"]:
+            for model in models:
+                consumer = _ThreadHeartbeatConsumer if model == "threads" else _LoopHeartbeatConsumer
+                opened, before, after = asyncio.run(self._run(consumer, connections))
+
+                rss = after["VmRSS"] - before["VmRSS"]
+                virt = after["VmSize"] - before["VmSize"]
+                per_conn = max(opened, 1)
+
+                self.stdout.write(
+                    f"{model:<8} {connections:>6} {opened:>7} {after['Threads'] - before['Threads']:>8} "
+                    f"{rss / 1024:>8.1f} {rss / per_conn:>9.1f} {virt / 1024:>9.1f} {virt / per_conn:>14.1f}"
+                )
+
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    async def _run(self, consumer, connections: int) -> tuple[int, dict, dict]:
+        application = consumer.as_asgi()
+
+        # the sync consumers run on asgiref's executor, warm it up so its threads aren't counted
+        warmup = WebsocketCommunicator(application, "/ws")
+        await warmup.connect()
+        await warmup.disconnect()
+
+        gc.collect()
+        before = _read_proc_status()
+
+        communicators = []
+        try:
+            for _ in range(connections):
+                communicator = WebsocketCommunicator(application, "/ws")
+                connected, _ = await communicator.connect()
+                if not connected:
+                    break
+                communicators.append(communicator)
+        except Exception as e:
+            # thread per socket runs out of threads / memory map areas long before the loop does
+            self.stderr.write(f"stopped after {len(communicators)} connections: {e}")
+
+        gc.collect()
+        after = _read_proc_status()
+
+        for communicator in communicators:
+            await communicator.disconnect()
+
+        # let heartbeat threads exit so they don't skew the next run
+        deadline = time.monotonic() + 10
+        while threading.active_count() > before["Threads"] and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        return len(communicators), before, after
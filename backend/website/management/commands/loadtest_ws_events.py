@@ -0,0 +1,83 @@
+import asyncio
+import statistics
+import time
+
+import redis
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from website.websockets.groups import get_user_group_name
+
+LOADTEST_PREFIX = "ws-loadtest"
+
+
+class Command(BaseCommand):
+    help = ("Load test of websocket event fan-out against the configured channel layer redis. "
+            "Compares the old global 'user' group with per-user groups: event latency and redis traffic per event as connections grow.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, nargs="+", default=[100, 1000, 5000], help="Simulated websocket connections per run.")
+        parser.add_argument("--connections-per-user", type=int, default=2)
+        parser.add_argument("--events", type=int, default=100, help="Events sent per run.")
+
+    def handle(self, *args, **options):
+        asyncio.run(self._main(options))
+
+    async def _main(self, options):
+        host = settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"][0]
+        redis_client = redis.Redis.from_url(host)
+
+        self.stdout.write(f"{'mode':<9} {'conns':>6} {'p50 ms':>8} {'p99 ms':>8} {'redis cmds/event':>17} {'redis KiB/event':>16}")
+
+        for connections in options["connections"]:
+            for mode in ("global", "per-user"):
+                # own prefix and capacity, so nothing is dropped and flush() only touches our keys
+                layer = RedisChannelLayer(hosts=[host], prefix=LOADTEST_PREFIX, capacity=options["events"] + 1)
+
+                try:
+                    latencies, commands, traffic = await self._run(layer, redis_client, mode, connections, options["connections_per_user"], options["events"])
+                finally:
+                    await layer.flush()
+
+                latencies.sort()
+                p50 = statistics.median(latencies) * 1000
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+                events = options["events"]
+
+                self.stdout.write(f"{mode:<9} {connections:>6} {p50:>8.2f} {p99:>8.2f} {commands / events:>17.1f} {traffic / events / 1024:>16.1f}")
+
+        redis_client.close()
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    async def _run(self, layer: RedisChannelLayer, redis_client: redis.Redis, mode: str, connections: int, connections_per_user: int, events: int) -> tuple[list[float], int, int]:
+        users = max(1, connections // connections_per_user)
+
+        probe_channel = None
+        for index in range(connections):
+            user_id = index % users
+            channel = await layer.new_channel()
+            group = "user" if mode == "global" else get_user_group_name(user_id)
+            await layer.group_add(group, channel)
+
+            if probe_channel is None:
+                probe_channel = channel
+
+        # every event is addressed to the user owning the probe connection
+        target_group = "user" if mode == "global" else get_user_group_name(0)
+
+        before = redis_client.info("stats")
+        latencies = []
+
+        for event_id in range(events):
+            started = time.perf_counter()
+            await layer.group_send(target_group, {"type": "send_event", "context": {"user_id": 0}, "event_id": event_id})
+            await layer.receive(probe_channel)
+            latencies.append(time.perf_counter() - started)
+
+        after = redis_client.info("stats")
+
+        commands = after["total_commands_processed"] - before["total_commands_processed"]
+        traffic = (after["total_net_input_bytes"] - before["total_net_input_bytes"]) + (after["total_net_output_bytes"] - before["total_net_output_bytes"])
+
+        return latencies, commands, traffic
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from website.services import folder_aggregate_service
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds FolderAggregate rows (folder sizes and counts) from files and folders. "
+            "Migration 0013 fills them and the hourly reconcile_folder_aggregates task keeps them correct, "
+            "this is for fixing a user on demand.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="Only rebuild this user id.")
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options["user"]:
+            users = users.filter(id=options["user"])
+
+        total = 0
+        for user in users:
+            fixed = folder_aggregate_service.rebuild_for_user(user)
+            self.stdout.write(f"{user.username}: {fixed} rows written")
+            total += fixed
+
+        self.stdout.write(self.style.SUCCESS(f"Done. Wrote {total} folder aggregate rows."))
@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from website.models import StorageUsage
+from website.services import usage_service
+
+
+class Command(BaseCommand):
+    help = ("Recomputes every user's storage usage from files, thumbnails, moments and subtitles "
+            "and compares it with the StorageUsage ledger. Pass --fix to overwrite the rows that drifted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="Only verify this user id.")
+        parser.add_argument("--fix", action="store_true", help="Write the recomputed values.")
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options["user"]:
+            users = users.filter(id=options["user"])
+
+        with transaction.atomic():
+            user_ids = list(users.order_by("id").values_list("id", flat=True))
+            rows = {row.user_id: row for row in StorageUsage.objects.select_for_update().filter(user_id__in=user_ids).order_by("user_id")}
+            expected = usage_service.recompute(user_ids)
+
+            drifted = []
+            missing = []
+            for user_id in user_ids:
+                used = expected.get(user_id, 0)
+                row = rows.get(user_id)
+
+                if row is None:
+                    self.stdout.write(f"user {user_id}: no ledger row, expected {used}")
+                    missing.append(StorageUsage(user_id=user_id, used=used))
+
+                elif row.used != used:
+                    self.stdout.write(f"user {user_id}: ledger {row.used}, expected {used} ({used - row.used:+d})")
+                    row.used = used
+                    drifted.append(row)
+
+            if options["fix"]:
+                StorageUsage.objects.bulk_update(drifted, ["used"], batch_size=1000)
+                StorageUsage.objects.bulk_create(missing, batch_size=1000)
+
+        wrong = len(drifted) + len(missing)
+        if not wrong:
+            self.stdout.write(self.style.SUCCESS(f"Checked {len(user_ids)} users, ledger is correct."))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Checked {len(user_ids)} users, fixed {wrong}."))
+        else:
+            self.stdout.write(self.style.WARNING(f"Checked {len(user_ids)} users, {wrong} wrong. Run with --fix to correct them."))
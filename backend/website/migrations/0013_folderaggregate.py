@@ -0,0 +1,113 @@
+# Generated by Django 6.0.4 on 2026-10-18 12:00
+
+import django.db.models.deletion
+import shortuuid.main
+import shortuuidfield.fields
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def _add(totals, key, count, size):
+    entry = totals.setdefault(key, [0, 0])
+    entry[0] += count
+    entry[1] += size
+
+
+def backfill_folder_aggregates(apps, schema_editor):
+    """Same counting as folder_aggregate_service.rebuild_for_user, one user at a time"""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Folder = apps.get_model("website", "Folder")
+    File = apps.get_model("website", "File")
+    FolderAggregate = apps.get_model("website", "FolderAggregate")
+
+    for user_id in User.objects.order_by("id").values_list("id", flat=True):
+        folders = list(Folder.objects.filter(owner_id=user_id).values("id", "parent_id", "level", "state", "inTrash", "lockFrom_id"))
+        by_id = {folder["id"]: folder for folder in folders}
+
+        # what every folder holds directly: its active files and itself
+        own = {folder["id"]: {} for folder in folders}
+        for folder in folders:
+            if folder["state"] == "active":
+                _add(own[folder["id"]], ("folder", folder["inTrash"], ""), 1, 0)
+
+        rows = (
+            File.objects
+            .filter(parent__owner_id=user_id, state="active")
+            .values("parent_id", "type", "inTrash")
+            .annotate(count=Count("id"), size=Sum("size"))
+            .order_by()
+        )
+        for row in rows:
+            parent = by_id.get(row["parent_id"])
+            if parent:
+                key = (row["type"], row["inTrash"] or parent["inTrash"], parent["lockFrom_id"] or "")
+                _add(own[parent["id"]], key, row["count"], row["size"] or 0)
+
+        # deepest first, every folder hands its subtree totals to its parent
+        subtree = {folder_id: {key: list(value) for key, value in totals.items()} for folder_id, totals in own.items()}
+        aggregates = []
+        for folder in sorted(folders, key=lambda f: -f["level"]):
+            totals = subtree[folder["id"]]
+            for key, (count, size) in totals.items():
+                own_count, own_size = own[folder["id"]].get(key, [0, 0])
+                aggregates.append(FolderAggregate(
+                    folder_id=folder["id"], type=key[0], inTrash=key[1], lockFrom=key[2],
+                    count=own_count, size=own_size, subtree_count=count, subtree_size=size,
+                ))
+
+            if folder["parent_id"] in by_id:
+                for key, (count, size) in totals.items():
+                    _add(subtree[folder["parent_id"]], key, count, size)
+
+        FolderAggregate.objects.bulk_create(aggregates, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("website", "0012_remove_historicalbot_history_user_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FolderAggregate",
+            fields=[
+                (
+                    "id",
+                    shortuuidfield.fields.ShortUUIDField(
+                        blank=True,
+                        default=shortuuid.main.ShortUUID.uuid,
+                        editable=False,
+                        max_length=22,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("type", models.CharField(max_length=50)),
+                ("inTrash", models.BooleanField()),
+                ("lockFrom", models.CharField(blank=True, default="", max_length=22)),
+                ("count", models.BigIntegerField(default=0)),
+                ("size", models.BigIntegerField(default=0)),
+                ("subtree_count", models.BigIntegerField(default=0)),
+                ("subtree_size", models.BigIntegerField(default=0)),
+                (
+                    "folder",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="aggregates",
+                        to="website.folder",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("folder", "type", "inTrash", "lockFrom"),
+                        name="folderaggregate_unique_key",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_folder_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0.4 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_storage_usage(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    File = apps.get_model("website", "File")
+    StorageUsage = apps.get_model("website", "StorageUsage")
+
+    files = File.objects.filter(inTrash=False, parent__inTrash=False, state="active")
+    used = {}
+
+    queries = (
+        (files.values("owner_id"), "owner_id"),
+        (apps.get_model("website", "Thumbnail").objects.filter(file__in=files).values("file__owner_id"), "file__owner_id"),
+        (apps.get_model("website", "Moment").objects.filter(file__in=files).values("file__owner_id"), "file__owner_id"),
+        (apps.get_model("website", "Subtitle").objects.filter(file__in=files).values("file__owner_id"), "file__owner_id"),
+    )
+    for rows, owner_field in queries:
+        for row in rows.annotate(total=Sum("size")).order_by():
+            used[row[owner_field]] = used.get(row[owner_field], 0) + (row["total"] or 0)
+
+    StorageUsage.objects.bulk_create(
+        [StorageUsage(user_id=user_id, used=used.get(user_id, 0)) for user_id in User.objects.values_list("id", flat=True)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("website", "0013_folderaggregate"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StorageUsage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("used", models.BigIntegerField(default=0)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill_storage_usage, migrations.RunPython.noop),
+    ]
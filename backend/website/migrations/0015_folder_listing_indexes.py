@@ -0,0 +1,32 @@
+# Generated by Django 6.0.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("website", "0014_storageusage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(fields=["parent", "name", "id"], name="file_parent_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(fields=["parent", "created_at", "id"], name="file_parent_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(fields=["parent", "size", "id"], name="file_parent_size_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="folder",
+            index=models.Index(fields=["parent", "name", "id"], name="folder_parent_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="folder",
+            index=models.Index(fields=["parent", "created_at", "id"], name="folder_parent_created_idx"),
+        ),
+    ]
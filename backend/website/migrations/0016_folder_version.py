@@ -0,0 +1,17 @@
+# Generated by Django 6.0.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("website", "0015_folder_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="folder",
+            name="version",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
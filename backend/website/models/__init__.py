@@ -2,8 +2,8 @@ from .auth_models import PerDeviceToken
 from .discord_models import Channel, Webhook, Bot
 from .file_models import File, Fragment
 from .file_related_models import (Tag, Moment, Subtitle, Thumbnail, SubtitleTrack, AudioTrack, VideoTrack, MediaPosition, VideoMetadata, VideoMetadataTrackMixin)
-from .folder_models import Folder
+from .folder_models import Folder, FolderAggregate
 from .other_models import UserZIP
 from .share_models import ShareAccess, ShareAccessEvent, ShareableLink
-from .user_models import UserPerms, UserSettings, DiscordSettings
+from .user_models import UserPerms, UserSettings, DiscordSettings, StorageUsage
 from .mixin_models import DiscordAttachmentMixin
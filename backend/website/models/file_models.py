@@ -95,6 +95,12 @@ class File(models.Model):
                 name="%(class)s_crc_valid_based_on_size"
             )
         ]
+        indexes = [
+            # keyset pagination of folder listings (queries.builders.build_folder_page)
+            models.Index(fields=["parent", "name", "id"], name="file_parent_name_idx"),
+            models.Index(fields=["parent", "created_at", "id"], name="file_parent_created_idx"),
+            models.Index(fields=["parent", "size", "id"], name="file_parent_size_idx"),
+        ]
 
     MINIMAL_VALUES = ("id", "name", "inTrash", "state", "parent_id", "owner_id", "is_locked", "lockFrom_id", "lockFrom__name", "password", "is_dir")
 
@@ -1,7 +1,7 @@
 import shortuuid
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models import F, CheckConstraint, Q
+from django.db.models import F, CheckConstraint, Q, UniqueConstraint
 from mptt.fields import TreeForeignKey
 from mptt.models import MPTTModel
 from mptt.querysets import TreeQuerySet
@@ -24,6 +24,9 @@ class Folder(MPTTModel):
     autoLock = models.BooleanField(default=False, blank=True)
     lockFrom = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
 
+    # bumped by touch_service whenever the folder's listing or breadcrumbs may have changed, folder listing ETags are built from it
+    version = models.BigIntegerField(default=0)
+
     # --- lifecycle state ---
     state = models.CharField(max_length=32, choices=ItemState.choices, default=ItemState.ACTIVE, db_index=True)
     state_changed_at = models.DateTimeField(null=True, blank=True)
@@ -78,6 +81,11 @@ class Folder(MPTTModel):
                 name="%(class)s_parent_not_self"
             )
         ]
+        indexes = [
+            # keyset pagination of folder listings (queries.builders.build_folder_page)
+            models.Index(fields=["parent", "name", "id"], name="folder_parent_name_idx"),
+            models.Index(fields=["parent", "created_at", "id"], name="folder_parent_created_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -101,3 +109,37 @@ class Folder(MPTTModel):
         # todo move to queries
         queryset = self.get_all_subfolders(include_self=True)
         return File.objects.filter(parent__in=queryset)
+
+
+class FolderAggregate(models.Model):
+    """
+    Materialized file/folder counts and sizes of a folder, one row per (type, inTrash, lockFrom).
+    `count` and `size` cover what the folder holds directly: its files, and itself once under FOLDER_AGGREGATE_TYPE.
+    `subtree_count` and `subtree_size` add up the same for the folder and everything below it.
+
+    Only ACTIVE items are counted. A file is in trash if it or its parent is.
+    Maintained by folder_aggregate_service, periodically rebuilt by reconcile_folder_aggregates.
+    """
+    id = ShortUUIDField(primary_key=True, default=shortuuid.uuid, editable=False)
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name="aggregates")
+    type = models.CharField(max_length=50)
+    inTrash = models.BooleanField()
+    # id of the lock root of the files' parent, "" if unlocked
+    lockFrom = models.CharField(max_length=22, blank=True, default="")
+
+    count = models.BigIntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+    subtree_count = models.BigIntegerField(default=0)
+    subtree_size = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["folder", "type", "inTrash", "lockFrom"],
+                name="%(class)s_unique_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.folder_id} {self.type}"
+
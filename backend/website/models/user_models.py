@@ -28,6 +28,22 @@ class UserSettings(models.Model):
         UserSettings.objects.get_or_create(user=user)
 
 
+class StorageUsage(models.Model):
+    """
+    Running total of the bytes a user stores outside trash: files with their thumbnails, moments and subtitles.
+    Changed only through usage_service deltas, checked by the verify_storage_usage command.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, unique=True)
+    used = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.user.username + "'s storage usage"
+
+    @staticmethod
+    def _create_user_storage_usage(user):
+        StorageUsage.objects.get_or_create(user=user)
+
+
 class UserPerms(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, unique=True)
     globalLock = models.BooleanField(default=False)
@@ -1,17 +1,19 @@
 import time
-from typing import Dict
+from datetime import datetime
+from typing import Dict, Optional
 from typing import List, Iterable, Iterator
 
 from django.db.models import Q
-from django.db.models.aggregates import Sum
 from rest_framework.exceptions import ValidationError
 
 from website.core.Serializers import FileSerializer, FolderSerializer, ShareFolderSerializer, ShareFileSerializer, WebhookSerializer, BotSerializer, ShareAccessEventSerializer
 from website.core.dataModels.general import Item
-from website.core.helpers import get_attr, normalize_blocked_until
+from website.core.errors import BadRequestError
+from website.core.helpers import get_attr, normalize_blocked_until, encode_cursor, decode_cursor
 from website.discord.Discord import discord
 from website.models import Folder, File, Channel, Webhook, Bot, ShareAccessEvent
 from website.models.mixin_models import ItemState
+from website.services import folder_aggregate_service
 
 
 def build_breadcrumbs(folder_obj: Folder) -> List[dict]:
@@ -50,6 +52,105 @@ def build_folder_content(folder_obj: Folder, include_folders: bool = True, inclu
     return folder_dict
 
 
+# listing order -> (file field, folder field). Folders have no size, they're listed by name then
+FOLDER_LISTING_ORDERS = {
+    "name": ("name", "name"),
+    "created": ("created_at", "created_at"),
+    "size": ("size", "name"),
+}
+
+
+def _keyset_page(qs, field: str, descending: bool, after: Optional[tuple], limit: int):
+    """Rows of `qs` ordered by (field, id) that come after `after` ((value, id), None for the start), `limit` + 1 to tell if there's more"""
+    op = "lt" if descending else "gt"
+    if after:
+        value, last_id = after
+        qs = qs.filter(Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": last_id}))
+
+    prefix = "-" if descending else ""
+    return qs.order_by(f"{prefix}{field}", f"{prefix}id")[:limit + 1]
+
+
+def _cursor_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _parse_cursor(cursor: Optional[str], file_field: str, folder_field: str) -> tuple[str, Optional[tuple]]:
+    """:return: section the page starts in ("folders" or "files"), (value, id) of the last row already returned"""
+    if not cursor:
+        return "folders", None
+
+    position = decode_cursor(cursor)
+    if len(position) != 3 or position[0] not in ("folders", "files"):
+        raise BadRequestError("Invalid cursor.")
+
+    section, value, last_id = position
+    if last_id is None:
+        return section, None
+
+    field = file_field if section == "files" else folder_field
+    try:
+        if field == "created_at":
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, int if field == "size" else str) or not isinstance(last_id, str):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise BadRequestError("Invalid cursor.")
+
+    return section, (value, last_id)
+
+
+def build_folder_page(folder_obj: Folder, order: str, descending: bool, cursor: Optional[str], limit: int) -> tuple[list[Folder], list[tuple], Optional[str]]:
+    """
+    One page of a folder's children: its subfolders first, then its files, each ordered by `order` and id.
+    Keyset paginated, the cursor holds the section and the (value, id) of the last row returned,
+    so every page costs an index range scan no matter how deep into the folder it is.
+
+    :return: subfolders, file tuples (File.DISPLAY_VALUES), cursor of the next page or None on the last one
+    """
+    if order not in FOLDER_LISTING_ORDERS:
+        raise BadRequestError(f"Order must be one of: {', '.join(FOLDER_LISTING_ORDERS)}.")
+
+    file_field, folder_field = FOLDER_LISTING_ORDERS[order]
+    section, after = _parse_cursor(cursor, file_field, folder_field)
+
+    folders = []
+    if section == "folders":
+        folders = list(_keyset_page(
+            folder_obj.subfolders.filter(state=ItemState.ACTIVE, inTrash=False).select_related("parent", "lockFrom"),
+            folder_field, descending, after, limit
+        ))
+
+        if len(folders) > limit:
+            folders = folders[:limit]
+            last = folders[-1]
+            return folders, [], encode_cursor(["folders", _cursor_value(getattr(last, folder_field)), last.id])
+
+        after = None
+
+    files_qs = (
+        folder_obj.files
+        .filter(state=ItemState.ACTIVE, inTrash=False)
+        .annotate(**File.get_display_annotate())
+    )
+
+    remaining = limit - len(folders)
+    if remaining == 0:
+        next_cursor = encode_cursor(["files", None, None]) if files_qs.exists() else None
+        return folders, [], next_cursor
+
+    files = list(_keyset_page(files_qs, file_field, descending, after, remaining).values_list(*File.DISPLAY_VALUES))
+
+    next_cursor = None
+    if len(files) > remaining:
+        files = files[:remaining]
+        last = files[-1]
+        value = last[File.DISPLAY_VALUES.index(file_field)]
+        next_cursor = encode_cursor(["files", _cursor_value(value), last[0]])
+
+    return folders, files, next_cursor
+
+
 def build_share_breadcrumbs(folder_obj: Folder, obj_in_share: Item, is_folder_id: bool = False) -> List[Dict]:
     subfolders = folder_obj.get_ancestors(include_self=True, ascending=True)
 
@@ -66,33 +167,16 @@ def build_share_breadcrumbs(folder_obj: Folder, obj_in_share: Item, is_folder_id
 
 def calculate_size(folder: Folder, includeTrash: bool = False) -> int:
     """
-    Function to calculate size of a folder
+    Function to calculate size of a folder, read from its FolderAggregate rows
     """
-    qs = folder.get_all_files().filter(state=ItemState.ACTIVE)
-
-    if not includeTrash:
-        qs = qs.filter(inTrash=False, parent__inTrash=False)
-
-    size_result = qs.aggregate(Sum("size"))
-    return size_result["size__sum"] or 0
+    return folder_aggregate_service.get_size(folder, include_trash=includeTrash)
 
 
 def calculate_file_and_folder_count(folder: Folder, includeTrash: bool = False) -> tuple[int, int]:
     """
-    Function to calculate entire file & folder count of a given folder
+    Function to calculate entire file & folder count of a given folder, read from its FolderAggregate rows
     """
-
-    file_qs = folder.get_all_files().filter(state=ItemState.ACTIVE)
-    folder_qs = folder.get_all_subfolders().filter(state=ItemState.ACTIVE)
-
-    if not includeTrash:
-        file_qs = file_qs.filter(inTrash=False, parent__inTrash=False)
-        folder_qs = folder_qs.filter(inTrash=False)
-
-    file_count = file_qs.count()
-    folder_count = folder_qs.count()
-
-    return folder_count, file_count
+    return folder_aggregate_service.get_file_and_folder_count(folder, include_trash=includeTrash)
 
 
 FILE_VALUE_FIELDS = (
@@ -129,6 +213,7 @@ def build_zip_file_dict(file_row: dict, file_name: str) -> dict:
     }
 
     if file_row.get("encryption_method"):
+        # only read while the layout is built, ZipByteSource.build_layout drops them before the layout is cached
         file_dict["iv"] = file_row["iv"]
         file_dict["key"] = file_row["key"]
 
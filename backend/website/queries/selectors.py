@@ -1,10 +1,11 @@
+import hashlib
 from typing import Union
 
-from django.db.models import Q
+from django.db.models import Q, Count, Max
 
 from website.core.dataModels.general import Item
 from website.core.errors import ResourceNotFoundError, ResourcePermissionError, BadRequestError, NoBotsError
-from website.models import File, Folder, ShareableLink, UserSettings, Bot, Webhook, Channel, DiscordAttachmentMixin
+from website.models import File, Folder, ShareableLink, UserSettings, Bot, Webhook, Channel, DiscordAttachmentMixin, UserZIP
 from website.models.mixin_models import ItemState
 from website.safety.helper import get_classes_extending_discordAttachmentMixin
 
@@ -103,6 +104,22 @@ def check_if_bots_exists(user) -> int:
     return bots_count
 
 
+def get_zip_content_version(user_zip: UserZIP, folder_rows: list[dict]) -> str:
+    """
+    Changes whenever anything that ends up in the zip may have changed: member files, member folders,
+    anything inside them (touches bump the direct parent folder) and the shared parent of the members.
+    """
+    folder_filter = Q(id__in=user_zip.files.values("parent_id")) | Q(id__in=[row["parent_id"] for row in folder_rows])
+    for row in folder_rows:
+        folder_filter |= Q(tree_id=row["tree_id"], lft__gte=row["lft"], rght__lte=row["rght"])
+
+    files = user_zip.files.aggregate(count=Count("id"), last_modified=Max("last_modified_at"))
+    folders = Folder.objects.filter(folder_filter).aggregate(count=Count("id"), last_modified=Max("last_modified_at"))
+
+    payload = f"{user_zip.id}:{files['count']}:{files['last_modified']}:{folders['count']}:{folders['last_modified']}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 DiscordAttachmentClasses = get_classes_extending_discordAttachmentMixin()
 
 
@@ -16,10 +16,11 @@ from website.core.errors import ResourceNotFoundError, BadRequestError, Resource
 from website.core.helpers import get_ip, validate_value
 from website.core.http.utils import get_device_metadata
 from website.core.validators.GeneralChecks import NotEmpty
-from website.models import PerDeviceToken, UserPerms, Folder, UserSettings, DiscordSettings
+from website.models import PerDeviceToken, UserPerms, Folder, UserSettings, DiscordSettings, StorageUsage
 from website.models.other_models import NotificationType, NotificationKind
 from website.services import cache_service, user_service
-from website.tasks.queueTasks import queue_ws_event
+from website.websockets.EventDispatcher import ws_dispatcher
+from website.websockets.groups import get_context_group_name, get_qr_session_group_name
 from website.websockets.utils import send_event
 
 
@@ -61,8 +62,8 @@ def authenticate_qr_session(user: User, session_id) -> None:
 
     auth_data = {"auth_token": raw_token, "device_id": token_obj.device_id}
 
-    queue_ws_event.delay(
-        'qrcode',
+    ws_dispatcher.publish(
+        get_qr_session_group_name(session_id),
         {
             'type': 'approve_session',
             'session_id': session_id,
@@ -77,8 +78,8 @@ def cancel_pending_qr_session(session_id: str) -> None:
     if not session_json:
         raise ResourceNotFoundError("Invalid or expired session")
 
-    queue_ws_event.delay(
-        'qrcode',
+    ws_dispatcher.publish(
+        get_qr_session_group_name(session_id),
         {
             'type': 'cancel_pending_session',
             'session_id': session_id,
@@ -95,8 +96,8 @@ def get_qr_session_device_info(user: User, session_id: str) -> dict:
     session_data = json.loads(session_json)
 
     # send info that the session is now in pending state
-    queue_ws_event.delay(
-        'qrcode',
+    ws_dispatcher.publish(
+        get_qr_session_group_name(session_id),
         {
             'type': 'pending_session',
             'session_id': session_id,
@@ -156,8 +157,8 @@ def _logout_websockets(user: User, device_id: str = None) -> None:
         context.device_id = device_id
 
     send_event(context, None, EventCode.FORCE_LOGOUT)
-    queue_ws_event.delay(
-        'user',
+    ws_dispatcher.publish(
+        get_context_group_name(context),
         {
             "type": "logout",
             "context": context,
@@ -227,3 +228,4 @@ def create_new_user(username: str, password: str, is_superuser: bool):
         UserSettings._create_user_settings(user=user)
         Folder._create_user_root(user=user)
         DiscordSettings._create_user_discord_settings(user=user)
+        StorageUsage._create_user_storage_usage(user=user)
@@ -1,7 +1,8 @@
-from website.constants import cache
+from website.constants import cache, ZIP_EXPIRY_SECONDS
 
 FOLDER_CONTENT_CACHE_TIMEOUT = 6 * 60 * 60
 FOLDER_HASH_CACHE_TIMEOUT = 6 * 60 * 60
+ZIP_LAYOUT_CACHE_TIMEOUT = ZIP_EXPIRY_SECONDS
 
 
 def get_thumbnail_key(file_id: str) -> str:
@@ -16,7 +17,7 @@ def get_folder_hash_key(folder_id: str) -> str:
 
 
 def get_folder_content_version(folder) -> str:
-    return folder.last_modified_at.isoformat() if folder.last_modified_at else ""
+    return str(folder.version)
 
 
 def get_folder_content(folder):
@@ -65,6 +66,33 @@ def set_folder_hash(folder_id: str, version: str, digest: str) -> None:
     )
 
 
+def get_zip_layout_key(zip_id: str, raw: bool) -> str:
+    return f"zip-layout:{zip_id}:{int(raw)}"
+
+
+def get_zip_layout(zip_id: str, raw: bool, version: str):
+    cached = cache.get(get_zip_layout_key(zip_id, raw))
+
+    if not isinstance(cached, dict):
+        return None
+
+    if cached.get("version") != version:
+        return None
+
+    return cached.get("layout")
+
+
+def set_zip_layout(zip_id: str, raw: bool, version: str, layout) -> None:
+    cache.set(
+        get_zip_layout_key(zip_id, raw),
+        {
+            "version": version,
+            "layout": layout,
+        },
+        timeout=ZIP_LAYOUT_CACHE_TIMEOUT,
+    )
+
+
 def get_folder_usage_key(folder_id: str) -> str:
     return f"folder-usage:{folder_id}"
 
@@ -77,5 +105,3 @@ def get_qr_ip_key(qr_ip: str) -> str:
 def get_discord_message_key(message_id: str) -> str:
     return f"discord-message:{message_id}"
 
-def get_total_used_size_key(user_id: int) -> str:
-    return f"total-used-size:{user_id}"
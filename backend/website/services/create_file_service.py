@@ -21,7 +21,7 @@ from website.models import Fragment, File, Moment
 from website.models.file_related_models import PhotoMetadata, Subtitle, RawMetadata, Thumbnail, VideoMetadata
 from website.models.mixin_models import ItemState
 from website.queries.selectors import get_discord_author, get_discord_channel, get_folder, check_if_bots_exists
-from website.services import file_service, attachment_service, touch_service, folder_service, cache_service
+from website.services import file_service, attachment_service, touch_service, folder_service, cache_service, usage_service
 from website.websockets.utils import group_and_send_event, send_event
 
 
@@ -117,6 +117,7 @@ def _create_single_file(request, user: User, file: dict) -> Optional[File]:
         )
 
         file_obj.save()
+        usage_service.add_for_file(file_obj, file_obj.size)
 
         for fragment in fragments:
             _create_fragment_internal(file_obj, fragment)
@@ -205,6 +206,7 @@ def edit_file(user, file_obj: File, file_data: Optional[dict]):
         validate_crc(fragment_size, crc)
 
     with transaction.atomic():
+        old_size = file_obj.size
         fragment_for_delete = None
         if fragments.exists():
             fragment_for_delete = fragments[0]
@@ -225,6 +227,7 @@ def edit_file(user, file_obj: File, file_data: Optional[dict]):
             file_obj.size = 0
 
         file_obj.save()
+        usage_service.add_for_file(file_obj, file_obj.size - old_size)
         touch_service.touch_file_object(file_obj)
 
     send_event(RequestContext.from_user(user.id), file_obj.parent, EventCode.ITEM_UPDATE, FileSerializer.serialize_object(file_obj))
@@ -240,6 +243,7 @@ def delete_thumbnail(file_obj, must_exist=False):
         attachment_service.delete_remote_single_discord_attachment(file_obj.owner, file_obj.thumbnail)
         with transaction.atomic():
             file_obj.thumbnail.delete()
+            usage_service.add_for_file(file_obj, -file_obj.thumbnail.size)
             touch_service.touch_file_object(file_obj)
             key = cache_service.get_thumbnail_key(file_obj.id)
             cache.delete(key)
@@ -13,7 +13,7 @@ from website.models import Thumbnail, File, Subtitle, VideoMetadataTrackMixin, V
 from website.models.file_related_models import RawMetadata, PhotoMetadata, MediaPosition, Tag, Moment
 from website.models.mixin_models import ItemState
 from website.queries.selectors import get_discord_author, get_discord_channel
-from website.services import attachment_service, touch_service
+from website.services import attachment_service, touch_service, usage_service
 
 
 def create_thumbnail_internal(file_obj: File, data: dict) -> Thumbnail:
@@ -36,17 +36,21 @@ def create_thumbnail_internal(file_obj: File, data: dict) -> Thumbnail:
 
     key, iv = validate_encryption_fields(file_obj.encryption_method, key_b64, iv_b64)
 
-    return Thumbnail.objects.create(
-        file=file_obj,
-        size=size,
-        key=key,
-        iv=iv,
-        channel=channel,
-        message_id=message_id,
-        attachment_id=attachment_id,
-        content_type=ContentType.objects.get_for_model(author),
-        object_id=author.discord_id
-    )
+    with transaction.atomic():
+        thumbnail = Thumbnail.objects.create(
+            file=file_obj,
+            size=size,
+            key=key,
+            iv=iv,
+            channel=channel,
+            message_id=message_id,
+            attachment_id=attachment_id,
+            content_type=ContentType.objects.get_for_model(author),
+            object_id=author.discord_id
+        )
+        usage_service.add_for_file(file_obj, thumbnail.size)
+
+    return thumbnail
 
 
 def create_subtitle(file_obj: File, data: dict) -> Subtitle:
@@ -87,6 +91,7 @@ def create_subtitle(file_obj: File, data: dict) -> Subtitle:
             key=key,
             iv=iv
         )
+        usage_service.add_for_file(file_obj, sub.size)
 
         touch_service.touch_file_object(file_obj)
         return sub
@@ -214,6 +219,7 @@ def remove_subtitle(user, file_obj: File, subtitle_id: str) -> None:
         subtitle = Subtitle.objects.select_for_update().get(file=file_obj, id=subtitle_id)
         attachment_service.delete_remote_single_discord_attachment(user, subtitle)
         subtitle.delete()
+        usage_service.add_for_file(file_obj, -subtitle.size)
         touch_service.touch_file_object(file_obj)
 
 
@@ -222,6 +228,7 @@ def remove_moment(user, file_obj, moment_id) -> None:
         moment = Moment.objects.select_for_update().get(file=file_obj, id=moment_id)
         attachment_service.delete_remote_single_discord_attachment(user, moment)
         moment.delete()
+        usage_service.add_for_file(file_obj, -moment.size)
 
 def add_moment(user: User, file_obj: File, data: dict) -> Moment:
     if file_obj.state != ItemState.ACTIVE:
@@ -247,18 +254,21 @@ def add_moment(user: User, file_obj: File, data: dict) -> Moment:
     if Moment.objects.filter(timestamp=timestamp, file=file_obj).exists():
         raise BadRequestError("Moment with this timestamp already exists!")
 
-    moment = Moment.objects.create(
-        timestamp=timestamp,
-        file=file_obj,
-        message_id=message_id,
-        attachment_id=attachment_id,
-        content_type=ContentType.objects.get_for_model(author),
-        channel=channel,
-        object_id=author.discord_id,
-        size=size,
-        key=key,
-        iv=iv
-    )
+    with transaction.atomic():
+        moment = Moment.objects.create(
+            timestamp=timestamp,
+            file=file_obj,
+            message_id=message_id,
+            attachment_id=attachment_id,
+            content_type=ContentType.objects.get_for_model(author),
+            channel=channel,
+            object_id=author.discord_id,
+            size=size,
+            key=key,
+            iv=iv
+        )
+        usage_service.add_for_file(file_obj, moment.size)
+
     return moment
 
 def internal_move_to_trash(files: Iterable[File]) -> None:
@@ -267,7 +277,7 @@ def internal_move_to_trash(files: Iterable[File]) -> None:
     ids = [f.id for f in files if not f.parent.inTrash]
     parent_ids = [f.parent_id for f in files if not f.parent.inTrash]
 
-    with transaction.atomic():
+    with usage_service.track(File.objects.filter(id__in=ids), parent_ids):
         File.objects.filter(id__in=ids).update(inTrash=True, inTrashSince=now)
         touch_service.touch_files(ids, parent_ids=parent_ids)
 
@@ -280,7 +290,7 @@ def internal_restore_from_trash(files: Iterable[File]) -> None:
     ids = [f.id for f in files]
     parent_ids = [f.parent_id for f in files]
 
-    with transaction.atomic():
+    with usage_service.track(File.objects.filter(id__in=ids), parent_ids):
         File.objects.filter(id__in=ids).update(inTrash=False, inTrashSince=None)
         touch_service.touch_files(ids, parent_ids=parent_ids)
 
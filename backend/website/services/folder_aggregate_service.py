@@ -0,0 +1,304 @@
+from collections import defaultdict
+from typing import Iterable
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Sum, F, QuerySet
+
+from website.constants import FOLDER_AGGREGATE_TYPE
+from website.models import File, Folder, FolderAggregate
+from website.models.mixin_models import ItemState
+
+# (type, inTrash, lockFrom)
+AggregateKey = tuple[str, bool, str]
+
+FOLDER_FIELDS = ("id", "parent_id", "tree_id", "lft", "rght", "level", "state", "inTrash", "lockFrom_id")
+
+
+def _add(totals: dict, key, count: int, size: int) -> None:
+    entry = totals.setdefault(key, [0, 0])
+    entry[0] += count
+    entry[1] += size
+
+
+def _count_own(folders: list[dict], files: QuerySet) -> dict[str, dict[AggregateKey, list[int]]]:
+    """Counts what every folder holds directly: its ACTIVE files and itself. One grouped query over `files`."""
+    by_id = {folder["id"]: folder for folder in folders}
+    own = {folder_id: {} for folder_id in by_id}
+
+    for folder in folders:
+        if folder["state"] == ItemState.ACTIVE:
+            _add(own[folder["id"]], (FOLDER_AGGREGATE_TYPE, folder["inTrash"], ""), 1, 0)
+
+    rows = (
+        files
+        .filter(state=ItemState.ACTIVE)
+        .values("parent_id", "type", "inTrash")
+        .annotate(count=Count("id"), size=Sum("size"))
+        .order_by()
+    )
+
+    for row in rows:
+        parent = by_id.get(row["parent_id"])
+        if not parent:
+            continue
+
+        key = (row["type"], row["inTrash"] or parent["inTrash"], parent["lockFrom_id"] or "")
+        _add(own[parent["id"]], key, row["count"], row["size"] or 0)
+
+    return own
+
+
+def _strict_ancestor_ids(folder: dict) -> list[str]:
+    return list(
+        Folder.objects
+        .filter(tree_id=folder["tree_id"], lft__lt=folder["lft"], rght__gt=folder["rght"])
+        .values_list("id", flat=True)
+    )
+
+
+def _load_rows(folder_ids: Iterable[str]) -> dict[tuple[str, AggregateKey], FolderAggregate]:
+    rows = FolderAggregate.objects.select_for_update().filter(folder_id__in=list(folder_ids)).order_by("id")
+    return {(row.folder_id, (row.type, row.inTrash, row.lockFrom)): row for row in rows}
+
+
+def _write(own: dict[tuple[str, AggregateKey], list[int]], subtree_deltas: dict[tuple[str, AggregateKey], list[int]]) -> None:
+    """Sets `own` counts and adds `subtree_deltas` to subtree counts, creating missing rows"""
+    targets = set(own) | set(subtree_deltas)
+    if not targets:
+        return
+
+    folder_ids = {folder_id for folder_id, _ in targets}
+    rows = _load_rows(folder_ids)
+
+    missing = [
+        FolderAggregate(folder_id=folder_id, type=key[0], inTrash=key[1], lockFrom=key[2])
+        for folder_id, key in targets if (folder_id, key) not in rows
+    ]
+    if missing:
+        FolderAggregate.objects.bulk_create(missing, ignore_conflicts=True)
+        rows = _load_rows(folder_ids)
+
+    changed = []
+    for target in targets:
+        row = rows[target]
+
+        if target in own:
+            row.count, row.size = own[target]
+
+        if target in subtree_deltas:
+            count, size = subtree_deltas[target]
+            row.subtree_count = F("subtree_count") + count
+            row.subtree_size = F("subtree_size") + size
+
+        changed.append(row)
+
+    # same order as the row locks above, concurrent writers queue instead of deadlocking
+    changed.sort(key=lambda row: row.id)
+    FolderAggregate.objects.bulk_update(changed, ["count", "size", "subtree_count", "subtree_size"], batch_size=500)
+
+
+def refresh(folder_ids: Iterable[str]) -> None:
+    """
+    Recounts what the given folders hold directly and carries the difference up to all their ancestors.
+    Call it in the transaction that changed their files or their own trash/lock/state, after the change.
+    """
+    folder_ids = sorted({folder_id for folder_id in folder_ids if folder_id})
+    if not folder_ids:
+        return
+
+    with transaction.atomic():
+        folders = list(Folder.objects.select_for_update().filter(id__in=folder_ids).order_by("id").values(*FOLDER_FIELDS))
+        if not folders:
+            return
+
+        own = _count_own(folders, File.objects.filter(parent_id__in=folder_ids))
+
+        stored = defaultdict(dict)
+        for row in FolderAggregate.objects.filter(folder_id__in=folder_ids).values("folder_id", "type", "inTrash", "lockFrom", "count", "size"):
+            stored[row["folder_id"]][(row["type"], row["inTrash"], row["lockFrom"])] = [row["count"], row["size"]]
+
+        new_own = {}
+        deltas = {}
+        for folder in folders:
+            folder_id = folder["id"]
+            before = stored[folder_id]
+            after = own[folder_id]
+
+            delta = {}
+            for key in set(before) | set(after):
+                count, size = after.get(key, [0, 0])
+                old_count, old_size = before.get(key, [0, 0])
+                if (count, size) != (old_count, old_size):
+                    delta[key] = [count - old_count, size - old_size]
+                    new_own[(folder_id, key)] = [count, size]
+
+            if delta:
+                deltas[folder_id] = delta
+
+        if not deltas:
+            return
+
+        by_id = {folder["id"]: folder for folder in folders}
+        subtree_deltas = {}
+        carried_by_id = {}
+
+        # deepest first, a refreshed folder passes its delta on to its refreshed parent in memory
+        # and only climbs the rest of the tree in the database once
+        for folder in sorted(folders, key=lambda f: -f["level"]):
+            carried = carried_by_id.pop(folder["id"], {})
+            for key, (count, size) in deltas.get(folder["id"], {}).items():
+                _add(carried, key, count, size)
+
+            if not carried:
+                continue
+
+            for key, (count, size) in carried.items():
+                _add(subtree_deltas, (folder["id"], key), count, size)
+
+            parent_id = folder["parent_id"]
+            if parent_id in by_id:
+                parent_carried = carried_by_id.setdefault(parent_id, {})
+                for key, (count, size) in carried.items():
+                    _add(parent_carried, key, count, size)
+
+            elif parent_id:
+                for ancestor_id in _strict_ancestor_ids(folder):
+                    for key, (count, size) in carried.items():
+                        _add(subtree_deltas, (ancestor_id, key), count, size)
+
+        _write(new_own, subtree_deltas)
+
+
+def _shift_subtree(folder: Folder, sign: int) -> None:
+    folder = Folder.objects.values(*FOLDER_FIELDS).get(id=folder.id)
+    totals = {
+        (row.type, row.inTrash, row.lockFrom): [sign * row.subtree_count, sign * row.subtree_size]
+        for row in FolderAggregate.objects.select_for_update().filter(folder_id=folder["id"])
+    }
+
+    if not totals:
+        return
+
+    subtree_deltas = {
+        (ancestor_id, key): list(totals[key])
+        for ancestor_id in _strict_ancestor_ids(folder)
+        for key in totals
+    }
+    _write({}, subtree_deltas)
+
+
+def detach_subtree(folder: Folder) -> None:
+    """Takes a folder's subtree totals off its ancestors, call right before moving it"""
+    _shift_subtree(folder, -1)
+
+
+def attach_subtree(folder: Folder) -> None:
+    """Adds a folder's subtree totals to its (new) ancestors, call right after moving it"""
+    _shift_subtree(folder, 1)
+
+
+def rebuild_for_user(user: User) -> int:
+    """
+    Recomputes every aggregate of a user from scratch and fixes the rows that drifted.
+    Holds the user's folder rows for the duration so incremental updates wait instead of interleaving.
+
+    :return: number of rows that were wrong
+    """
+    with transaction.atomic():
+        folders = list(Folder.objects.select_for_update().filter(owner=user).order_by("id").values(*FOLDER_FIELDS))
+        own = _count_own(folders, File.objects.filter(parent__owner=user))
+
+        expected = {}
+        for folder_id, totals in own.items():
+            for key, (count, size) in totals.items():
+                expected[(folder_id, key)] = [count, size, 0, 0]
+
+        by_id = {folder["id"]: folder for folder in folders}
+        subtree = {folder_id: {key: list(value) for key, value in totals.items()} for folder_id, totals in own.items()}
+
+        for folder in sorted(folders, key=lambda f: -f["level"]):
+            totals = subtree[folder["id"]]
+            for key, (count, size) in totals.items():
+                entry = expected.setdefault((folder["id"], key), [0, 0, 0, 0])
+                entry[2] = count
+                entry[3] = size
+
+            if folder["parent_id"] in by_id:
+                parent_totals = subtree[folder["parent_id"]]
+                for key, (count, size) in totals.items():
+                    _add(parent_totals, key, count, size)
+
+        rows = {
+            (row.folder_id, (row.type, row.inTrash, row.lockFrom)): row
+            for row in FolderAggregate.objects.select_for_update().filter(folder__owner=user).order_by("id")
+        }
+
+        fixed = []
+        for target, row in rows.items():
+            values = expected.get(target, [0, 0, 0, 0])
+            if [row.count, row.size, row.subtree_count, row.subtree_size] != values:
+                row.count, row.size, row.subtree_count, row.subtree_size = values
+                fixed.append(row)
+
+        missing = [
+            FolderAggregate(folder_id=folder_id, type=key[0], inTrash=key[1], lockFrom=key[2],
+                            count=values[0], size=values[1], subtree_count=values[2], subtree_size=values[3])
+            for (folder_id, key), values in expected.items() if (folder_id, key) not in rows
+        ]
+
+        FolderAggregate.objects.bulk_update(fixed, ["count", "size", "subtree_count", "subtree_size"], batch_size=500)
+        FolderAggregate.objects.bulk_create(missing, batch_size=1000)
+
+        # rows nothing counts towards anymore
+        FolderAggregate.objects.filter(folder__owner=user, count=0, size=0, subtree_count=0, subtree_size=0).delete()
+
+        return len(fixed) + len(missing)
+
+
+def _subtree_rows(folder: Folder, include_trash: bool) -> QuerySet:
+    rows = FolderAggregate.objects.filter(folder_id=folder.id)
+    if not include_trash:
+        rows = rows.filter(inTrash=False)
+    return rows
+
+
+def get_size(folder: Folder, include_trash: bool = False) -> int:
+    rows = _subtree_rows(folder, include_trash).exclude(type=FOLDER_AGGREGATE_TYPE)
+    return rows.aggregate(total=Sum("subtree_size"))["total"] or 0
+
+
+def get_file_and_folder_count(folder: Folder, include_trash: bool = False) -> tuple[int, int]:
+    folder_count = 0
+    file_count = 0
+
+    for row in _subtree_rows(folder, include_trash).values("type", "count", "subtree_count"):
+        if row["type"] == FOLDER_AGGREGATE_TYPE:
+            # the folder itself isn't one of its subfolders
+            folder_count += row["subtree_count"] - row["count"]
+        else:
+            file_count += row["subtree_count"]
+
+    return folder_count, file_count
+
+
+def get_file_stats(folder: Folder) -> dict[str, dict]:
+    """
+    Count and size per file type of the folder's non trash subtree.
+    Files behind a lock other than this folder's are merged into "hidden", without a count.
+    """
+    stats = {}
+
+    for row in _subtree_rows(folder, include_trash=False).exclude(type=FOLDER_AGGREGATE_TYPE).values("type", "lockFrom", "subtree_count", "subtree_size"):
+        if not row["subtree_count"]:
+            continue
+
+        file_type = "hidden" if row["lockFrom"] and row["lockFrom"] != folder.id else row["type"]
+        entry = stats.setdefault(file_type, {"count": 0, "total_size": 0})
+        entry["count"] += row["subtree_count"]
+        entry["total_size"] += row["subtree_size"]
+
+    if "hidden" in stats:
+        stats["hidden"]["count"] = None
+
+    return dict(sorted(stats.items()))
@@ -13,7 +13,7 @@ from website.core.helpers import validate_value
 from website.core.validators.GeneralChecks import IsValidItemName, NotEmpty
 from website.models import Folder, File
 from website.models.mixin_models import ItemState
-from website.services import touch_service
+from website.services import touch_service, folder_aggregate_service, usage_service
 from website.tasks.otherTasks import lock_folder_task, unlock_folder_task
 from website.websockets.utils import send_event
 
@@ -131,10 +131,14 @@ def internal_move_to_new_parent(folder: Folder, new_parent: "Folder") -> None:
 
         folder.refresh_from_db()
 
+        folder_aggregate_service.detach_subtree(folder)
+
         folder.parent = new_parent
         folder.move_to(new_parent, "last-child")
         folder.save()
 
+        folder_aggregate_service.attach_subtree(folder)
+
         touch_service.touch_folder_move(
             [folder.id],
             old_parent_ids=[old_parent.id] if old_parent else [],
@@ -147,7 +151,7 @@ def internal_move_to_trash(folder: Folder) -> None:
 
     folder_ids = [folder.id, *[f.id for f in subfolders]]
 
-    with transaction.atomic():
+    with usage_service.track(File.objects.filter(parent_id__in=folder_ids), folder_ids):
         Folder.objects.filter(id__in=folder_ids).update(
             inTrash=True,
             inTrashSince=now,
@@ -165,7 +169,7 @@ def internal_restore_from_trash(folder: Folder) -> None:
     folders = [folder, *subfolders]
     folder_ids = [f.id for f in folders]
 
-    with transaction.atomic():
+    with usage_service.track(File.objects.filter(parent_id__in=folder_ids), folder_ids):
         Folder.objects.filter(id__in=folder_ids).update(
             inTrash=False,
             inTrashSince=None,
@@ -35,7 +35,8 @@ def rename_item(context: RequestContext, item_obj: Item, new_name: str) -> None:
             touch_service.touch_file_object(item_obj)
             data = FileSerializer.serialize_object(item_obj)
         else:
-            item_obj.save()
+            # only the name, a full save would write back the version this request loaded
+            item_obj.save(update_fields=["name"])
             touch_service.touch_folder_object(item_obj)
             data = FolderSerializer.serialize_object(item_obj)
 
@@ -18,7 +18,8 @@ from website.discord.Discord import discord
 from website.models import File, Moment, Subtitle, UserZIP, Thumbnail
 from website.models.mixin_models import ItemState
 from website.queries.builders import build_zip_file_dict, build_flattened_children_mptt_values, FILE_VALUE_FIELDS, FOLDER_VALUE_FIELDS
-from website.queries.selectors import check_if_bots_exists
+from website.queries.selectors import check_if_bots_exists, get_zip_content_version
+from website.services import cache_service
 from itertools import chain
 
 
@@ -99,12 +100,12 @@ def get_file_response(request, file_obj: File):
     fragments = file_obj.fragments.all().order_by("sequence")
     user = file_obj.owner  # without this call it will break lol
 
-    check_if_bots_exists(user)
+    num_bots = check_if_bots_exists(user)
 
     if not fragments.exists():
         source = EmptyByteSource()
     else:
-        source = FragmentedDiscordByteSource(file_obj=file_obj, fragments=fragments, decrypted=not raw)
+        source = FragmentedDiscordByteSource(file_obj=file_obj, fragments=fragments, decrypted=not raw, read_ahead=num_bots)
 
     response = build_streaming_response(
         request=request,
@@ -148,33 +149,45 @@ def get_zip_response(request, user_zip: UserZIP):
     single_root = not files_exists and len(folders) == 1
 
     if single_root:
-        root_folder = folders[0]
-        dict_files = build_flattened_children_mptt_values(root_folder, include_root_name=False)
-        zip_name = f"{root_folder['name']}.zip"
+        zip_name = f"{folders[0]['name']}.zip"
     else:
-        file_rows = files_qs.values(*FILE_VALUE_FIELDS).order_by("id").iterator(chunk_size=1000)
+        zip_name = f"{user_zip.name}.zip"
 
-        folder_iterators = (
-            build_flattened_children_mptt_values(folder_row)
-            for folder_row in folders
-        )
+    # download managers open the same zip many times with different ranges, the layout is only rebuilt when a member changes
+    version = get_zip_content_version(user_zip, folders)
+    layout = cache_service.get_zip_layout(user_zip.id, raw, version)
 
-        dict_files = chain(
-            iter_zip_file_dicts(file_rows),
-            chain.from_iterable(folder_iterators),
-        )
+    if layout is None:
+        if single_root:
+            dict_files = build_flattened_children_mptt_values(folders[0], include_root_name=False)
+        else:
+            file_rows = files_qs.values(*FILE_VALUE_FIELDS).order_by("id").iterator(chunk_size=1000)
 
-        zip_name = f"{user_zip.name}.zip"
+            folder_iterators = (
+                build_flattened_children_mptt_values(folder_row)
+                for folder_row in folders
+            )
+
+            dict_files = chain(
+                iter_zip_file_dicts(file_rows),
+                chain.from_iterable(folder_iterators),
+            )
+
+        layout = ZipByteSource.build_layout(dict_files, decrypted=not raw)
+
+        # encryption keys never go to redis, raw zips of encrypted files are rebuilt per request
+        if not layout.contains_keys:
+            cache_service.set_zip_layout(user_zip.id, raw, version, layout)
 
     owner = first_file.owner if first_file else first_folder.owner
-    source = ZipByteSource(dict_files=dict_files, owner=owner, num_bots=num_bots, decrypted=not raw)
+    source = ZipByteSource(layout=layout, owner=owner, num_bots=num_bots, decrypted=not raw)
 
     return build_streaming_response(
         request=request,
         byte_source=source,
         filename=zip_name,
         content_type="application/zip",
-        etag=user_zip.id,
+        etag=version,
         vary=["x-resource-password"],
     )
 
@@ -193,13 +206,13 @@ def get_zip_entry_response(request, file_obj: File):
     fragments = file_obj.fragments.all().order_by("sequence")
     user = file_obj.owner
 
-    check_if_bots_exists(user)
+    num_bots = check_if_bots_exists(user)
 
     if not fragments.exists():
         source = EmptyByteSource()
     else:
         source = DeflateZipEntryByteSource(file_obj=file_obj, fragments=fragments, offset=offset, compression_method=compression_method, compressed_size=compressed_size,
-                                           uncompressed_size=uncompressed_size)
+                                           uncompressed_size=uncompressed_size, read_ahead=num_bots)
 
     return build_streaming_response(
         request=request,
@@ -6,6 +6,7 @@ from django.core.exceptions import BadRequest
 from django.db.models.query_utils import Q
 
 from website.core.Serializers import FileSerializer, FolderSerializer
+from website.core.crypto.signer import ResourceSigner
 from website.core.errors import BadRequestError
 from website.core.helpers import validate_key, validate_ids_as_list
 from website.core.validators.GeneralChecks import MaxLength, Max, Min
@@ -380,7 +381,8 @@ def perform_search(request):
             .annotate(**File.get_display_annotate())
             .values_list(*File.DISPLAY_VALUES)[:result_limit]
         )
-        result.extend(FileSerializer.serialize_tuple(f) for f in files)
+        signer = ResourceSigner()
+        result.extend(FileSerializer.serialize_tuple(f, signer=signer) for f in files)
 
     if include_folders:
         folders = (
@@ -1,8 +1,10 @@
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 
 from website.models import File
 from website.models import Folder
+from website.services import folder_aggregate_service
 
 
 def _file_parent_ids(file_ids: list[str]) -> list[str]:
@@ -29,14 +31,26 @@ def _folder_parent_ids_from_objects(folders: list[Folder]) -> list[str]:
     return list({folder.parent_id for folder in folders if folder.parent_id is not None})
 
 
+def _touch_folder_rows(folder_ids: list[str], now) -> None:
+    Folder.objects.filter(id__in=folder_ids).update(last_modified_at=now, version=F("version") + 1)
+
+
+def touch_folder_listings(folder_ids: list[str]) -> None:
+    """For changes to what a folder lists that don't go through the touch_* functions above, e.g. children being marked for deletion"""
+    _touch_folder_rows(folder_ids, timezone.now())
+
+
 def touch_files(file_ids: list[str], parent_ids: list[str] | None = None, touch_parent_listings: bool = True) -> None:
     now = timezone.now()
 
     with transaction.atomic():
         File.objects.filter(id__in=file_ids).update(last_modified_at=now)
 
+        parent_ids = parent_ids or _file_parent_ids(file_ids)
         if touch_parent_listings:
-            Folder.objects.filter(id__in=parent_ids or _file_parent_ids(file_ids)).update(last_modified_at=now)
+            _touch_folder_rows(parent_ids, now)
+
+        folder_aggregate_service.refresh(parent_ids)
 
 
 def touch_file_objects(files: list[File], touch_parent_listings: bool = True) -> None:
@@ -46,18 +60,23 @@ def touch_file_objects(files: list[File], touch_parent_listings: bool = True) ->
     with transaction.atomic():
         File.objects.filter(id__in=file_ids).update(last_modified_at=now)
 
+        parent_ids = _file_parent_ids_from_objects(files)
         if touch_parent_listings:
-            Folder.objects.filter(id__in=_file_parent_ids_from_objects(files)).update(last_modified_at=now)
+            _touch_folder_rows(parent_ids, now)
+
+        folder_aggregate_service.refresh(parent_ids)
 
 
 def touch_folders(folder_ids: list[str], parent_ids: list[str] | None = None, touch_parent_listings: bool = True) -> None:
     now = timezone.now()
 
     with transaction.atomic():
-        Folder.objects.filter(id__in=folder_ids).update(last_modified_at=now)
+        _touch_folder_rows(folder_ids, now)
 
         if touch_parent_listings:
-            Folder.objects.filter(id__in=parent_ids or _folder_parent_ids(folder_ids)).update(last_modified_at=now)
+            _touch_folder_rows(parent_ids or _folder_parent_ids(folder_ids), now)
+
+        folder_aggregate_service.refresh(folder_ids)
 
 
 def touch_folder_objects(folders: list[Folder], touch_parent_listings: bool = True) -> None:
@@ -65,10 +84,12 @@ def touch_folder_objects(folders: list[Folder], touch_parent_listings: bool = Tr
 
     folder_ids = _folder_ids(folders)
     with transaction.atomic():
-        Folder.objects.filter(id__in=folder_ids).update(last_modified_at=now)
+        _touch_folder_rows(folder_ids, now)
 
         if touch_parent_listings:
-            Folder.objects.filter(id__in=_folder_parent_ids_from_objects(folders)).update(last_modified_at=now)
+            _touch_folder_rows(_folder_parent_ids_from_objects(folders), now)
+
+        folder_aggregate_service.refresh(folder_ids)
 
 
 def touch_file_move(file_ids: list[str], old_parent_ids: list[str], new_parent_ids: list[str]) -> None:
@@ -76,7 +97,9 @@ def touch_file_move(file_ids: list[str], old_parent_ids: list[str], new_parent_i
     with transaction.atomic():
         File.objects.filter(id__in=file_ids).update(last_modified_at=now)
 
-        Folder.objects.filter(id__in=[*old_parent_ids, *new_parent_ids]).update(last_modified_at=now)
+        _touch_folder_rows([*old_parent_ids, *new_parent_ids], now)
+
+        folder_aggregate_service.refresh([*old_parent_ids, *new_parent_ids])
 
 
 def touch_file_object_move(files: list[File], old_parent_ids: list[str], new_parent_ids: list[str]) -> None:
@@ -86,7 +109,7 @@ def touch_file_object_move(files: list[File], old_parent_ids: list[str], new_par
 def touch_folder_move(folder_ids: list[str], old_parent_ids: list[str], new_parent_ids: list[str]) -> None:
     now = timezone.now()
 
-    Folder.objects.filter(id__in=[*folder_ids, *old_parent_ids, *new_parent_ids]).update(last_modified_at=now)
+    _touch_folder_rows([*folder_ids, *old_parent_ids, *new_parent_ids], now)
 
 
 def touch_folder_object_move(folders: list[Folder], old_parent_ids: list[str], new_parent_ids: list[str]) -> None:
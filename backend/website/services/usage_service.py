@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+from typing import Iterable
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Sum, F, Q, QuerySet
+
+from website.models import File, Folder, Thumbnail, Moment, Subtitle, StorageUsage
+from website.models.mixin_models import ItemState
+
+# Files that take up a user's storage: active ones outside trash. plan_deletion_job takes files off once they turn DELETING
+USED_FILES = Q(inTrash=False, parent__inTrash=False, state=ItemState.ACTIVE)
+
+
+def measure(files: QuerySet) -> dict[int, int]:
+    """
+    Bytes `files` take up (outside trash), with their thumbnails, moments and subtitles.
+
+    :return: owner id -> bytes
+    """
+    used = {}
+    files = files.filter(USED_FILES)
+
+    queries = (
+        (files.values("owner_id"), "owner_id"),
+        (Thumbnail.objects.filter(file__in=files).values("file__owner_id"), "file__owner_id"),
+        (Moment.objects.filter(file__in=files).values("file__owner_id"), "file__owner_id"),
+        (Subtitle.objects.filter(file__in=files).values("file__owner_id"), "file__owner_id"),
+    )
+
+    for rows, owner_field in queries:
+        for row in rows.annotate(total=Sum("size")).order_by():
+            used[row[owner_field]] = used.get(row[owner_field], 0) + (row["total"] or 0)
+
+    return used
+
+
+def apply_deltas(deltas: dict[int, int]) -> None:
+    """Adds signed byte deltas to the users' ledger rows, in user id order so concurrent writers don't deadlock"""
+    for user_id in sorted(deltas):
+        if deltas[user_id]:
+            StorageUsage.objects.filter(user_id=user_id).update(used=F("used") + deltas[user_id])
+
+
+def _lock_folders(folder_ids: Iterable[str]) -> None:
+    """
+    Serializes usage changes of files in these folders, track() against add_for_file().
+    Without it a file added between track()'s two measures would be counted in but never taken off.
+    """
+    list(Folder.objects.select_for_update().filter(id__in=set(folder_ids)).order_by("id").values_list("id", flat=True))
+
+
+def add_for_file(file_obj: File, delta: int) -> None:
+    """Records bytes added to (or removed from, negative) a file, if the file counts towards usage"""
+    if not delta:
+        return
+
+    with transaction.atomic():
+        _lock_folders([file_obj.parent_id])
+
+        # re-read under the lock, a concurrent track() may have just moved it in or out of trash
+        if File.objects.filter(USED_FILES, id=file_obj.id).exists():
+            apply_deltas({file_obj.owner_id: delta})
+
+
+@contextmanager
+def track(files: QuerySet, folder_ids: Iterable[str]):
+    """
+    Measures `files` before and after the block and records the difference.
+    For changes that move many files in or out of trash at once. `files` must still match the same files afterwards.
+    `folder_ids` are the folders `files` live in, locked for the block so no upload or edit lands between the measures.
+    """
+    with transaction.atomic():
+        _lock_folders(folder_ids)
+        before = measure(files)
+        yield
+        after = measure(files)
+
+        apply_deltas({user_id: after.get(user_id, 0) - before.get(user_id, 0) for user_id in before.keys() | after.keys()})
+
+
+def get_used(user: User) -> int:
+    used = StorageUsage.objects.filter(user=user).values_list("used", flat=True).first()
+    if used is None:
+        # users created before the ledger existed, verify_storage_usage --fix backfills them in bulk
+        usage, _ = StorageUsage.objects.get_or_create(user=user, defaults={"used": recompute([user.id]).get(user.id, 0)})
+        used = usage.used
+
+    return used
+
+
+def recompute(user_ids: list[int] | None = None) -> dict[int, int]:
+    """
+    Recomputes the ledger of the given users (all if None) from scratch in bulk, 4 grouped queries in total.
+    Doesn't write anything. :return: user id -> bytes
+    """
+    files = File.objects.all()
+    if user_ids is not None:
+        files = files.filter(owner_id__in=user_ids)
+
+    return measure(files)
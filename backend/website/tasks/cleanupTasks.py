@@ -9,7 +9,7 @@ from django.utils import timezone as django_timezone
 from .helper import is_bulk_deletable
 from .otherTasks import _handle_parse_failure
 from ..celery import app
-from ..constants import MAX_TIME_FILES_IN_TRASH, MAX_RAW_EXTRACTION_ATTEMPTS
+from ..constants import MAX_TIME_FILES_IN_TRASH, MAX_RAW_EXTRACTION_ATTEMPTS, DiscordRequestPriority
 from ..core.dataModels.http import RequestContext
 from ..core.errors import NoBotsError, DiscordError
 from ..discord.Discord import discord
@@ -98,18 +98,18 @@ def bulk_delete_messages(user, channel_id, message_ids):
     if not message_ids:
         return
 
-    discord.bulk_delete_messages(user, channel_id, message_ids)
+    discord.bulk_delete_messages(user, channel_id, message_ids, priority=DiscordRequestPriority.LOW)
 
 def delete_single_safe(user, channel_id, message_id):
     try:
-        discord.delete_message(user, channel_id, message_id)
+        discord.delete_message(user, channel_id, message_id, priority=DiscordRequestPriority.LOW)
     except DiscordError as error:
         if error.status != 404:
             raise
 
 def flush_bulk(user, channel_id, message_ids):
     try:
-        discord.bulk_delete_messages(user, channel_id, message_ids)
+        discord.bulk_delete_messages(user, channel_id, message_ids, priority=DiscordRequestPriority.LOW)
     except DiscordError as error:
         if error.status != 404:
             raise
@@ -125,7 +125,7 @@ def process_channel(user, channel, days):
     cutoff = now - timedelta(days=days)
 
     try:
-        for discord_message in discord.fetch_all_messages(user, channel.discord_id):
+        for discord_message in discord.fetch_all_messages(user, channel.discord_id, priority=DiscordRequestPriority.LOW):
 
             msg_id = discord_message["id"]
             timestamp = datetime.fromisoformat(discord_message["timestamp"])
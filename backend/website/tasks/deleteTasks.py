@@ -18,6 +18,7 @@ from website.models import File, Folder, Fragment, Thumbnail, Moment, Subtitle,
 from website.models.delete_models import DeletionJob, DeletionFolderWorkItem, DeletionFileWorkItem
 from website.models.mixin_models import ItemState
 from website.queries.selectors import query_attachments
+from website.services import folder_aggregate_service, usage_service, touch_service
 from website.tasks.helper import is_bulk_deletable
 from website.websockets.utils import send_event, send_message
 
@@ -115,16 +116,27 @@ def plan_deletion_job(job_id: UUID) -> None:
         )
 
         # ---- mark domain rows ----
-        File.objects.filter(id__in=expanded_file_ids).update(
-            state=ItemState.DELETING,
-            state_changed_at=timezone.now(),
-        )
+        file_parent_ids = list(File.objects.filter(id__in=expanded_file_ids).values_list("parent_id", flat=True).distinct())
+
+        # DELETING files stop taking up storage right away, not once discord finished deleting them
+        with usage_service.track(File.objects.filter(id__in=expanded_file_ids), file_parent_ids):
+            File.objects.filter(id__in=expanded_file_ids).update(
+                state=ItemState.DELETING,
+                state_changed_at=timezone.now(),
+            )
 
         Folder.objects.filter(id__in=expanded_folder_ids).update(
             state=ItemState.DELETING,
             state_changed_at=timezone.now(),
         )
 
+        # DELETING items stop counting right away, hard deletes later remove rows that are already 0
+        folder_aggregate_service.refresh([*expanded_folder_ids, *file_parent_ids])
+
+        # their parents stop listing them, so cached listings and ETags of those parents must go stale
+        folder_parent_ids = Folder.objects.filter(id__in=expanded_folder_ids).values_list("parent_id", flat=True).distinct()
+        touch_service.touch_folder_listings([*file_parent_ids, *(folder_id for folder_id in folder_parent_ids if folder_id)])
+
         # ---- totals ----
         job.total_file_items = len(expanded_file_ids)
         job.total_folder_items = len(expanded_folder_ids)
@@ -381,6 +393,7 @@ def mark_remote_done(claim_token: UUID) -> None:
 
 def finalize_file_deletions(job_id: UUID, file_ids: list[str], claim_token: UUID) -> None:
     with transaction.atomic():
+        # usage was already taken off by plan_deletion_job
         delete_fragments(file_ids)
 
         Thumbnail.objects.filter(file_id__in=file_ids).delete()
@@ -2,11 +2,6 @@ from datetime import datetime, timezone, timedelta
 
 DISCORD_EPOCH = 1420070400000  # ms
 
-def auto_prefetch(fragment_id: str) -> None:
-    from .otherTasks import prefetch_next_fragments
-    fragments_to_prefetch = 5
-    prefetch_next_fragments.delay(fragment_id, fragments_to_prefetch)
-
 def snowflake_to_datetime(snowflake_id: str):
     snowflake = int(snowflake_id)
     timestamp_ms = (snowflake >> 22) + DISCORD_EPOCH
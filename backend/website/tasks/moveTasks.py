@@ -4,57 +4,52 @@ from django.core.exceptions import ValidationError
 
 from website.celery import app
 from website.constants import EventCode
-from website.core.Serializers import FolderSerializer, FileSerializer
+from website.core.Serializers import FolderSerializer
 from website.core.dataModels.http import RequestContext
 from website.models import Folder, File
 from website.queries.selectors import get_folder
 from website.services import folder_service, file_service
-from website.websockets.utils import send_event, send_message
+from website.websockets.FolderEventBatch import FolderEventBatch
+from website.websockets.utils import send_message
 
 
-def move_group(context: RequestContext, grouped_items, new_parent, processed_count, last_percentage, total_length, is_folder):
+def move_group(context: RequestContext, events: FolderEventBatch, grouped_items, new_parent, processed_count, last_percentage, total_length, is_folder):
 
     BATCH_SIZE = 250
 
     for old_parent_id, item_group in grouped_items.items():
         old_parent = Folder.objects.get(id=old_parent_id)
 
-        item_dicts_batch = []
-        ids = []
-
         # Perform one normal move on first item to trigger checks & on_save()
         first_item = item_group.pop(0)
+
+        # events are queued only after the move went through, a failed move must not announce anything
         if is_folder:
             folder_service.internal_move_to_new_parent(folder=first_item, new_parent=new_parent)
+            events.add(old_parent, EventCode.ITEM_MOVE_OUT, [first_item.id])
+            events.add(new_parent, EventCode.ITEM_MOVE_IN, [FolderSerializer.serialize_object(first_item)])
         else:
             file_service.internal_move_to_new_parent(file_ids=[first_item.id], new_parent=new_parent)
-
-        send_event(context, old_parent, EventCode.ITEM_MOVE_OUT, [first_item.id])
-
-        first_item_dict = FolderSerializer.serialize_object(first_item) if is_folder else FileSerializer.serialize_object(first_item)
-        send_event(context, new_parent, EventCode.ITEM_MOVE_IN, [first_item_dict])
+            events.add(old_parent, EventCode.ITEM_MOVE_OUT, [first_item.id])
+            events.add_files(new_parent, EventCode.ITEM_MOVE_IN, [first_item.id])
 
         while item_group:
             batch = item_group[:BATCH_SIZE]  # Take first batch
             item_group = item_group[BATCH_SIZE:]  # Remove taken batch
 
-            file_ids = []
-            # Prepare remaining items for bulk update
-            for item in batch:
-                if is_folder:
-                    # save without bulk update if it's a folder batch
-                    folder_service.internal_move_to_new_parent(folder=item, new_parent=new_parent)
-                else:
-                    file_ids.append(item.id)
-
-            # Bulk update the batch only if it's a file batch (bulk update messes up MPTT structure I think)
-            if file_ids:
-                file_service.internal_move_to_new_parent(file_ids=file_ids, new_parent=new_parent)
+            ids = [item.id for item in batch]
 
-            for item in batch:
-                item_dict = FolderSerializer.serialize_object(item) if is_folder else FileSerializer.serialize_object(item)
-                item_dicts_batch.append(item_dict)
-                ids.append(item.id)
+            if is_folder:
+                # save without bulk update if it's a folder batch, each folder is announced once it has moved
+                for item in batch:
+                    folder_service.internal_move_to_new_parent(folder=item, new_parent=new_parent)
+                    events.add(old_parent, EventCode.ITEM_MOVE_OUT, [item.id])
+                    events.add(new_parent, EventCode.ITEM_MOVE_IN, [FolderSerializer.serialize_object(item)])
+            else:
+                # Bulk update the batch only if it's a file batch (bulk update messes up MPTT structure I think)
+                file_service.internal_move_to_new_parent(file_ids=ids, new_parent=new_parent)
+                events.add(old_parent, EventCode.ITEM_MOVE_OUT, ids)
+                events.add_files(new_parent, EventCode.ITEM_MOVE_IN, ids)
 
             # Update progress
             processed_count += len(batch) + 1  # First item + bulk updated items
@@ -63,12 +58,6 @@ def move_group(context: RequestContext, grouped_items, new_parent, processed_cou
                 send_message(message="toasts.itemsAreBeingMoved", args={"percentage": percentage}, finished=False, context=context)
                 last_percentage = percentage
 
-            # Send batched events
-            send_event(context, old_parent, EventCode.ITEM_MOVE_OUT, ids)
-            send_event(context, new_parent, EventCode.ITEM_MOVE_IN, item_dicts_batch)
-            item_dicts_batch = []
-            ids = []
-
     return processed_count, last_percentage
 
 @app.task
@@ -96,17 +85,18 @@ def move_task(context: dict, ids: list[str], new_parent_id: str):
         last_percentage = 0
         processed_count = 0
 
-        # Process files
-        processed_count, last_percentage = move_group(
-            context, grouped_files, new_parent,
-            processed_count, last_percentage, total_length, is_folder=False
-        )
-
-        # Process folders
-        move_group(
-            context, grouped_folders, new_parent,
-            processed_count, last_percentage, total_length, is_folder=True
-        )
+        with FolderEventBatch(context) as events:
+            # Process files
+            processed_count, last_percentage = move_group(
+                context, events, grouped_files, new_parent,
+                processed_count, last_percentage, total_length, is_folder=False
+            )
+
+            # Process folders
+            move_group(
+                context, events, grouped_folders, new_parent,
+                processed_count, last_percentage, total_length, is_folder=True
+            )
 
         send_message(message="toasts.movedItems", args=None, finished=True, context=context)
 
@@ -7,22 +7,23 @@ import rawpy
 import requests
 from PIL import Image
 from celery.utils.log import get_task_logger
+from django.contrib.auth.models import User
 from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
 
 from website.celery import app
 from website.config import MAX_RAW_IMAGE_SIZE_ALLOWED_FOR_CONVERSION, GENERATE_RAW_THUMBNAILS
-from website.constants import EventCode, MAX_RAW_EXTRACTION_ATTEMPTS, MAX_ATTACHMENTS_PER_MESSAGE, MAX_DISCORD_MESSAGE_SIZE
+from website.constants import EventCode, MAX_RAW_EXTRACTION_ATTEMPTS, MAX_ATTACHMENTS_PER_MESSAGE, MAX_DISCORD_MESSAGE_SIZE, DiscordRequestPriority
 from website.core.Serializers import FileSerializer
 from website.core.crypto.Decryptor import Decryptor
 from website.core.crypto.Encryptor import Encryptor
 from website.core.dataModels.http import RequestContext
 from website.core.errors import FailedToParseRawImage
 from website.discord.Discord import discord
-from website.models import Folder, Fragment, File, DiscordSettings
+from website.models import Folder, File, DiscordSettings
 from website.models.other_models import RawExtractionClaim, NotificationKind, NotificationType
-from website.services import folder_service, create_file_service, file_service, user_service, touch_service
+from website.services import folder_service, create_file_service, file_service, user_service, touch_service, folder_aggregate_service
 from website.websockets.utils import send_event, send_message
 
 logger = get_task_logger(__name__)
@@ -59,17 +60,6 @@ def unlock_folder_task(context: dict, folder_id: str, change_type: str):
         traceback.print_exc()
         send_message(message=str(e), args=None, finished=True, context=context, isError=True)
 
-@app.task(expires=2)
-def prefetch_next_fragments(fragment_id: str, number_to_prefetch: int):
-    fragment = Fragment.objects.get(id=fragment_id)
-    fragments = Fragment.objects.filter(file=fragment.file)
-
-    filtered_fragments = fragments.filter(sequence__gt=fragment.sequence).order_by('sequence')[:number_to_prefetch]
-
-    for fragment in filtered_fragments:
-        discord.get_attachment_url(user=fragment.file.owner, resource=fragment)
-
-
 def format_shutter(speed: float | None) -> str:
     if speed is None:
         return ""
@@ -103,10 +93,11 @@ def _extract_raw_metadata(other, lens) -> dict:
 
 def _download_and_decrypt_fragments(file_obj):
     raw_buffer = BytesIO()
-    fragments = file_obj.fragments.all().order_by("sequence")
+    fragments = list(file_obj.fragments.all().select_related("channel").order_by("sequence"))
     decryptor = Decryptor(method=file_obj.get_encryption_method(), key=file_obj.key, iv=file_obj.iv)
+    urls = discord.get_attachment_urls(file_obj.owner, fragments, priority=DiscordRequestPriority.LOW)
     for frag in fragments:
-        url = discord.get_attachment_url(file_obj.owner, frag)
+        url = urls[frag.attachment_id]
         r = requests.get(url, timeout=30)
         r.raise_for_status()
         raw_buffer.write(decryptor.decrypt(r.content))
@@ -371,3 +362,16 @@ def generate_raw_image_thumbnails():
 
     if len(files) > 0:
         generate_raw_image_thumbnails.delay()
+
+
+@app.task(expires=60 * 60)
+def reconcile_folder_aggregates():
+    """Rebuilds FolderAggregate of every user, fixing whatever incremental updates got wrong (imports, crashes, races)"""
+    for user in User.objects.all():
+        try:
+            fixed = folder_aggregate_service.rebuild_for_user(user)
+            if fixed:
+                logger.warning(f"Fixed {fixed} drifted folder aggregate rows of user {user.id}")
+
+        except Exception as e:
+            logger.exception(f"Failed to reconcile folder aggregates of user {user.id}: {e}")
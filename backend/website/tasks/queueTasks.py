@@ -1,7 +1,37 @@
+import asyncio
+import logging
+
 from asgiref.sync import async_to_sync
 from celery import shared_task
 from channels.layers import get_channel_layer
 
+logger = logging.getLogger("Websockets")
+
+
+async def send_in_group_order(channel_layer, ws_events: list) -> list[Exception]:
+    """
+    group_sends (group, event) pairs. Events of one group go out one after another in the given order,
+    a group_send is several redis round trips and sent together they could overtake each other.
+    Different groups are sent concurrently.
+
+    :return: exceptions of the sends that failed
+    """
+    events_by_group = {}
+    for group, event in ws_events:
+        events_by_group.setdefault(group, []).append(event)
+
+    async def send_group(group: str, events: list) -> list[Exception]:
+        errors = []
+        for event in events:
+            try:
+                await channel_layer.group_send(group, event)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    results = await asyncio.gather(*(send_group(group, events) for group, events in events_by_group.items()))
+    return [error for errors in results for error in errors]
+
 
 # thanks to this genius - https://github.com/django/channels/issues/1799#issuecomment-1219970560
 @shared_task(name='queue_ws_event', ignore_result=True, queue='wsQ', expires=60)
@@ -11,3 +41,12 @@ def queue_ws_event(ws_channel, ws_event: dict, group=True):
         async_to_sync(channel_layer.group_send)(ws_channel, ws_event)
     else:
         async_to_sync(channel_layer.send)(ws_channel, ws_event)
+
+
+@shared_task(name='queue_ws_events', ignore_result=True, queue='wsQ', expires=60)
+def queue_ws_events(ws_events: list):
+    """Many group events in one task, eventlet workers hand over what they collected in a window with it"""
+    errors = async_to_sync(send_in_group_order)(get_channel_layer(), ws_events)
+
+    for error in errors:
+        logger.warning(f"Failed to publish websocket event: {error}")
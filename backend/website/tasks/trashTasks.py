@@ -6,7 +6,8 @@ from website.core.Serializers import FolderSerializer
 from website.core.dataModels.http import RequestContext
 from website.models import File, Folder
 from website.services import file_service, folder_service
-from website.websockets.utils import group_and_send_event, send_event, send_message
+from website.websockets.FolderEventBatch import FolderEventBatch
+from website.websockets.utils import send_message
 
 
 @app.task
@@ -17,19 +18,20 @@ def move_to_trash_task(context: dict, ids: list[str]):
         files = File.objects.filter(id__in=ids).select_related("parent")
         folders = Folder.objects.filter(id__in=ids).select_related("parent")
 
-        file_service.internal_move_to_trash(files)
-        group_and_send_event(context, EventCode.ITEM_MOVE_TO_TRASH, list(files))
+        with FolderEventBatch(context) as events:
+            file_service.internal_move_to_trash(files)
+            events.add_resources(EventCode.ITEM_MOVE_TO_TRASH, list(files))
 
-        total_length = len(folders)
-        last_percentage = 0
-        for index, folder in enumerate(folders):
-            folder_dict = FolderSerializer.serialize_object(folder)
-            folder_service.internal_move_to_trash(folder=folder)
-            send_event(context, folder.parent, EventCode.ITEM_MOVE_TO_TRASH, folder_dict)
-            percentage = round((index + 1) / total_length * 100)
-            if percentage != last_percentage:
-                send_message(message="toasts.itemsAreBeingMovedToTrash", args={"percentage": percentage}, finished=False, context=context)
-                last_percentage = percentage
+            total_length = len(folders)
+            last_percentage = 0
+            for index, folder in enumerate(folders):
+                folder_dict = FolderSerializer.serialize_object(folder)
+                folder_service.internal_move_to_trash(folder=folder)
+                events.add(folder.parent, EventCode.ITEM_MOVE_TO_TRASH, [folder_dict])
+                percentage = round((index + 1) / total_length * 100)
+                if percentage != last_percentage:
+                    send_message(message="toasts.itemsAreBeingMovedToTrash", args={"percentage": percentage}, finished=False, context=context)
+                    last_percentage = percentage
 
         send_message(message="toasts.itemsMovedToTrash", args=None, finished=True, context=context)
     except Exception as e:
@@ -44,20 +46,21 @@ def restore_from_trash_task(context: dict, ids: list[str]):
         files = File.objects.filter(id__in=ids).select_related("parent")
         folders = Folder.objects.filter(id__in=ids).select_related("parent")
 
-        file_service.internal_restore_from_trash(files)
+        with FolderEventBatch(context) as events:
+            file_service.internal_restore_from_trash(files)
 
-        group_and_send_event(context, EventCode.ITEM_RESTORE_FROM_TRASH, list(files))
+            events.add_resources(EventCode.ITEM_RESTORE_FROM_TRASH, list(files))
 
-        total_length = len(folders)
-        last_percentage = 0
-        for index, folder in enumerate(folders):
-            folder_dict = FolderSerializer.serialize_object(folder)
-            folder_service.internal_restore_from_trash(folder=folder)
-            send_event(context, folder.parent, EventCode.ITEM_RESTORE_FROM_TRASH, folder_dict)
-            percentage = round((index + 1) / total_length * 100)
-            if percentage != last_percentage:
-                send_message(message="toasts.itemsAreBeingRestoredFromTrash", args={"percentage": percentage}, finished=False, context=context)
-                last_percentage = percentage
+            total_length = len(folders)
+            last_percentage = 0
+            for index, folder in enumerate(folders):
+                folder_dict = FolderSerializer.serialize_object(folder)
+                folder_service.internal_restore_from_trash(folder=folder)
+                events.add(folder.parent, EventCode.ITEM_RESTORE_FROM_TRASH, [folder_dict])
+                percentage = round((index + 1) / total_length * 100)
+                if percentage != last_percentage:
+                    send_message(message="toasts.itemsAreBeingRestoredFromTrash", args={"percentage": percentage}, finished=False, context=context)
+                    last_percentage = percentage
 
         send_message(message="toasts.itemsRestoredFromTrash", args=None, finished=True, context=context)
     except Exception as e:
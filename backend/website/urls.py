@@ -8,7 +8,7 @@ from django.views.static import serve
 
 from .views.authViews import login_per_device_view, logout_per_device_view, register_user_view, get_qr_session_view, authenticate_qr_session_view, get_qr_session_device_info_view, \
     cancel_pending_qr_session_view, change_password_view, healthcheck_view, list_active_devices_view, logout_all_devices_view, revoke_device_view
-from .views.dataViews import get_folder_info, get_file_info, get_usage, search, \
+from .views.dataViews import get_folder_info, get_folder_children_view, get_files_signed_urls_view, get_file_info, get_usage, search, \
     get_trash, check_password, fetch_additional_info, get_moments, get_tags, get_subtitles, get_fragment_url_view, get_folder_file_stats, get_folder_hash, get_all_tags, \
     ultra_download_files_metadata, ultra_download_file_fragments_metadata, get_files_media_position
 from .views.itemManagmentViews import rename_view, move_items_to_trash_view, move_items_view, \
@@ -17,7 +17,8 @@ from .views.itemManagmentViews import rename_view, move_items_to_trash_view, mov
     add_moment_view, add_subtitle_view, remove_subtitle_view, rename_subtitle_view, create_zip_model_view, delete_thumbnail_view
 from .views.shareViews import get_shares, delete_share, create_share, view_share, create_share_zip_model, share_get_subtitles, check_share_password, get_share_visits, get_visit_events
 from .views.streamViews import serve_thumbnail, stream_file, stream_zip_files, serve_moment, serve_subtitle
-from .views.testViews import get_discord_state
+from .views.testViews import get_discord_state, get_stream_pool_stats_view, get_url_warmer_stats_view, get_fragment_cache_stats_view, get_ws_dispatcher_stats_view, \
+    get_discord_invalid_requests_stats_view
 from .views.uploadViews import create_file_view, create_or_edit_thumbnail_view, edit_file_view
 from .views.userViews import users_me, update_settings, get_discord_settings_view, create_channel_and_webhook_view, delete_webhook_view, add_bot_view, \
     delete_bot_view, update_attachment_name_view, can_upload, discord_settings_start_view, reset_discord_settings_view, \
@@ -69,6 +70,7 @@ urlpatterns = [
 
     path("files", ["POST"], create_file_view, name="create file"),
     path("files/media-positions", ["POST"], get_files_media_position, name="returns a media position for many files"),
+    path("files/signed-urls", ["POST"], get_files_signed_urls_view, name="returns signed urls of many files"),
     path("files/<file_id>", ["PATCH"], edit_file_view, name="edit file"),
     path("files/<file_id>", ["GET"], get_file_info, name="get file info"),
     path("files/<file_id>/thumbnail", ["POST"], create_or_edit_thumbnail_view, name="create or edit thumbnail"),
@@ -87,6 +89,7 @@ urlpatterns = [
 
     path("folders", ["POST"], create_folder_view, name="create folder"),
     path('folders/<folder_id>', ["GET"], get_folder_info, name="get files and folders from a folder id"),
+    path('folders/<folder_id>/children', ["GET"], get_folder_children_view, name="get a page of a folder's children"),
     path('folders/<folder_id>/usage', ["GET"], get_usage, name="get size of all files in that folder to all user's files"),
     path("folders/<folder_id>/password", ["POST"], change_folder_password_view, name="change folder password"),
     path("folders/<folder_id>/password/reset", ["POST"], reset_folder_password_view, name="reset folder's password"),
@@ -158,6 +161,11 @@ urlpatterns = [
 
     path('healthcheck/', ['GET'], healthcheck_view, name='check health of the backend server'),
 
+    django_path('test/stream-pool', get_stream_pool_stats_view),
+    django_path('test/url-warmer', get_url_warmer_stats_view),
+    django_path('test/fragment-cache', get_fragment_cache_stats_view),
+    django_path('test/ws-dispatcher', get_ws_dispatcher_stats_view),
+    django_path('test/discord-invalid-requests', get_discord_invalid_requests_stats_view),
     django_path('test/<user_id>', get_discord_state),
 
     re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
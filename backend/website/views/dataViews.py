@@ -1,37 +1,34 @@
 import base64
 import hashlib
+import itertools
 import json
 import time
 from typing import Optional
 
-from django.db.models import Count, Sum, Case, When, Value, CharField
-from django.db.models import F, BooleanField
-from django.db.models.query_utils import Q
-from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_headers
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from rest_framework.decorators import permission_classes, throttle_classes, api_view
 from rest_framework.permissions import IsAuthenticated
 
 from website.auth.Permissions import ReadPerms, default_checks, CheckTrash, CheckOwnership, CheckIpPrivateOrAllowedIfResourceLocked
 from website.auth.throttle import defaultAuthUserThrottle, SearchThrottle, FolderPasswordThrottle, MediaThrottle
 from website.auth.utils import check_resource_perms
-from website.constants import cache, SIGNED_URL_EXPIRY_SECONDS, API_BASE_URL, EncryptionMethod
+from website.constants import SIGNED_URL_EXPIRY_SECONDS, API_BASE_URL, EncryptionMethod, FOLDER_LISTING_PAGE_SIZE, FOLDER_LISTING_MAX_PAGE_SIZE, FOLDER_LISTING_STREAM_BATCH
 from website.core.Serializers import FileSerializer, VideoTrackSerializer, SubtitleTrackSerializer, AudioTrackSerializer, RawMetadataSerializer, PhotoMetadataSerializer, \
     FolderSerializer, \
     MomentSerializer, TagSerializer, MediaPositionSerializer, SubtitleSerializer
 from website.core.converters import param_to_bool
-from website.core.crypto.signer import sign_resource
+from website.core.crypto.signer import ResourceSigner
 from website.core.decorators import check_resource_permissions, extract_folder, extract_file, extract_item
 from website.core.errors import ResourceNotFoundError, ResourcePermissionError
 from website.core.helpers import validate_ids_as_list, extract_key, validate_key
+from website.core.validators.GeneralChecks import IsPositive, Max
 from website.discord.Discord import discord
 from website.models import Folder, File, Subtitle, Moment, Thumbnail, VideoTrack, VideoMetadata, SubtitleTrack, AudioTrack, Fragment
 from website.models.file_related_models import RawMetadata, PhotoMetadata, Tag, MediaPosition
 from website.models.mixin_models import ItemState
-from website.queries.builders import build_folder_content, build_breadcrumbs, calculate_size, calculate_file_and_folder_count, build_file_path
+from website.queries.builders import build_folder_content, build_folder_page, build_breadcrumbs, calculate_size, calculate_file_and_folder_count, build_file_path
 from website.queries.selectors import get_trash_files_and_folders, check_if_bots_exists
-from website.services import cache_service, search_service
+from website.services import cache_service, search_service, folder_aggregate_service, usage_service
 
 
 @api_view(['GET'])
@@ -40,61 +37,137 @@ from website.services import cache_service, search_service
 @extract_folder()
 @check_resource_permissions(default_checks, resource_key="folder_obj")
 def get_folder_info(request, folder_obj: Folder):
-    # todo optimize this
+    # signUrls=false leaves the urls unsigned, get_files_signed_urls_view signs the ones the client actually shows
+    sign_urls = validate_key(request.GET, "signUrls", bool, default=True, converter=param_to_bool)
+    etag_value = _get_folder_listing_etag(folder_obj, sign_urls)
+
+    # answered from folder versions alone, the listing itself isn't loaded for a 304
+    if _get_request_etag(request) == etag_value:
+        response = HttpResponseNotModified()
+        response["ETag"] = f'"{etag_value}"'
+        response["Cache-Control"] = "private, no-cache"
+
+        return response
+
     folder_content = cache_service.get_folder_content(folder_obj)
 
     if folder_content is None:
         folder_content = build_folder_content(folder_obj)
         cache_service.set_folder_content(folder_obj, folder_content)
 
-    folder_content = folder_content
     breadcrumbs = build_breadcrumbs(folder_obj)
 
-    unsigned_payload = {
+    _sign_listing_urls(folder_content["children"], sign_urls)
+
+    response_payload = {
         "folder": folder_content,
-        "breadcrumbs": breadcrumbs,
-        "_signature_epoch": int(time.time() // SIGNED_URL_EXPIRY_SECONDS)
+        "breadcrumbs": breadcrumbs
     }
 
-    unsigned_json = json.dumps(unsigned_payload, sort_keys=True)
+    response = HttpResponse(
+        json.dumps(response_payload),
+        content_type="application/json",
+        status=200
+    )
 
-    etag_value = hashlib.md5(unsigned_json.encode()).hexdigest()
+    response["ETag"] = f'"{etag_value}"'
+    response["Cache-Control"] = "private, no-cache"
 
+    return response
+
+
+def _sign_listing_urls(children: list[dict], sign_urls: bool) -> None:
+    """Signs the urls build_folder_content left unsigned in one batch, sharing one expiry"""
+    targets = []
+    for child in children:
+        for path_key, url_key in (("_download_path", "download_url"), ("_thumbnail_path", "thumbnail_url")):
+            path = child.pop(path_key, None)
+            if path:
+                targets.append((child, url_key, path))
+
+    if not sign_urls:
+        return
+
+    signatures = ResourceSigner().sign_many(path for _, _, path in targets)
+    for (child, url_key, path), signature in zip(targets, signatures):
+        child[url_key] = f"{API_BASE_URL}{path}{signature}"
+
+
+def _get_folder_listing_etag(folder_obj: Folder, sign_urls: bool) -> str:
+    """
+    ETag of a folder listing with breadcrumbs, from the signature epoch, sign_urls and the versions and locks
+    of the folder and its ancestors. Any of those changing changes the listing, nothing else does.
+    Breadcrumbs aren't hashed, they are built from the same ancestors and a rename or move bumps their version.
+    """
+    ancestors = folder_obj.get_ancestors(include_self=True).values_list("id", "version", "lockFrom_id")
+    stamp = ";".join(f"{folder_id}:{version}:{lock_from_id or ''}" for folder_id, version, lock_from_id in ancestors)
+    epoch = int(time.time() // SIGNED_URL_EXPIRY_SECONDS)
+
+    return hashlib.md5(f"{epoch}|{sign_urls}|{stamp}".encode()).hexdigest()
+
+
+def _get_request_etag(request) -> Optional[str]:
     request_etag = request.headers.get("If-None-Match")
     if request_etag:
         request_etag = request_etag.removeprefix('W/').strip('"')
 
-    if request_etag == etag_value:
-        response = HttpResponseNotModified()
-        response["ETag"] = f'"{etag_value}"'
-        response["Cache-Control"] = "private, no-cache"
+    return request_etag
 
-        return response
 
-    for file in folder_content["children"]:
-        download_path = file.get("_download_path")
-        thumbnail_path = file.get("_thumbnail_path")
+async def _stream_folder_page(folder_dict: dict, folders: list[Folder], files: list[tuple], next_cursor: Optional[str], sign_urls: bool):
+    yield f'{{"folder":{json.dumps(folder_dict)},"children":['
 
-        if thumbnail_path:
-            file["thumbnail_url"] = f"{API_BASE_URL}{thumbnail_path}{sign_resource(thumbnail_path)}"
+    signer = ResourceSigner()
 
-        if download_path:
-            file["download_url"] = f"{API_BASE_URL}{download_path}{sign_resource(download_path)}"
+    batch = []
+    for i, child in enumerate(itertools.chain(
+            (FolderSerializer.serialize_object(folder) for folder in folders),
+            (FileSerializer.serialize_tuple(file, sign_urls=sign_urls, signer=signer) for file in files),
+    )):
+        batch.append(("," if i else "") + json.dumps(child))
 
-        file.pop("_download_path", None)
-        file.pop("_thumbnail_path", None)
+        if len(batch) >= FOLDER_LISTING_STREAM_BATCH:
+            yield "".join(batch)
+            batch = []
 
-    response_payload = {
-        "folder": folder_content,
-        "breadcrumbs": breadcrumbs
-    }
+    batch.append(f'],"nextCursor":{json.dumps(next_cursor)}}}')
+    yield "".join(batch)
 
-    response = HttpResponse(
-        json.dumps(response_payload),
+
+@api_view(['GET'])
+@throttle_classes([defaultAuthUserThrottle])
+@permission_classes([IsAuthenticated & ReadPerms])
+@extract_folder()
+@check_resource_permissions(default_checks, resource_key="folder_obj")
+def get_folder_children_view(request, folder_obj: Folder):
+    """
+    A page of the folder's children, subfolders first, ordered by name, created or size.
+    Pass `nextCursor` of a page as `cursor` to get the next one, it's null on the last page.
+    """
+    order = validate_key(request.GET, "order", str, default="name")
+    descending = validate_key(request.GET, "desc", bool, default=False, converter=param_to_bool)
+    cursor = validate_key(request.GET, "cursor", str, default=None)
+    limit = validate_key(request.GET, "limit", int, default=FOLDER_LISTING_PAGE_SIZE, converter=int, checks=[IsPositive, Max(FOLDER_LISTING_MAX_PAGE_SIZE)])
+    sign_urls = validate_key(request.GET, "signUrls", bool, default=True, converter=param_to_bool)
+
+    # the page only changes when the folder's listing does (touch_service bumps its version) or its urls get re-signed
+    version = cache_service.get_folder_content_version(folder_obj)
+    epoch = int(time.time() // SIGNED_URL_EXPIRY_SECONDS)
+    etag_value = hashlib.md5(f"{folder_obj.id}:{version}:{epoch}:{order}:{descending}:{cursor}:{limit}:{sign_urls}".encode()).hexdigest()
+
+    if _get_request_etag(request) == etag_value:
+        response = HttpResponseNotModified()
+        response["ETag"] = f'"{etag_value}"'
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    folders, files, next_cursor = build_folder_page(folder_obj, order, descending, cursor, limit)
+
+    response = StreamingHttpResponse(
+        _stream_folder_page(FolderSerializer.serialize_object(folder_obj), folders, files, next_cursor, sign_urls),
         content_type="application/json",
         status=200
     )
-
     response["ETag"] = f'"{etag_value}"'
     response["Cache-Control"] = "private, no-cache"
 
@@ -116,21 +189,8 @@ def get_file_info(request, file_obj: File):
 @permission_classes([IsAuthenticated & ReadPerms])
 @extract_folder()
 @check_resource_permissions(default_checks, resource_key="folder_obj")
-@vary_on_headers("x-resource-password")
-@cache_page(60 * 1)
 def get_usage(request, folder_obj: Folder):
-    key = cache_service.get_total_used_size_key(request.user.id)
-    total_used_size = cache.get(key)
-    if not total_used_size:
-        file_used = File.objects.filter(owner=request.user, inTrash=False, state=ItemState.ACTIVE, parent__inTrash=False).aggregate(Sum('size'))['size__sum'] or 0
-        thumbnail_used = Thumbnail.objects.filter(file__owner=request.user, file__state=ItemState.ACTIVE, file__parent__inTrash=False, file__inTrash=False).aggregate(Sum('size'))[
-                             'size__sum'] or 0
-        moment_used = Moment.objects.filter(file__owner=request.user, file__state=ItemState.ACTIVE, file__parent__inTrash=False, file__inTrash=False).aggregate(Sum('size'))['size__sum'] or 0
-        subtitle_used = Subtitle.objects.filter(file__owner=request.user, file__state=ItemState.ACTIVE, file__parent__inTrash=False, file__inTrash=False).aggregate(Sum('size'))[
-                            'size__sum'] or 0
-
-        total_used_size = file_used + thumbnail_used + moment_used + subtitle_used
-        cache.set(key, total_used_size, 60)
+    total_used_size = usage_service.get_used(request.user)
 
     if folder_obj.parent:
         folder_used_size = calculate_size(folder_obj)
@@ -210,7 +270,8 @@ def search(request):
 def get_trash(request):
     files, folders = get_trash_files_and_folders(request.user)
 
-    file_dicts = [FileSerializer.serialize_tuple(file) for file in files]
+    signer = ResourceSigner()
+    file_dicts = [FileSerializer.serialize_tuple(file, signer=signer) for file in files]
     folder_dicts = [FolderSerializer.serialize_object(folder) for folder in folders]
 
     return JsonResponse({"trash": file_dicts + folder_dicts})
@@ -284,6 +345,36 @@ def get_files_media_position(request):
     return JsonResponse(MediaPositionSerializer.serialize_objects(media_positions), safe=False)
 
 
+@api_view(["POST"])
+@throttle_classes([defaultAuthUserThrottle])
+@permission_classes([IsAuthenticated & ReadPerms])
+def get_files_signed_urls_view(request):
+    """Signed download and thumbnail urls of many files at once, for listings fetched with signUrls=false"""
+    ids = extract_key(request.data, "ids")
+    validate_ids_as_list(ids, max_length=1000)
+
+    files = File.objects.filter(id__in=ids).select_related("parent")
+    file_ids = []
+    for file in files:
+        check_resource_perms(request=request, resource=file, checks=default_checks)
+        file_ids.append(file.id)
+
+    thumbnail_ids = dict(Thumbnail.objects.filter(file_id__in=file_ids).values_list("file_id", "id"))
+
+    targets = []
+    for file_id in file_ids:
+        targets.append((file_id, "download_url", f"/files/{file_id}/stream"))
+        if file_id in thumbnail_ids:
+            targets.append((file_id, "thumbnail_url", f"/files/{file_id}/thumbnail/{thumbnail_ids[file_id]}/stream"))
+
+    urls = {file_id: {} for file_id in file_ids}
+    signatures = ResourceSigner().sign_many(path for _, _, path in targets)
+    for (file_id, url_key, path), signature in zip(targets, signatures):
+        urls[file_id][url_key] = f"{API_BASE_URL}{path}{signature}"
+
+    return JsonResponse(urls)
+
+
 @api_view(["GET"])
 @throttle_classes([defaultAuthUserThrottle])
 @permission_classes([IsAuthenticated & ReadPerms])
@@ -379,12 +470,12 @@ def ultra_download_file_fragments_metadata(request, file_obj, folder_obj: Option
 @permission_classes([IsAuthenticated & ReadPerms])
 def get_fragment_url_view(request, fragment_id):
     check_if_bots_exists(request.user)
-    fragment = Fragment.objects.get(id=fragment_id)
+    fragment = Fragment.objects.select_related("file", "channel").get(id=fragment_id)
 
     file = fragment.file
     check_resource_perms(request, file, default_checks)
 
-    url = discord.get_attachment_url(request.user, fragment)
+    url = discord.get_attachment_urls(request.user, [fragment])[fragment.attachment_id]
     return JsonResponse({"url": url})
 
 
@@ -393,41 +484,8 @@ def get_fragment_url_view(request, fragment_id):
 @permission_classes([IsAuthenticated & ReadPerms])
 @extract_folder()
 @check_resource_permissions(default_checks, resource_key="folder_obj")
-@cache_page(60 * 1)
 def get_folder_file_stats(request, folder_obj):
-    files_qs = folder_obj.get_all_files().filter(owner=request.user, inTrash=False, parent__inTrash=False)
-
-    # Annotate lock-related fields
-    files_qs = files_qs.annotate(
-        is_locked=Case(
-            When(parent__password__isnull=False, then=Value(True)),
-            default=Value(False),
-            output_field=BooleanField()
-        ),
-        lockFrom_id=F("parent__lockFrom__id")
-    )
-
-    # Annotate type: 'hidden' properly
-    qs = (
-        files_qs
-        .annotate(file_type=Case(
-            When(Q(is_locked=True) & ~Q(lockFrom_id=folder_obj.id), then=Value('hidden')),
-            default=F('type'),
-            output_field=CharField()
-        ))
-        .values('file_type')
-        .annotate(count=Count('id'), total_size=Sum('size'))
-        .order_by('file_type')
-    )
-
-    result = {
-        row['file_type']: {
-            "count": None if row['file_type'] == "hidden" else row['count'],
-            "total_size": row['total_size']
-        }
-        for row in qs
-    }
-
+    result = folder_aggregate_service.get_file_stats(folder_obj)
     return JsonResponse(result, safe=False)
 
 
@@ -8,7 +8,12 @@ from rest_framework.permissions import AllowAny
 from website.auth.Permissions import AllowedIP
 from website.auth.throttle import defaultAuthUserThrottle
 from website.core.helpers import get_ip
+from website.core.media.stream.CDNSessionPool import cdn_pool
+from website.core.media.stream.FragmentDiskCache import fragment_cache
+from website.discord.AttachmentUrlWarmer import url_warmer
 from website.discord.Discord import discord
+from website.discord.InvalidRequestGuard import invalid_request_guard
+from website.websockets.EventDispatcher import ws_dispatcher
 
 
 @api_view(['GET'])
@@ -25,9 +30,71 @@ def get_discord_state(request, user_id):
     return JsonResponse(state.to_dict(), safe=False)
 
 
+@api_view(['GET'])
+@throttle_classes([defaultAuthUserThrottle])
+@permission_classes([AllowAny & AllowedIP])
+def get_stream_pool_stats_view(request):
+    ip, _ = get_ip(request)
+    ip_obj = ipaddress.ip_address(ip)
+    if not ip_obj.is_private:
+        return HttpResponse(status=404)
+
+    # stats are per worker process, each gunicorn worker owns its own pool
+    return JsonResponse(cdn_pool.stats())
+
+
 @api_view(['GET'])
 @throttle_classes([defaultAuthUserThrottle])
 @permission_classes([AllowAny & AllowedIP])
 def your_ip(request):
     ip, from_nginx = get_ip(request)
     return JsonResponse({"ip": ip, "nginx": from_nginx})
+
+
+@api_view(['GET'])
+@throttle_classes([defaultAuthUserThrottle])
+@permission_classes([AllowAny & AllowedIP])
+def get_url_warmer_stats_view(request):
+    ip, _ = get_ip(request)
+    ip_obj = ipaddress.ip_address(ip)
+    if not ip_obj.is_private:
+        return HttpResponse(status=404)
+
+    return JsonResponse(url_warmer.stats())
+
+
+@api_view(['GET'])
+@throttle_classes([defaultAuthUserThrottle])
+@permission_classes([AllowAny & AllowedIP])
+def get_fragment_cache_stats_view(request):
+    ip, _ = get_ip(request)
+    ip_obj = ipaddress.ip_address(ip)
+    if not ip_obj.is_private:
+        return HttpResponse(status=404)
+
+    return JsonResponse(fragment_cache.stats())
+
+
+@api_view(['GET'])
+@throttle_classes([defaultAuthUserThrottle])
+@permission_classes([AllowAny & AllowedIP])
+def get_ws_dispatcher_stats_view(request):
+    ip, _ = get_ip(request)
+    ip_obj = ipaddress.ip_address(ip)
+    if not ip_obj.is_private:
+        return HttpResponse(status=404)
+
+    # per worker process, every process publishing events owns its own dispatcher
+    return JsonResponse(ws_dispatcher.stats())
+
+
+@api_view(['GET'])
+@throttle_classes([defaultAuthUserThrottle])
+@permission_classes([AllowAny & AllowedIP])
+def get_discord_invalid_requests_stats_view(request):
+    ip, _ = get_ip(request)
+    ip_obj = ipaddress.ip_address(ip)
+    if not ip_obj.is_private:
+        return HttpResponse(status=404)
+
+    return JsonResponse(invalid_request_guard.stats())
@@ -1,18 +1,26 @@
+import asyncio
 import json
-import threading
 import time
 import traceback
 import uuid
 from abc import abstractmethod, ABC
-from datetime import timedelta
+from typing import Optional
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
-from django.core.cache import cache
-from django.utils import timezone
+from channels.generic.websocket import AsyncWebsocketConsumer
+from redis.asyncio import Redis
 
+from website.constants import cache
+from website.core import ratelimit
+from website.core.aioredis import get_async_redis_connection
 
-class RateLimitedWebsocketConsumer(WebsocketConsumer, ABC):
+
+class RateLimitedWebsocketConsumer(AsyncWebsocketConsumer, ABC):
+    """
+    Runs entirely on the worker's event loop, a connection costs a few objects and one timer, no threads.
+
+    The heartbeat and the periodic re-authorization share a single loop timer per connection,
+    rate limits (core.ratelimit) and the active connection registry are redis calls awaited on the loop.
+    """
     max_connections_per_client = 5
     connection_limit = 15        # how many new connections allowed
     connection_window = 30      # seconds
@@ -28,144 +36,136 @@ class RateLimitedWebsocketConsumer(WebsocketConsumer, ABC):
 
     def __init__(self):
         super().__init__()
-        self.last_pong = time.time()
-        self._heartbeat_thread = None
-        self._heartbeat_running = None
+        self.last_pong = time.monotonic()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._reauthorize_task: Optional[asyncio.Task] = None
         self._connection_id = str(uuid.uuid4())
         self._last_authorized_at = 0
+        self._groups = []
 
     @abstractmethod
-    def authorize(self) -> tuple[bool, bool, str]:
+    async def authorize(self) -> tuple[bool, bool, str]:
         raise NotImplementedError()
 
     @abstractmethod
     def get_group_name(self) -> str:
         raise NotImplementedError()
 
-    def on_ratelimit(self):
+    def get_group_names(self) -> list[str]:
+        """Groups this connection joins once authorized. Override to join more than one."""
+        return [self.get_group_name()]
+
+    async def on_ratelimit(self):
         pass
 
-    def on_exception(self, exception: Exception):
+    async def on_exception(self, exception: Exception):
         pass
 
-    def on_message(self, text_data, bytes_data):
+    async def on_message(self, text_data, bytes_data):
         pass
 
-    def on_disconnect(self, close_code):
+    async def on_disconnect(self, close_code):
         pass
 
-    def on_accept(self):
+    async def on_accept(self):
         pass
 
-    def get_cache(self):
-        return cache
+    def get_redis(self) -> Redis:
+        return get_async_redis_connection()
 
     def get_rate_limit_id(self) -> str:
         return self.scope["client"][0]
 
-    def _check_rate_limit(self, key_prefix, limit, window_seconds):
-        cache = self.get_cache()
+    async def _check_rate_limit(self, key_prefix, limit, window_seconds) -> bool:
         ident = self.get_rate_limit_id()
-        key = f"ws-{key_prefix}-{ident}"
-
-        entry = cache.get(key, {"count": 0, "timestamp": timezone.now()})
-        now = timezone.now()
-
-        # reset window if expired
-        if now - entry["timestamp"] > timedelta(seconds=window_seconds):
-            entry = {"count": 0, "timestamp": now}
-
-        entry["count"] += 1
-        cache.set(key, entry, window_seconds)
+        result = await ratelimit.ahit(f"ws-{key_prefix}-{ident}", limit, window_seconds)
+        return result.allowed
 
-        return entry["count"] <= limit
-
-    def _reauthorize_if_needed(self) -> bool:
+    async def _reauthorize_if_needed(self) -> bool:
         if not self.re_authorize_every_n_seconds:
             return True
 
-        now = time.time()
+        now = time.monotonic()
 
         if now - self._last_authorized_at < self.re_authorize_every_n_seconds:
             return True
 
-        authorized, _, _ = self.authorize()
+        authorized, _, _ = await self.authorize()
         self._last_authorized_at = now
 
         return authorized
 
-    def reject(self, code, reason):
-        self.close(code)
-        return
+    async def reject(self, code, reason):
+        await self.close(code)
 
-    def connect(self):
-        if not self._check_rate_limit("connect", self.connection_limit, self.connection_window):
-            self.reject(code=4408, reason="Too many connection attempts")
+    async def connect(self):
+        if not await self._check_rate_limit("connect", self.connection_limit, self.connection_window):
+            await self.reject(code=4408, reason="Too many connection attempts")
             return
 
-        if self._count_connections() > self.max_connections_per_client:
-            self.reject(code=4409, reason="Too many active connections")
+        if await self._count_connections() > self.max_connections_per_client:
+            await self.reject(code=4409, reason="Too many active connections")
             return
 
-        authorized, is_standard_protocol, token = self.authorize()
-        self._last_authorized_at = time.time()
+        authorized, is_standard_protocol, token = await self.authorize()
+        self._last_authorized_at = time.monotonic()
 
         if not authorized:
-            self.reject(code=4401, reason="Unauthorized")
+            await self.reject(code=4401, reason="Unauthorized")
             return
 
         if is_standard_protocol:
-            self.accept()
+            await self.accept()
         else:
-            self.accept(token)
+            await self.accept(token)
 
-        self._register_connection()
+        await self._register_connection()
 
-        if self.ping_heartbeat:
-            self.last_pong = time.time()
-            self._heartbeat_running = True
-            self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
-            self._heartbeat_thread.start()
+        self.last_pong = time.monotonic()
+        self._schedule_tick()
 
-        async_to_sync(self.channel_layer.group_add)(self.get_group_name(), self.channel_name)
+        self._groups = self.get_group_names()
+        for group in self._groups:
+            await self.channel_layer.group_add(group, self.channel_name)
 
-        self.on_accept()
+        await self.on_accept()
 
-    def disconnect(self, close_code):
-        self._heartbeat_running = False
-        async_to_sync(self.channel_layer.group_discard)(self.get_group_name(), self.channel_name)
-        self._unregister_connection()
-        self.on_disconnect(close_code)
+    async def disconnect(self, close_code):
+        self._cancel_timers()
+        for group in self._groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        await self._unregister_connection()
+        await self.on_disconnect(close_code)
 
-    def receive(self, text_data=None, bytes_data=None):
+    async def receive(self, text_data=None, bytes_data=None):
         """DO NOT OVERRIDE THIS FUNCTION TO HANDLE MESSAGES.
         USE on_message() INSTEAD!"""
 
         # 0) Re-authorize periodically
-        if not self._reauthorize_if_needed():
-            self.close(code=4401)
+        if not await self._reauthorize_if_needed():
+            await self.close(code=4401)
             return
 
         # 1) Rate-limit per-message
-        if not self._check_rate_limit("msg", self.message_limit, self.message_window):
-            self.on_ratelimit()
+        if not await self._check_rate_limit("msg", self.message_limit, self.message_window):
+            await self.on_ratelimit()
             return
 
         # 2) Handle heartbeat/application pong
         if self.ping_heartbeat and text_data == "PONG":
-            self._refresh_connection()
-            self.last_pong = time.time()
+            self.last_pong = time.monotonic()
+            await self._register_connection()
             return
 
         # 3) Pass to subclass handler
         try:
-            self.on_message(text_data, bytes_data)
+            await self.on_message(text_data, bytes_data)
         except Exception as e:
             traceback.print_exc()
-            self.on_exception(e)
+            await self.on_exception(e)
 
-    def send_json(self, data: dict):
-        self.send(json.dumps(data))
+    async def send_json(self, data: dict):
+        await self.send(json.dumps(data))
 
     def get_token_key(self) -> tuple[str, bool]:
         headers = dict(self.scope.get("headers", []))
@@ -193,52 +193,81 @@ class RateLimitedWebsocketConsumer(WebsocketConsumer, ABC):
 
         return token_key, is_standard_protocol
 
-    def _heartbeat_loop(self):
-        while self._heartbeat_running:
-            time.sleep(self.ping_interval)
+    # ------------------------------------------------------------------
+    # Heartbeat & periodic re-authorization, one loop timer per connection
+    # ------------------------------------------------------------------
 
-            async_to_sync(self.channel_layer.send)(self.channel_name, {"type": "heartbeat_ping"})
+    def _schedule_tick(self) -> None:
+        if not self.ping_heartbeat and not self.re_authorize_every_n_seconds:
+            return
 
-            if time.time() - self.last_pong > self.ping_interval + self.ping_timeout:
-                async_to_sync(self.channel_layer.send)(self.channel_name, {"type": "heartbeat_close"})
-                break
+        interval = self.ping_interval if self.ping_heartbeat else self.re_authorize_every_n_seconds
+        self._timer = asyncio.get_running_loop().call_later(interval, self._tick)
 
-    def heartbeat_ping(self, event):
-        self.send("PING")
+    def _tick(self) -> None:
+        self._timer = None
 
-    def heartbeat_close(self, event):
-        self._heartbeat_running = False
-        self.close()
+        if self.ping_heartbeat:
+            if time.monotonic() - self.last_pong > self.ping_interval + self.ping_timeout:
+                asyncio.ensure_future(self.close())
+                return
 
-    def _count_connections(self) -> int:
-        ident = self.get_rate_limit_id()
-        cache = self.get_cache()
-        pattern = f"ws-active:{ident}:*"
+            asyncio.ensure_future(self.send("PING"))
 
-        keys = cache.keys(pattern)
-        return len(keys)
+        if self.re_authorize_every_n_seconds and self._reauthorize_task is None:
+            if time.monotonic() - self._last_authorized_at >= self.re_authorize_every_n_seconds:
+                self._reauthorize_task = asyncio.ensure_future(self._periodic_reauthorize())
 
-    def _register_connection(self) -> None:
-        cache = self.get_cache()
-        ident = self.get_rate_limit_id()
+        self._schedule_tick()
 
-        ttl = self.ping_interval + self.ping_timeout
+    async def _periodic_reauthorize(self) -> None:
+        try:
+            if not await self._reauthorize_if_needed():
+                await self.close(code=4401)
+        except Exception as e:
+            traceback.print_exc()
+            await self.on_exception(e)
+        finally:
+            self._reauthorize_task = None
 
-        key = f"ws-active:{ident}:{self._connection_id}"
-        cache.set(key, 1, timeout=ttl)
+    def _cancel_timers(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
 
-    def _refresh_connection(self) -> None:
-        cache = self.get_cache()
-        ident = self.get_rate_limit_id()
+        if self._reauthorize_task:
+            self._reauthorize_task.cancel()
+            self._reauthorize_task = None
 
-        ttl = self.ping_interval + self.ping_timeout
+    # ------------------------------------------------------------------
+    # Active connections, a sorted set of connection ids scored by expiry per client
+    # ------------------------------------------------------------------
 
-        key = f"ws-active:{ident}:{self._connection_id}"
-        cache.set(key, 1, timeout=ttl)
+    def _get_active_key(self) -> str:
+        return cache.make_key(f"ws-active:{self.get_rate_limit_id()}")
 
-    def _unregister_connection(self) -> None:
-        cache = self.get_cache()
-        ident = self.get_rate_limit_id()
+    def _get_connection_ttl(self) -> int:
+        return self.ping_interval + self.ping_timeout
+
+    async def _count_connections(self) -> int:
+        key = self._get_active_key()
+
+        async with self.get_redis().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.zcard(key)
+            _, count = await pipe.execute()
+
+        return count
+
+    async def _register_connection(self) -> None:
+        """Also refreshes the connection, connections that stop answering pings expire on their own"""
+        key = self._get_active_key()
+        ttl = self._get_connection_ttl()
+
+        async with self.get_redis().pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {self._connection_id: time.time() + ttl})
+            pipe.expire(key, ttl)
+            await pipe.execute()
 
-        key = f"ws-active:{ident}:{self._connection_id}"
-        cache.delete(key)
+    async def _unregister_connection(self) -> None:
+        await self.get_redis().zrem(self._get_active_key(), self._connection_id)
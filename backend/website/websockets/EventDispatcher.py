@@ -0,0 +1,226 @@
+import asyncio
+import atexit
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Hashable
+
+from channels.layers import get_channel_layer
+from django.core.serializers.json import DjangoJSONEncoder
+
+from website.constants import WS_DISPATCH_QUEUE_SIZE, WS_DISPATCH_BATCH_SIZE, WS_GREEN_DISPATCH_WINDOW
+from website.tasks.queueTasks import queue_ws_events, send_in_group_order
+
+logger = logging.getLogger("Websockets")
+
+
+def _is_green_process() -> bool:
+    """eventlet celery workers replace threads with green threads, an asyncio loop can't live in one of those"""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched("thread")
+
+
+class _WireEncoder(DjangoJSONEncoder):
+    """Same objects the celery json serializer accepted (RequestContext has __json__)"""
+
+    def default(self, o):
+        if hasattr(o, "__json__"):
+            return o.__json__()
+        return super().default(o)
+
+
+class WebsocketEventDispatcher:
+    """
+    Publishes websocket events straight to the channel layer, instead of a celery task per event.
+
+    - events go through a bounded in-memory queue, when it's full the oldest event is dropped
+    - events with a coalesce key (progress messages of one task) replace the queued event with the same key
+      and move to the end of the queue, so only the latest one is sent and never ahead of events queued before it
+    - a background thread with its own event loop drains the queue in batches. Events of one group
+      are sent in queue order, different groups of a batch are in flight together
+
+    Processes running under eventlet (the default celery worker) can't host an asyncio loop. There a green thread
+    collects events for WS_GREEN_DISPATCH_WINDOW, coalesced the same way, and hands them to the wsQ worker
+    in one `queue_ws_events` task per window instead of a task per event.
+    """
+
+    def __init__(self, max_size: int = WS_DISPATCH_QUEUE_SIZE, batch_size: int = WS_DISPATCH_BATCH_SIZE, green_window: float = WS_GREEN_DISPATCH_WINDOW):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.green_window = green_window
+
+        # queue order, oldest first. Keys are event ids or (group, coalesce key)
+        self._events: OrderedDict[Hashable, tuple[str, dict]] = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+        self._pid: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._green = False
+        self._green_wakeup: Optional[threading.Event] = None
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    # ------------------------------------------------------------------
+    # Background loop
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+
+            # forked children inherit the queue but not the thread
+            self._events.clear()
+
+            # under eventlet threading is monkey patched, this thread is a green one
+            self._green = _is_green_process()
+            target = self._run_green if self._green else self._run
+
+            started = threading.Event()
+            self._thread = threading.Thread(target=target, args=(started,), name="ws-event-dispatcher", daemon=True)
+            self._thread.start()
+            started.wait()
+            self._pid = os.getpid()
+
+    def _run(self, started: threading.Event) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        started.set()
+
+        self._loop.run_until_complete(self._drain_forever())
+
+    def _run_green(self, started: threading.Event) -> None:
+        self._green_wakeup = threading.Event()
+        started.set()
+
+        while True:
+            self._green_wakeup.wait()
+            # let the window fill up (and progress messages coalesce) before handing it over
+            time.sleep(self.green_window)
+            self._green_wakeup.clear()
+            self._hand_over()
+
+    def _hand_over(self) -> None:
+        """Sends everything queued to the wsQ worker as one task"""
+        batch = self._take_batch(len(self._events))
+        if not batch:
+            return
+
+        try:
+            queue_ws_events.delay(batch)
+            self.sent += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"Failed to hand websocket events over to celery: {e}")
+
+    async def _drain_forever(self) -> None:
+        channel_layer = get_channel_layer()
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self._drain(channel_layer)
+
+    async def _drain(self, channel_layer) -> None:
+        while True:
+            batch = self._take_batch(self.batch_size)
+            if not batch:
+                return
+
+            errors = await send_in_group_order(channel_layer, batch)
+
+            self.sent += len(batch) - len(errors)
+            self.failed += len(errors)
+            for error in errors:
+                logger.warning(f"Failed to publish websocket event: {error}")
+
+    def _take_batch(self, size: int) -> list[tuple[str, dict]]:
+        with self._lock:
+            batch = []
+            while self._events and len(batch) < size:
+                batch.append(self._events.popitem(last=False)[1])
+            return batch
+
+    def _notify(self) -> None:
+        if self._green:
+            self._green_wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def publish(self, group: str, event: dict, coalesce_key: Optional[str] = None) -> None:
+        """Thread safe, never blocks on redis."""
+        # consumers get exactly what they got through celery's json serializer
+        event = json.loads(json.dumps(event, cls=_WireEncoder))
+
+        self._ensure_started()
+
+        with self._lock:
+            if coalesce_key is not None:
+                key = (group, coalesce_key)
+                if key in self._events:
+                    # the latest message goes where it would have been queued, after everything queued since
+                    self._events[key] = (group, event)
+                    self._events.move_to_end(key)
+                    self.coalesced += 1
+                    return
+            else:
+                key = next(self._ids)
+
+            if len(self._events) >= self.max_size:
+                self._events.popitem(last=False)
+                self.dropped += 1
+
+            self._events[key] = (group, event)
+
+        self._notify()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Publishes whatever is queued, used on process exit so short-lived workers don't lose their last events"""
+        if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+            return
+
+        if self._green:
+            self._hand_over()
+            return
+
+        future = asyncio.run_coroutine_threadsafe(self._drain(get_channel_layer()), self._loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.warning(f"Failed to flush websocket events: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._events),
+            "green": self._green,
+            "maxSize": self.max_size,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+ws_dispatcher = WebsocketEventDispatcher()
+atexit.register(ws_dispatcher.flush)
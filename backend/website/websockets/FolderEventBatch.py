@@ -0,0 +1,135 @@
+import time
+from typing import Optional, Union
+
+from website.constants import EventCode, FOLDER_EVENT_WINDOW, FOLDER_EVENT_MAX_ITEMS
+from website.core.Serializers import FileSerializer, FolderSerializer
+from website.core.crypto.signer import ResourceSigner
+from website.core.dataModels.http import RequestContext
+from website.models import File, Folder
+from website.websockets.utils import send_event
+
+
+class _PendingEvent:
+    def __init__(self, folder_context: Optional[Folder], op_code: EventCode):
+        self.folder_context = folder_context
+        self.op_code = op_code
+        # item id -> payload item (an id or a dict), None for files serialized when the event is sent
+        self.items: dict[str, Union[str, dict, None]] = {}
+
+
+class FolderEventBatch:
+    """
+    Merges the folder change events of a task into one event per (folder, op code).
+
+    Bulk operations used to send an event, and serialize a file with its own query, for every item or small group.
+    Items added here are held for FOLDER_EVENT_WINDOW and sent together, files are serialized
+    with a single values query right before sending, so events carry their state after the change.
+
+    Use it as a context manager, whatever is left is sent when the block exits, also when it raises.
+    Callers must therefore add an item only after its change went through, so an error midway
+    sends the events of what finished and nothing about what didn't.
+    """
+
+    def __init__(self, context: RequestContext, window: float = FOLDER_EVENT_WINDOW, max_items: int = FOLDER_EVENT_MAX_ITEMS):
+        self.context = context
+        self.window = window
+        self.max_items = max_items
+
+        self._pending: dict[tuple[Optional[str], int], _PendingEvent] = {}
+        self._item_count = 0
+        self._opened_at: Optional[float] = None
+
+    def __enter__(self) -> "FolderEventBatch":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        # everything pending describes finished changes (see above), clients need those even if a later one failed
+        self.flush()
+
+    def _get_pending(self, folder_context: Optional[Folder], op_code: EventCode) -> _PendingEvent:
+        key = (folder_context.id if folder_context else None, op_code.value)
+        pending = self._pending.get(key)
+        if not pending:
+            pending = _PendingEvent(folder_context, op_code)
+            self._pending[key] = pending
+
+        if self._opened_at is None:
+            self._opened_at = time.monotonic()
+
+        return pending
+
+    def _maybe_flush(self) -> None:
+        if self._item_count >= self.max_items or time.monotonic() - self._opened_at >= self.window:
+            self.flush()
+
+    def add(self, folder_context: Optional[Folder], op_code: EventCode, items: list[Union[str, dict]]) -> None:
+        """Adds ready payload items, ids or already serialized dicts"""
+        pending = self._get_pending(folder_context, op_code)
+        for item in items:
+            key = item["id"] if isinstance(item, dict) else item
+            pending.items[key] = item
+
+        self._item_count += len(items)
+        self._maybe_flush()
+
+    def add_files(self, folder_context: Optional[Folder], op_code: EventCode, file_ids: list[str]) -> None:
+        """Adds files that are serialized when the batch is sent"""
+        pending = self._get_pending(folder_context, op_code)
+        for file_id in file_ids:
+            pending.items[file_id] = None
+
+        self._item_count += len(file_ids)
+        self._maybe_flush()
+
+    def add_resources(self, op_code: EventCode, resources: list[Union[File, Folder]]) -> None:
+        """Adds files and folders under their parents"""
+        grouped_files = {}
+        parent_mapping = {}
+
+        for resource in resources:
+            parent_mapping[resource.parent_id] = resource.parent
+            if isinstance(resource, Folder):
+                self.add(resource.parent, op_code, [FolderSerializer.serialize_object(resource)])
+            else:
+                grouped_files.setdefault(resource.parent_id, []).append(resource.id)
+
+        for parent_id, file_ids in grouped_files.items():
+            self.add_files(parent_mapping[parent_id], op_code, file_ids)
+
+    def _serialize_files(self) -> dict[str, dict]:
+        file_ids = [item_id for pending in self._pending.values() for item_id, item in pending.items.items() if item is None]
+        if not file_ids:
+            return {}
+
+        file_tuples = (
+            File.objects
+            .filter(id__in=file_ids)
+            .annotate(**File.get_display_annotate())
+            .values_list(*File.DISPLAY_VALUES)
+        )
+
+        signer = ResourceSigner()
+        return {file_tuple[0]: FileSerializer.serialize_tuple(file_tuple, signer=signer) for file_tuple in file_tuples}
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+
+        file_dicts = self._serialize_files()
+
+        for pending in self._pending.values():
+            payload = []
+            for item_id, item in pending.items.items():
+                if item is None:
+                    item = file_dicts.get(item_id)
+                    # file was deleted in the meantime
+                    if not item:
+                        continue
+                payload.append(item)
+
+            if payload:
+                send_event(self.context, pending.folder_context, pending.op_code, payload)
+
+        self._pending = {}
+        self._item_count = 0
+        self._opened_at = None
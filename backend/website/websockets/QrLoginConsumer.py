@@ -1,9 +1,11 @@
+import asyncio
 import json
-import threading
 
-from website.constants import cache, QR_CODE_SESSION_EXPIRY
+from website.constants import QR_CODE_SESSION_EXPIRY
+from website.core.aioredis import cache_aget_many
 from website.services import cache_service
 from website.websockets.BaseConsumer import RateLimitedWebsocketConsumer
+from website.websockets.groups import get_qr_session_group_name
 
 
 class QrLoginConsumer(RateLimitedWebsocketConsumer):
@@ -19,58 +21,52 @@ class QrLoginConsumer(RateLimitedWebsocketConsumer):
         self.close_timer = None
         self.session_id = None
         self._closed = False
-        self._close_lock = threading.Lock()
 
     def get_group_name(self) -> str:
-        return "qrcode"
+        return get_qr_session_group_name(self.session_id)
 
-    def safe_close(self, code=4000):
-        with self._close_lock:
-            if self._closed:
-                return
-            self._closed = True
+    def _cancel_close_timer(self):
+        if self.close_timer:
+            self.close_timer.cancel()
+            self.close_timer = None
 
-            if self.close_timer:
-                self.close_timer.cancel()
-                self.close_timer = None
+    async def safe_close(self, code=4000):
+        # everything runs on one loop, no lock needed
+        if self._closed:
+            return
+        self._closed = True
 
-        self.close(code=code)
+        self._cancel_close_timer()
+        await self.close(code=code)
 
-    def on_disconnect(self, close_code):
-        with self._close_lock:
-            self._closed = True
+    async def on_disconnect(self, close_code):
+        self._closed = True
+        self._cancel_close_timer()
 
-            if self.close_timer:
-                self.close_timer.cancel()
-                self.close_timer = None
-
-    def authorize(self) -> tuple[bool, bool, str]:
+    async def authorize(self) -> tuple[bool, bool, str]:
         session_id, is_standard_protocol = self.get_token_key()
         self.session_id = session_id
 
         if session_id:
             session_key = cache_service.get_qr_session_key(session_id)
-            session_json = cache.get(session_key)
+            session_json = (await cache_aget_many([session_key])).get(session_key)
 
             if session_json:
-                self.close_timer = threading.Timer(QR_CODE_SESSION_EXPIRY + 5, lambda: self.safe_close())
-                self.close_timer.daemon = True
-                self.close_timer.start()
+                if not self.close_timer:
+                    loop = asyncio.get_running_loop()
+                    self.close_timer = loop.call_later(QR_CODE_SESSION_EXPIRY + 5, lambda: asyncio.ensure_future(self.safe_close()))
                 return True, is_standard_protocol, session_id
 
         return False, is_standard_protocol, session_id
 
-    def approve_session(self, event):
-        if event["session_id"] == self.session_id:
-            event["message"]["opcode"] = 2
-            self.send(text_data=json.dumps(event["message"]))
-            self.safe_close()
+    async def approve_session(self, event):
+        event["message"]["opcode"] = 2
+        await self.send(text_data=json.dumps(event["message"]))
+        await self.safe_close()
 
-    def pending_session(self, event):
-        if event["session_id"] == self.session_id:
-            self.send(text_data=json.dumps({"opcode": 1, "user": event["username"]}))
+    async def pending_session(self, event):
+        await self.send(text_data=json.dumps({"opcode": 1, "user": event["username"]}))
 
-    def cancel_pending_session(self, event):
-        if event["session_id"] == self.session_id:
-            self.send(text_data=json.dumps({"opcode": 3}))
-            self.safe_close()
+    async def cancel_pending_session(self, event):
+        await self.send(text_data=json.dumps({"opcode": 3}))
+        await self.safe_close()
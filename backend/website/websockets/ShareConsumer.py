@@ -1,6 +1,8 @@
 import json
 from typing import Optional
 
+from channels.db import database_sync_to_async
+
 from website.constants import ShareEventType
 from website.models import ShareableLink
 from website.services import share_service
@@ -16,40 +18,42 @@ class ShareConsumer(RateLimitedWebsocketConsumer):
         super().__init__()
         self.share = None
 
+    @database_sync_to_async
     def get_share(self, token) -> Optional[ShareableLink]:
         if not token:
             return None
 
-        qs = ShareableLink.objects.filter(token=token)
-        if not qs.exists():
-            return None
-        return qs[0]
+        return ShareableLink.objects.filter(token=token).first()
 
     def get_group_name(self) -> str:
         return "share"
 
-    def authorize(self) -> tuple[bool, bool, str]:
+    async def authorize(self) -> tuple[bool, bool, str]:
         token_key, is_standard_protocol = self.get_token_key()
 
-        share = self.get_share(token_key)
+        share = await self.get_share(token_key)
         if not share:
             return False, is_standard_protocol, token_key
 
         self.share = share
         return True, is_standard_protocol, token_key
 
-    def on_message(self, text_data, bytes_data):
+    @database_sync_to_async
+    def log_event(self, event_type: ShareEventType, **args):
+        share_service.log_event_websocket(self.scope, self.share, event_type, **args)
+
+    async def on_message(self, text_data, bytes_data):
         json_data = json.loads(text_data)
         event_type = json_data['type']
         args = json_data['args']
 
         if event_type == ShareEventType.FILE_OPEN.value:
-            share_service.log_event_websocket(self.scope, self.share, ShareEventType.FILE_OPEN, **args)
+            await self.log_event(ShareEventType.FILE_OPEN, **args)
         elif event_type == ShareEventType.MOVIE_WATCH.value:
-            share_service.log_event_websocket(self.scope, self.share, ShareEventType.MOVIE_WATCH, **args)
+            await self.log_event(ShareEventType.MOVIE_WATCH, **args)
         elif event_type == ShareEventType.MOVIE_TOGGLE.value:
-            share_service.log_event_websocket(self.scope, self.share, ShareEventType.MOVIE_TOGGLE, **args)
+            await self.log_event(ShareEventType.MOVIE_TOGGLE, **args)
         elif event_type == ShareEventType.MOVIE_SEEK.value:
-            share_service.log_event_websocket(self.scope, self.share, ShareEventType.MOVIE_SEEK, **args)
+            await self.log_event(ShareEventType.MOVIE_SEEK, **args)
         elif event_type == ShareEventType.FILE_DOWNLOAD.value:
-            share_service.log_event_websocket(self.scope, self.share, ShareEventType.FILE_DOWNLOAD, **args)
+            await self.log_event(ShareEventType.FILE_DOWNLOAD, **args)
@@ -1,10 +1,13 @@
 import json
 from typing import Optional
 
+from channels.db import database_sync_to_async
+
 from website.constants import EventCode
 from website.core.dataModels.websocket import WebsocketEvent, WebsocketLogoutEvent
 from website.models import PerDeviceToken
 from website.websockets.BaseConsumer import RateLimitedWebsocketConsumer
+from website.websockets.groups import get_user_group_name, get_device_group_name
 
 
 class UserConsumer(RateLimitedWebsocketConsumer):
@@ -18,6 +21,7 @@ class UserConsumer(RateLimitedWebsocketConsumer):
         self.user = None
         self.token = None
 
+    @database_sync_to_async
     def get_token(self, raw_token) -> Optional[PerDeviceToken]:
         if not raw_token:
             return None
@@ -26,12 +30,16 @@ class UserConsumer(RateLimitedWebsocketConsumer):
         return token
 
     def get_group_name(self) -> str:
-        return "user"
+        return get_user_group_name(self.user.id)
+
+    def get_group_names(self) -> list[str]:
+        # events are routed to either every socket of the user or to the sockets of one device
+        return [self.get_group_name(), get_device_group_name(self.user.id, self.device_id)]
 
-    def authorize(self) -> tuple[bool, bool, str]:
+    async def authorize(self) -> tuple[bool, bool, str]:
         token_key, is_standard_protocol = self.get_token_key()
 
-        token = self.get_token(token_key)
+        token = await self.get_token(token_key)
         if not token:
             return False, is_standard_protocol, token_key
 
@@ -41,20 +49,16 @@ class UserConsumer(RateLimitedWebsocketConsumer):
         self.device_id = self.token_obj.device_id
         return token.user.is_authenticated, is_standard_protocol, token_key
 
-    def send_error(self, error_code):
-        self.send_json({'is_encrypted': False, 'event': {'op_code': EventCode.WEBSOCKET_ERROR.value, 'data': [{'error_code': f"errors.{error_code}"}]}})
+    async def send_error(self, error_code):
+        await self.send_json({'is_encrypted': False, 'event': {'op_code': EventCode.WEBSOCKET_ERROR.value, 'data': [{'error_code': f"errors.{error_code}"}]}})
 
-    def on_ratelimit(self):
-        self.send_error("rate_limit_exceeded")
+    async def on_ratelimit(self):
+        await self.send_error("rate_limit_exceeded")
 
-    def send_event(self, event: WebsocketEvent):
-        if self.user.id == event['context']['user_id'] and (self.device_id == event['context'].get('device_id') or not event['context'].get('device_id')):
-            self.send(json.dumps(event['ws_payload']))
+    async def send_event(self, event: WebsocketEvent):
+        # only events addressed to this user/device reach this group
+        await self.send(json.dumps(event['ws_payload']))
 
-    def logout(self, event: WebsocketLogoutEvent):
-        if self.user.id == event['context']['user_id']:
-            if event['device_id']:  # specific connection to close
-                if self.device_id == event['device_id']:
-                    self.close()
-            else:  # close all connections
-                self.close()
+    async def logout(self, event: WebsocketLogoutEvent):
+        # sent to the device group when a single device logs out, to the user group otherwise
+        await self.close()
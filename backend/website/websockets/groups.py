@@ -0,0 +1,28 @@
+import hashlib
+from typing import Optional
+
+from website.core.dataModels.http import RequestContext
+
+
+def get_user_group_name(user_id: int) -> str:
+    """Every websocket of a user"""
+    return f"user-{user_id}"
+
+
+def get_device_group_name(user_id: int, device_id: str) -> str:
+    """Websockets of a single device. device_id comes from the client, so it's hashed into a valid group name"""
+    device_hash = hashlib.sha256(device_id.encode("utf-8")).hexdigest()[:32]
+    return f"user-{user_id}-device-{device_hash}"
+
+
+def get_context_group_name(context: RequestContext, device_id: Optional[str] = None) -> str:
+    """Group of the sockets an event for `context` is addressed to"""
+    device_id = device_id or context.device_id
+    if device_id:
+        return get_device_group_name(context.user_id, device_id)
+    return get_user_group_name(context.user_id)
+
+
+def get_qr_session_group_name(session_id: str) -> str:
+    session_hash = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+    return f"qrcode-{session_hash}"
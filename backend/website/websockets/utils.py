@@ -1,44 +1,38 @@
-from collections import defaultdict
 from typing import List, Union, Optional
 
 from ..constants import EventCode
-from ..core.Serializers import FolderSerializer, FileSerializer
 from ..core.crypto.utils import encrypt_message
 from ..core.dataModels.http import RequestContext
 from ..models import File, Folder
-from ..tasks.queueTasks import queue_ws_event
+from .EventDispatcher import ws_dispatcher
+from .groups import get_context_group_name
 
 
 def send_message(message: str, args: Optional[dict], finished: bool, context: RequestContext, isError=False):
+    # progress messages of one task replace each other while they wait to be sent
+    coalesce_key = f"message:{context.request_id}" if context.request_id else None
+
     send_event(context, None, EventCode.MESSAGE_SENT, {
         "message": message,
         "args": args,
         "isFinished": finished,
         "isError": isError,
         "task_id": context.request_id
-    })
+    }, coalesce_key=coalesce_key)
 
 def group_and_send_event(context: RequestContext, op_code: EventCode, resources: List[Union[File, Folder]]) -> None:
     """Group files by parent object and send event for each parent"""
-    grouped_files = defaultdict(list)
-    parent_mapping = {}
-
-    for resource in resources:
-        parent_mapping[resource.parent_id] = resource.parent
-        if isinstance(resource, Folder):
-            grouped_files[resource.parent.id].append(FolderSerializer.serialize_object(resource))
-        else:
-            grouped_files[resource.parent_id].append(FileSerializer.serialize_object(resource))
+    from .FolderEventBatch import FolderEventBatch
 
-    for parent_id, file_dicts in grouped_files.items():
-        parent = parent_mapping[parent_id]
-        send_event(context, parent, op_code, file_dicts)
+    with FolderEventBatch(context) as events:
+        events.add_resources(op_code, resources)
 
 
-def send_event(context: RequestContext, folder_context: Optional[Folder], op_code: EventCode, payload: Union[List, dict, str, None] = None) -> None:
+def send_event(context: RequestContext, folder_context: Optional[Folder], op_code: EventCode, payload: Union[List, dict, str, None] = None, coalesce_key: Optional[str] = None) -> None:
     """
     Sends an event to the websocket layer.
     Handles optional encryption when a folder is locked.
+    Queued events with the same coalesce_key are replaced by the latest one.
     """
     if payload and not isinstance(payload, list):
         payload = [payload]
@@ -66,13 +60,14 @@ def send_event(context: RequestContext, folder_context: Optional[Folder], op_cod
     # Attach final event object
     ws_payload['event'] = event_body
 
-    queue_ws_event.delay(
-        'user',
+    ws_dispatcher.publish(
+        get_context_group_name(context),
         {
             'type': 'send_event',
             'context': context,
             'ws_payload': ws_payload
-        }
+        },
+        coalesce_key=coalesce_key,
     )
 
 